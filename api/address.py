@@ -9,6 +9,10 @@ class Address(BaseModel):
     topic_id: int
     user_ids: set[int]
 
+    def key(self) -> str:
+        user_ids = ",".join(str(user_id) for user_id in sorted(self.user_ids))
+        return f"{self.type},{self.topic_id},{user_ids}"
+
     def name(
         self,
         *,
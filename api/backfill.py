@@ -0,0 +1,199 @@
+import asyncio
+import json
+import math
+import os
+from typing import Any, Callable
+
+from database import Database
+from message import Message
+from pydantic import BaseModel
+from request_scheduler import Priority
+from zulip import ZulipApi
+
+"""
+Backfill older history, beyond the first MESSAGE_BATCH_SIZE messages.
+
+Zulip pages through history by anchor, and each page tells us the
+anchor for the next one, so a single walk backwards is inherently
+one request at a time.  To keep several requests in flight, we cut
+the id space below our oldest message into chunks:
+
+    chunk 0: [start_id - chunk_span, start_id)
+    chunk 1: [start_id - 2 * chunk_span, start_id - chunk_span)
+    ...
+
+Each chunk is walked backwards from its upper bound independently,
+by one of MAX_IN_FLIGHT workers.  Our requests go out at BACKFILL
+priority, so ZulipApi serves interactive requests first and keeps
+us within the rate limits.  Messages below a chunk's lower
+bound belong to the next chunk, so we drop them.  A chunk is done
+once a page reaches below its lower bound (or the start of history).
+
+The chunk_span is picked from the density of the ids that we
+already have, so that a chunk is a few pages of messages.
+
+Once some chunk reaches the start of history or a message older
+than stop_timestamp, that chunk is the last one, and we stop handing
+out (or working on) chunks beyond it.
+
+After every page, we hand the new messages to on_batch (which
+typically appends them to the snapshot) and then save the
+checkpoint.  There is no await between those two steps, so the
+checkpoint never claims more than has been persisted.  If we get
+interrupted, the next run picks up each chunk from its last anchor,
+and anything that got persisted without being checkpointed gets
+filtered out as a duplicate.
+"""
+
+BATCH_SIZE = 5_000
+BATCHES_PER_CHUNK = 4
+MAX_IN_FLIGHT = 4
+
+
+class BackfillCheckpoint(BaseModel):
+    start_id: int
+    chunk_span: int
+    stop_timestamp: int
+    anchors: dict[int, int] = {}
+    done: set[int] = set()
+    last_chunk: int | None = None
+
+    @staticmethod
+    def create(
+        database: Database, *, stop_timestamp: int, batch_size: int = BATCH_SIZE
+    ) -> "BackfillCheckpoint":
+        message_table = database.message_table
+        min_id = message_table.get_min_id()
+        max_id = message_table.get_max_id()
+        assert min_id is not None and max_id is not None
+
+        ids_per_message = (max_id - min_id + 1) / len(message_table)
+        chunk_span = math.ceil(ids_per_message * batch_size * BATCHES_PER_CHUNK)
+        return BackfillCheckpoint(
+            start_id=min_id,
+            chunk_span=chunk_span,
+            stop_timestamp=stop_timestamp,
+        )
+
+    @staticmethod
+    def load(fn: str) -> "BackfillCheckpoint":
+        with open(fn, encoding="utf8") as f:
+            return BackfillCheckpoint.model_validate_json(f.read())
+
+    def save(self, fn: str) -> None:
+        tmp_fn = fn + ".tmp"
+        with open(tmp_fn, "w", encoding="utf8") as f:
+            f.write(self.model_dump_json())
+        os.replace(tmp_fn, fn)
+
+    def get_bounds(self, chunk: int) -> tuple[int, int]:
+        upper = self.start_id - chunk * self.chunk_span
+        return max(upper - self.chunk_span, 0), upper
+
+    def is_past_end(self, chunk: int) -> bool:
+        return self.last_chunk is not None and chunk > self.last_chunk
+
+    def is_complete(self) -> bool:
+        if self.last_chunk is None:
+            return False
+        return all(chunk in self.done for chunk in range(self.last_chunk + 1))
+
+    def mark_end(self, chunk: int) -> None:
+        if self.last_chunk is None or chunk < self.last_chunk:
+            self.last_chunk = chunk
+
+
+class Backfill:
+    def __init__(
+        self,
+        *,
+        zulip_api: ZulipApi,
+        database: Database,
+        checkpoint: BackfillCheckpoint,
+        checkpoint_fn: str,
+        on_batch: Callable[[list[Message]], None],
+        batch_size: int = BATCH_SIZE,
+        max_in_flight: int = MAX_IN_FLIGHT,
+    ) -> None:
+        self.zulip_api = zulip_api
+        self.database = database
+        self.checkpoint = checkpoint
+        self.checkpoint_fn = checkpoint_fn
+        self.on_batch = on_batch
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.next_chunk = 0
+        self.num_messages = 0
+
+    async def run(self) -> None:
+        workers = [self.run_worker() for _ in range(self.max_in_flight)]
+        await asyncio.gather(*workers)
+
+    async def run_worker(self) -> None:
+        while True:
+            chunk = self.claim_chunk()
+            if chunk is None:
+                return
+            await self.fetch_chunk(chunk)
+
+    def claim_chunk(self) -> int | None:
+        checkpoint = self.checkpoint
+        while self.next_chunk in checkpoint.done:
+            self.next_chunk += 1
+        chunk = self.next_chunk
+        _, upper = checkpoint.get_bounds(chunk)
+        if upper <= 0 or checkpoint.is_past_end(chunk):
+            return None
+        self.next_chunk += 1
+        return chunk
+
+    async def fetch_chunk(self, chunk: int) -> None:
+        checkpoint = self.checkpoint
+        lower, upper = checkpoint.get_bounds(chunk)
+        anchor = checkpoint.anchors.get(chunk, upper)
+
+        while not checkpoint.is_past_end(chunk):
+            params = dict(
+                anchor=anchor,
+                include_anchor=json.dumps(False),
+                num_before=self.batch_size,
+                num_after=0,
+                client_gravatar=json.dumps(False),
+                apply_markdown=json.dumps(True),
+            )
+            async with self.zulip_api.GET_json(
+                "messages", params, priority=Priority.BACKFILL
+            ) as data:
+                raw_messages = data["messages"]
+                found_oldest = data["found_oldest"] or not raw_messages
+
+            reached_stop = self.save_batch(raw_messages, lower)
+
+            if found_oldest or reached_stop:
+                checkpoint.mark_end(chunk)
+            if found_oldest or reached_stop or raw_messages[0]["id"] <= lower:
+                checkpoint.done.add(chunk)
+            else:
+                anchor = raw_messages[0]["id"]
+                checkpoint.anchors[chunk] = anchor
+            checkpoint.save(self.checkpoint_fn)
+
+            if chunk in checkpoint.done:
+                return
+
+    def save_batch(self, raw_messages: list[dict[str, Any]], lower: int) -> bool:
+        # Returns True once we reach messages older than stop_timestamp.
+        message_table = self.database.message_table
+        raw_messages = [
+            m
+            for m in raw_messages
+            if m["id"] >= lower and message_table.maybe_get_row(m["id"]) is None
+        ]
+        if not raw_messages:
+            return False
+
+        messages = self.database.populate_messages(raw_messages)
+        self.on_batch(messages)
+        self.num_messages += len(messages)
+
+        return min(m.timestamp for m in messages) < self.checkpoint.stop_timestamp
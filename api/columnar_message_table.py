@@ -0,0 +1,494 @@
+import mmap
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Callable, Sequence
+
+from address import Address
+from message import Message, MessageKey
+from message_table import IndexKey, get_index_keys, has_same_index_keys
+from topic_table import TopicTable
+
+"""
+ColumnarMessageTable is a compact alternative to MessageTable for
+when we keep a lot of history locally.
+
+A pydantic Message (plus its nested Address with its own set of
+user ids) costs on the order of a kilobyte before we even count the
+content.  Here we store id, sender_id, timestamp and topic_id in
+typed arrays, and each row just points at an interned Address, so
+every message in a given conversation shares one Address object.
+
+Rows never move once they are appended; a row's "position" is its
+index into the columns.  The (timestamp, id) order and the secondary
+indexes (same buckets as MessageTable) are arrays of positions, kept
+sorted by bisecting through the columns.
+
+Callers get MessageView objects, which are just (table, position)
+pairs that read the columns on demand.  They satisfy MessageRecord,
+so filters and the Service don't care which backend they talk to.
+"""
+
+
+class SortedPositions:
+    def __init__(self, key: Callable[[int], MessageKey]) -> None:
+        self.key = key
+        self.positions = array("q")
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def add(self, position: int) -> None:
+        positions = self.positions
+        key = self.key(position)
+        if not positions or key > self.key(positions[-1]):
+            positions.append(position)
+        else:
+            i = bisect_right(positions, key, key=self.key)
+            positions.insert(i, position)
+
+    def comes_after(self, position: int) -> bool:
+        # True if position belongs after everything we have so far
+        positions = self.positions
+        return not positions or self.key(positions[-1]) < self.key(position)
+
+    def merge(self, positions: list[int]) -> None:
+        # Bulk version of add; see SortedKeys.merge.
+        if not positions:
+            return
+        positions = sorted(positions, key=self.key)
+        if self.comes_after(positions[0]):
+            self.positions.extend(positions)
+        elif self.key(positions[-1]) < self.key(self.positions[0]):
+            self.positions[:0] = array("q", positions)
+        else:
+            merged = sorted(self.positions.tolist() + positions, key=self.key)
+            self.positions = array("q", merged)
+
+    def remove(self, position: int) -> None:
+        i = bisect_left(self.positions, self.key(position), key=self.key)
+        assert self.positions[i] == position
+        del self.positions[i]
+
+    def before(self, anchor: MessageKey, num: int) -> list[int]:
+        i = bisect_left(self.positions, anchor, key=self.key)
+        return self.positions[max(0, i - num) : i].tolist()
+
+    def after(
+        self, anchor: MessageKey, num: int, *, include_anchor: bool = False
+    ) -> list[int]:
+        if include_anchor:
+            i = bisect_left(self.positions, anchor, key=self.key)
+        else:
+            i = bisect_right(self.positions, anchor, key=self.key)
+        return self.positions[i : i + num].tolist()
+
+    def between(self, start_timestamp: int, end_timestamp: int) -> list[int]:
+        positions = self.positions
+        lo = bisect_left(positions, start_timestamp, key=lambda p: self.key(p)[0])
+        hi = bisect_right(positions, end_timestamp, key=lambda p: self.key(p)[0])
+        return positions[lo:hi].tolist()
+
+
+class ContentColumn:
+    """
+    Message content lives either in Python strings or in UTF-8 heaps
+    (for example, a memory-mapped snapshot) that we only decode when
+    somebody actually asks for a row's content.
+
+    Heap rows always come first; once we start appending strings, no
+    more heaps can be added.  Edits to heap rows go into overrides.
+    """
+
+    def __init__(self) -> None:
+        self.heap_starts: list[int] = []
+        self.heaps: list[tuple[memoryview, Sequence[int]]] = []
+        self.num_heap_rows = 0
+        self.strings: list[str] = []
+        self.overrides: dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return self.num_heap_rows + len(self.strings)
+
+    def __getitem__(self, position: int) -> str:
+        if position >= self.num_heap_rows:
+            return self.strings[position - self.num_heap_rows]
+        if position in self.overrides:
+            return self.overrides[position]
+        i = bisect_right(self.heap_starts, position) - 1
+        heap, offsets = self.heaps[i]
+        j = position - self.heap_starts[i]
+        return str(heap[offsets[j] : offsets[j + 1]], "utf-8")
+
+    def __setitem__(self, position: int, content: str) -> None:
+        if position >= self.num_heap_rows:
+            self.strings[position - self.num_heap_rows] = content
+        else:
+            self.overrides[position] = content
+
+    def append(self, content: str) -> None:
+        self.strings.append(content)
+
+    def append_heap(self, heap: memoryview, offsets: Sequence[int]) -> None:
+        assert not self.strings
+        self.heap_starts.append(self.num_heap_rows)
+        self.heaps.append((heap, offsets))
+        self.num_heap_rows += len(offsets) - 1
+
+    def copy_heaps(self) -> None:
+        # Copy the heaps out of the buffers they point into, and let go
+        # of those buffers.
+        heaps: list[tuple[memoryview, Sequence[int]]] = []
+        for heap, offsets in self.heaps:
+            heaps.append((memoryview(bytes(heap)), array("q", offsets)))
+            heap.release()
+            if isinstance(offsets, memoryview):
+                offsets.release()
+        self.heaps = heaps
+
+
+class MessageView:
+    __slots__ = ("_table", "_position")
+
+    def __init__(self, table: "ColumnarMessageTable", position: int) -> None:
+        self._table = table
+        self._position = position
+
+    def __repr__(self) -> str:
+        return f"MessageView(id={self.id})"
+
+    @property
+    def id(self) -> int:
+        return self._table.ids[self._position]
+
+    @property
+    def sender_id(self) -> int:
+        return self._table.sender_ids[self._position]
+
+    @property
+    def timestamp(self) -> int:
+        return self._table.timestamps[self._position]
+
+    @property
+    def topic_id(self) -> int:
+        return self._table.topic_ids[self._position]
+
+    @property
+    def address(self) -> Address:
+        return self._table.addresses[self._table.address_refs[self._position]]
+
+    @property
+    def content(self) -> str:
+        return self._table.contents[self._position]
+
+    def key(self) -> MessageKey:
+        return (self.timestamp, self.id)
+
+    def get_stream_id(self, topic_table: TopicTable) -> int:
+        assert self.address.type == "stream"
+        topic = topic_table.get_topic(self.topic_id)
+        return topic.stream_id
+
+    def to_message(self) -> Message:
+        return Message(
+            id=self.id,
+            sender_id=self.sender_id,
+            address=self.address.model_copy(deep=True),
+            timestamp=self.timestamp,
+            content=self.content,
+        )
+
+
+class ColumnarMessageTable:
+    def __init__(self) -> None:
+        self.ids = array("q")
+        self.sender_ids = array("q")
+        self.timestamps = array("q")
+        self.topic_ids = array("q")
+        self.address_refs = array("q")
+        self.contents = ContentColumn()
+
+        # memory maps that our content heaps point into (see snapshot.py)
+        self.mappings: list[mmap.mmap] = []
+
+        # interned addresses
+        self.addresses: list[Address] = []
+        self.address_ref_dict: dict[str, int] = {}
+
+        self._by_id = SortedPositions(self._get_id_key)
+        self._order = SortedPositions(self._get_message_key)
+        self._index: dict[IndexKey, SortedPositions] = {}
+
+    @staticmethod
+    def from_rows(rows: list[Message]) -> "ColumnarMessageTable":
+        table = ColumnarMessageTable()
+        for row in sorted(rows, key=lambda m: m.key()):
+            table.insert(row)
+        return table
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def get_row(self, id: int) -> MessageView:
+        view = self.maybe_get_row(id)
+        if view is None:
+            raise KeyError(id)
+        return view
+
+    def maybe_get_row(self, id: int) -> MessageView | None:
+        position = self._find_position(id)
+        if position is None:
+            return None
+        return MessageView(self, position)
+
+    def maybe_get_row_at_or_after(self, id: int) -> MessageView | None:
+        # the row with the smallest id >= id
+        positions = self._by_id.positions
+        i = bisect_left(positions, (id, 0), key=self._get_id_key)
+        if i == len(positions):
+            return None
+        return MessageView(self, positions[i])
+
+    def get_max_id(self) -> int | None:
+        positions = self._by_id.positions
+        if not positions:
+            return None
+        return self.ids[positions[-1]]
+
+    def get_min_id(self) -> int | None:
+        positions = self._by_id.positions
+        if not positions:
+            return None
+        return self.ids[positions[0]]
+
+    def get_rows(self) -> list[MessageView]:
+        return self._get_views(self._order.positions.tolist())
+
+    def get_indexed_rows(self, key: IndexKey) -> list[MessageView]:
+        return self._get_views(self._get_sorted_positions(key).positions.tolist())
+
+    def get_rows_before(
+        self, anchor: MessageKey, num: int, *, index_key: IndexKey | None = None
+    ) -> list[MessageView]:
+        positions = self._get_sorted_positions(index_key).before(anchor, num)
+        return self._get_views(positions)
+
+    def get_rows_after(
+        self,
+        anchor: MessageKey,
+        num: int,
+        *,
+        index_key: IndexKey | None = None,
+        include_anchor: bool = False,
+    ) -> list[MessageView]:
+        sorted_positions = self._get_sorted_positions(index_key)
+        positions = sorted_positions.after(anchor, num, include_anchor=include_anchor)
+        return self._get_views(positions)
+
+    def get_rows_between(
+        self,
+        start_timestamp: int,
+        end_timestamp: int,
+        *,
+        index_key: IndexKey | None = None,
+    ) -> list[MessageView]:
+        sorted_positions = self._get_sorted_positions(index_key)
+        positions = sorted_positions.between(start_timestamp, end_timestamp)
+        return self._get_views(positions)
+
+    def insert(self, row: Message) -> None:
+        address_ref = self._intern_address(row.address)
+        position = self._find_position(row.id)
+
+        if position is not None:
+            # Update in place; the row keeps its position.
+            reindex = not has_same_index_keys(MessageView(self, position), row)
+            if reindex:
+                self._remove_from_index(position)
+            self.sender_ids[position] = row.sender_id
+            self.timestamps[position] = row.timestamp
+            self.topic_ids[position] = row.address.topic_id
+            self.address_refs[position] = address_ref
+            self.contents[position] = row.content
+            if reindex:
+                self._add_to_index(position)
+            return
+
+        position = len(self.ids)
+        self.ids.append(row.id)
+        self.sender_ids.append(row.sender_id)
+        self.timestamps.append(row.timestamp)
+        self.topic_ids.append(row.address.topic_id)
+        self.address_refs.append(address_ref)
+        self.contents.append(row.content)
+        self._by_id.add(position)
+        self._add_to_index(position)
+
+    def delete(self, id: int) -> bool:
+        # The row's slot in the columns just becomes unreachable; the
+        # next full snapshot write leaves it out.
+        position = self._find_position(id)
+        if position is None:
+            return False
+        self._remove_from_index(position)
+        self._by_id.remove(position)
+        self.contents[position] = ""
+        return True
+
+    def insert_many(self, rows: list[Message]) -> None:
+        new_positions: list[int] = []
+        for row in {row.id: row for row in rows}.values():
+            if self._find_position(row.id) is not None:
+                self.insert(row)
+                continue
+            position = len(self.ids)
+            self.ids.append(row.id)
+            self.sender_ids.append(row.sender_id)
+            self.timestamps.append(row.timestamp)
+            self.topic_ids.append(row.address.topic_id)
+            self.address_refs.append(self._intern_address(row.address))
+            self.contents.append(row.content)
+            new_positions.append(position)
+        self._merge_into_index(new_positions)
+
+    def to_rows(self) -> list[Message]:
+        return [view.to_message() for view in self.get_rows()]
+
+    def append_segment(
+        self,
+        *,
+        ids: memoryview,
+        sender_ids: memoryview,
+        timestamps: memoryview,
+        topic_ids: memoryview,
+        address_refs: memoryview,
+        addresses: list[Address],
+        heap: memoryview,
+        content_offsets: Sequence[int],
+        index: dict[IndexKey, memoryview],
+        ids_sorted: bool,
+    ) -> None:
+        """
+        Adopt a whole block of rows at once, without going through
+        insert() for each row.  The numeric columns are raw int64
+        buffers (we memcpy them into our arrays) and the content stays
+        in the heap buffer.  The rows must be in (timestamp, id) order,
+        and each index bucket must list segment-relative positions in
+        that same order.  Messages in a segment must not already be
+        in the table.
+        """
+        base = len(self.ids)
+        num_rows = len(content_offsets) - 1
+        if num_rows == 0:
+            return
+
+        self.ids.frombytes(ids)
+        self.sender_ids.frombytes(sender_ids)
+        self.timestamps.frombytes(timestamps)
+        self.topic_ids.frombytes(topic_ids)
+
+        refs = [self._intern_address(address) for address in addresses]
+        if refs == list(range(len(refs))):
+            self.address_refs.frombytes(address_refs)
+        else:
+            self.address_refs.extend(refs[ref] for ref in address_refs.cast("q"))
+
+        self.contents.append_heap(heap, content_offsets)
+
+        # In the common case, the new rows all come after the rows we
+        # already have, so we can just extend our sorted positions.
+        # Older segments (see backfill.py) get merged in instead.
+        new_positions = range(base, base + num_rows)
+
+        if self._order.comes_after(base):
+            self._order.positions.extend(new_positions)
+        else:
+            self._order.merge(list(new_positions))
+
+        if ids_sorted and self._by_id.comes_after(base):
+            self._by_id.positions.extend(new_positions)
+        else:
+            self._by_id.merge(list(new_positions))
+
+        for key, local_positions in index.items():
+            bucket = self._index.get(key)
+            if bucket is None:
+                bucket = self._index[key] = SortedPositions(self._get_message_key)
+            positions = local_positions.cast("q")
+            if not bucket and base == 0:
+                bucket.positions.frombytes(local_positions)
+            elif bucket.comes_after(base + positions[0]):
+                bucket.positions.extend(base + p for p in positions)
+            else:
+                bucket.merge([base + p for p in positions])
+
+    def release_mappings(self) -> None:
+        """
+        Copy the content out of our memory maps and close them, so
+        that the mapped file can be truncated or replaced.
+        """
+        if not self.mappings:
+            return
+        self.contents.copy_heaps()
+        for mapping in self.mappings:
+            mapping.close()
+        self.mappings = []
+
+    def _intern_address(self, address: Address) -> int:
+        address_key = address.key()
+        address_ref = self.address_ref_dict.get(address_key)
+        if address_ref is None:
+            address_ref = len(self.addresses)
+            self.addresses.append(address.model_copy(deep=True))
+            self.address_ref_dict[address_key] = address_ref
+        return address_ref
+
+    def _get_id_key(self, position: int) -> MessageKey:
+        # SortedPositions wants tuples; ids alone are unique.
+        return (self.ids[position], 0)
+
+    def _get_message_key(self, position: int) -> MessageKey:
+        return (self.timestamps[position], self.ids[position])
+
+    def _find_position(self, id: int) -> int | None:
+        positions = self._by_id.positions
+        i = bisect_left(positions, (id, 0), key=self._get_id_key)
+        if i < len(positions) and self.ids[positions[i]] == id:
+            return positions[i]
+        return None
+
+    def _get_views(self, positions: list[int]) -> list[MessageView]:
+        return [MessageView(self, position) for position in positions]
+
+    def _get_sorted_positions(self, index_key: IndexKey | None) -> SortedPositions:
+        if index_key is None:
+            return self._order
+        return self._index.get(index_key) or SortedPositions(self._get_message_key)
+
+    def _add_to_index(self, position: int) -> None:
+        self._order.add(position)
+        for key in get_index_keys(MessageView(self, position)):
+            bucket = self._index.get(key)
+            if bucket is None:
+                bucket = self._index[key] = SortedPositions(self._get_message_key)
+            bucket.add(position)
+
+    def _merge_into_index(self, positions: list[int]) -> None:
+        self._by_id.merge(positions)
+        self._order.merge(positions)
+        bucket_positions: dict[IndexKey, list[int]] = {}
+        for position in positions:
+            for key in get_index_keys(MessageView(self, position)):
+                bucket_positions.setdefault(key, []).append(position)
+        for key, new_positions in bucket_positions.items():
+            bucket = self._index.get(key)
+            if bucket is None:
+                bucket = self._index[key] = SortedPositions(self._get_message_key)
+            bucket.merge(new_positions)
+
+    def _remove_from_index(self, position: int) -> None:
+        self._order.remove(position)
+        for key in get_index_keys(MessageView(self, position)):
+            bucket = self._index[key]
+            bucket.remove(position)
+            if not bucket:
+                del self._index[key]
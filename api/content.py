@@ -32,7 +32,7 @@ from html_element import (
     restrict_attributes,
     text_content,
 )
-from html_helpers import SafeHtml, build_tag, canonicalize_escape_text, escape_text
+from html_helpers import HtmlWriter, SafeHtml, canonicalize_escape_text
 from pydantic import BaseModel, Field
 
 """
@@ -47,23 +47,38 @@ T_Element = TypeVar("T_Element", bound=Element)
 T_ContentNode = TypeVar("T_ContentNode", bound="ContentNode")
 
 
+"""
+We check the round trip once per message, at the top (see
+build_zulip_content in message_parser.py).  Checking at every level
+of the tree instead pinpoints where a mismatch happens, but it
+serializes each subtree once per ancestor, which is quadratic for
+deeply nested messages (lists inside blockquotes, say).  Flip
+VERIFY_EVERY_LEVEL on when you're hunting down a mismatch.
+"""
+
+VERIFY_EVERY_LEVEL = False
+
+
+def check_round_trip(elem: Element, node: "ContentNode") -> None:
+    expected_html = canonicalize_escape_text(str(get_trusted_html(elem)))
+    actual_html = str(node.as_html())
+
+    if actual_html != expected_html:
+        print("\n------- as_html MISMATCH\n")
+        print(repr(expected_html))
+        print()
+        print(repr(actual_html))
+        print()
+        raise IllegalMessage("as_html does not round trip")
+
+
 def verify_round_trip(
     f: Callable[[T_Element], T_ContentNode],
 ) -> Callable[[T_Element], T_ContentNode]:
     def new_f(elem: T_Element) -> T_ContentNode:
         node = f(elem)
-
-        expected_html = canonicalize_escape_text(str(get_trusted_html(elem)))
-        actual_html = str(node.as_html())
-
-        if actual_html != expected_html:
-            print("\n------- as_html MISMATCH\n")
-            print(repr(expected_html))
-            print()
-            print(repr(actual_html))
-            print()
-            raise IllegalMessage("as_html does not round trip")
-
+        if VERIFY_EVERY_LEVEL:
+            check_round_trip(elem, node)
         return node
 
     return new_f
@@ -73,18 +88,35 @@ def verify_round_trip(
 Our ContentNode class is abstract, but we have some helper
 static methods and an as_dict method.  I hope to eventually push down
 ContentNode.get_child_nodes to subclasses.
+
+Subclasses render HTML by writing themselves (and their children)
+into an HtmlWriter; as_html runs one walk over the tree and joins
+the result once.
 """
 
 
+def write_block_children(writer: HtmlWriter, children: Sequence["ContentNode"]) -> None:
+    # Block children go on their own lines, like lxml writes them.
+    writer.write_trusted("\n")
+    for c in children:
+        c.write_html(writer)
+        writer.write_trusted("\n")
+
+
 class ContentNode(BaseModel, ABC):
     @abstractmethod
     def as_text(self) -> str:
         pass
 
     @abstractmethod
-    def as_html(self) -> SafeHtml:
+    def write_html(self, writer: HtmlWriter) -> None:
         pass
 
+    def as_html(self) -> SafeHtml:
+        writer = HtmlWriter()
+        self.write_html(writer)
+        return writer.get_html()
+
     @staticmethod
     @verify_round_trip
     def from_tag_element(elem: TagElement) -> "ContentNode":
@@ -107,7 +139,10 @@ class ContentNode(BaseModel, ABC):
 
     def as_dict(self) -> dict[str, object]:
         dct: dict[str, object] = dict(type=self.__class__.__name__)
-        for field_name, value in self.model_dump().items():
+        # The children get dumped by their own as_dict, so don't
+        # serialize them here too.
+        dumped = self.model_dump(exclude={"children"})
+        for field_name in type(self).model_fields:
             if field_name == "children":
                 # play nice with mypy
                 assert hasattr(self, "children")
@@ -117,7 +152,7 @@ class ContentNode(BaseModel, ABC):
                     arr.append(c.as_dict())
                 dct["children"] = arr
             else:
-                dct[field_name] = value
+                dct[field_name] = dumped[field_name]
         return dct
 
 
@@ -248,9 +283,11 @@ class ZulipContent(ContentNode):
     def as_text(self) -> str:
         return " ".join(c.as_text() for c in self.children)
 
-    def as_html(self) -> SafeHtml:
-        inner = SafeHtml.combine([c.as_html() for c in self.children])
-        return build_tag(tag="body", inner=inner)
+    def write_html(self, writer: HtmlWriter) -> None:
+        start = writer.start_tag("body")
+        for c in self.children:
+            c.write_html(writer)
+        writer.end_tag("body", start)
 
     @staticmethod
     @verify_round_trip
@@ -331,8 +368,8 @@ class TextNode(InlineContentNode):
     def as_text(self) -> str:
         return self.value
 
-    def as_html(self) -> SafeHtml:
-        return escape_text(self.value)
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.write_text(self.value)
 
     @staticmethod
     def from_text_element(elem: TextElement) -> "TextNode":
@@ -350,8 +387,8 @@ class BlockWhiteSpaceNode(BlockContentNode):
     def as_text(self) -> str:
         return self.value
 
-    def as_html(self) -> SafeHtml:
-        return escape_text(self.value)
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.write_text(self.value)
 
     @staticmethod
     def from_text_element(elem: TextElement) -> "BlockWhiteSpaceNode":
@@ -369,8 +406,8 @@ class LineBreakInlineNode(InlineContentNode):
     def as_text(self) -> str:
         return "\n"
 
-    def as_html(self) -> SafeHtml:
-        return SafeHtml.trust("<br/>")
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.write_trusted("<br/>")
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "LineBreakInlineNode":
@@ -383,8 +420,8 @@ class LineBreakBlockNode(BlockContentNode):
     def as_text(self) -> str:
         return "\n"
 
-    def as_html(self) -> SafeHtml:
-        return SafeHtml.trust("<br/>")
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.write_trusted("<br/>")
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "LineBreakBlockNode":
@@ -397,8 +434,8 @@ class ThematicBreakNode(BlockContentNode):
     def as_text(self) -> str:
         return "\n\n---\n\n"
 
-    def as_html(self) -> SafeHtml:
-        return SafeHtml.trust("<hr/>")
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.write_trusted("<hr/>")
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "ThematicBreakNode":
@@ -431,13 +468,18 @@ class ContainerNode(ContentNode, ABC):
     def as_text(self) -> str:
         return self.children_text()
 
-    def tag(self, tag: str, **attrs: str | None) -> SafeHtml:
-        inner = SafeHtml.combine([c.as_html() for c in self.children])
-        return build_tag(tag=tag, inner=inner, **attrs)
+    def write_tag(self, writer: HtmlWriter, tag: str, **attrs: str | None) -> None:
+        start = writer.start_tag(tag, **attrs)
+        for c in self.children:
+            c.write_html(writer)
+        writer.end_tag(tag, start)
 
-    def block_tag(self, tag: str, **attrs: str | None) -> SafeHtml:
-        inner = SafeHtml.block_join([c.as_html() for c in self.children])
-        return build_tag(tag=tag, inner=inner, **attrs)
+    def write_block_tag(
+        self, writer: HtmlWriter, tag: str, **attrs: str | None
+    ) -> None:
+        start = writer.start_tag(tag, **attrs)
+        write_block_children(writer, self.children)
+        writer.end_tag(tag, start)
 
 
 class BlockInlineContainerNode(BlockContentNode, ABC):
@@ -449,9 +491,11 @@ class BlockInlineContainerNode(BlockContentNode, ABC):
     def as_text(self) -> str:
         return self.children_text()
 
-    def tag(self, tag: str, **attrs: str | None) -> SafeHtml:
-        inner = SafeHtml.combine([c.as_html() for c in self.children])
-        return build_tag(tag=tag, inner=inner, **attrs)
+    def write_tag(self, writer: HtmlWriter, tag: str, **attrs: str | None) -> None:
+        start = writer.start_tag(tag, **attrs)
+        for c in self.children:
+            c.write_html(writer)
+        writer.end_tag(tag, start)
 
 
 """
@@ -478,8 +522,8 @@ class HeadingNode(BlockInlineContainerNode):
     def as_text(self) -> str:
         return f"{'#' * self.depth} {self.children_text()}\n\n"
 
-    def as_html(self) -> SafeHtml:
-        return self.tag(f"h{self.depth}")
+    def write_html(self, writer: HtmlWriter) -> None:
+        self.write_tag(writer, f"h{self.depth}")
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "HeadingNode":
@@ -557,8 +601,8 @@ class DeleteNode(TextFormattingNode):
     def as_text(self) -> str:
         return f"~~{self.children_text()}~~"
 
-    def as_html(self) -> SafeHtml:
-        return self.tag("del")
+    def write_html(self, writer: HtmlWriter) -> None:
+        self.write_tag(writer, "del")
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "DeleteNode":
@@ -570,8 +614,8 @@ class EmphasisNode(TextFormattingNode):
     def as_text(self) -> str:
         return f"*{self.children_text()}*"
 
-    def as_html(self) -> SafeHtml:
-        return self.tag("em")
+    def write_html(self, writer: HtmlWriter) -> None:
+        self.write_tag(writer, "em")
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "EmphasisNode":
@@ -583,8 +627,8 @@ class StrongNode(TextFormattingNode):
     def as_text(self) -> str:
         return f"**{self.children_text()}**"
 
-    def as_html(self) -> SafeHtml:
-        return self.tag("strong")
+    def write_html(self, writer: HtmlWriter) -> None:
+        self.write_tag(writer, "strong")
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "StrongNode":
@@ -606,8 +650,8 @@ class QuotationNode(BlockContentNode, ContainerNode):
         content = self.children_text()
         return f"\n-----\n{content}\n-----\n"
 
-    def as_html(self) -> SafeHtml:
-        return self.tag("blockquote")
+    def write_html(self, writer: HtmlWriter) -> None:
+        self.write_tag(writer, "blockquote")
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "QuotationNode":
@@ -625,8 +669,8 @@ class CodeNode(InlineContentNode, ContainerNode):
     def as_text(self) -> str:
         return f"`{self.children_text()}`"
 
-    def as_html(self) -> SafeHtml:
-        return self.tag("code")
+    def write_html(self, writer: HtmlWriter) -> None:
+        self.write_tag(writer, "code")
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "CodeNode":
@@ -638,8 +682,8 @@ class ParagraphNode(BlockInlineContainerNode):
     def as_text(self) -> str:
         return self.children_text() + "\n\n"
 
-    def as_html(self) -> SafeHtml:
-        return self.tag("p")
+    def write_html(self, writer: HtmlWriter) -> None:
+        self.write_tag(writer, "p")
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "ParagraphNode":
@@ -701,8 +745,8 @@ class AnchorNode(LinkNode, ContainerNode):
         content = "".join(c.as_text() for c in self.children)
         return f"[{content}] ({self.href})"
 
-    def as_html(self) -> SafeHtml:
-        return self.tag("a", href=self.href)
+    def write_html(self, writer: HtmlWriter) -> None:
+        self.write_tag(writer, "a", href=self.href)
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "AnchorNode":
@@ -724,9 +768,8 @@ class MessageLinkNode(LinkNode, ContainerNode):
     def zulip_class() -> str:
         return "message-link"
 
-    def as_html(self) -> SafeHtml:
-        href = self.href
-        return self.tag("a", class_=self.zulip_class(), href=href)
+    def write_html(self, writer: HtmlWriter) -> None:
+        self.write_tag(writer, "a", class_=self.zulip_class(), href=self.href)
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "MessageLinkNode":
@@ -752,8 +795,9 @@ class StreamLinkNode(LinkNode, ContainerNode):
     def zulip_class() -> str:
         return "stream"
 
-    def as_html(self) -> SafeHtml:
-        return self.tag(
+    def write_html(self, writer: HtmlWriter) -> None:
+        self.write_tag(
+            writer,
             "a",
             class_=self.zulip_class(),
             data_stream_id=str(self.stream_id),
@@ -782,8 +826,9 @@ class StreamTopicLinkNode(LinkNode, ContainerNode):
     def zulip_class() -> str:
         return "stream-topic"
 
-    def as_html(self) -> SafeHtml:
-        return self.tag(
+    def write_html(self, writer: HtmlWriter) -> None:
+        self.write_tag(
+            writer,
             "a",
             class_=self.zulip_class(),
             data_stream_id=str(self.stream_id),
@@ -822,10 +867,9 @@ class EmojiImageNode(LinkNode):
     def zulip_class() -> str:
         return "emoji"
 
-    def as_html(self) -> SafeHtml:
-        return build_tag(
-            tag="img",
-            inner=SafeHtml.trust(""),
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.empty_tag(
+            "img",
             alt=f":{self.title.replace(' ', '_')}:",
             class_=self.zulip_class(),
             src=self.src,
@@ -855,11 +899,11 @@ class EmojiSpanNode(SpanNode):
         unicode_suffix = "-".join(f"{num:04x}" for num in self.unicode_points)
         return f"emoji emoji-{unicode_suffix}"
 
-    def as_html(self) -> SafeHtml:
+    def write_html(self, writer: HtmlWriter) -> None:
         title = self.title
-        return build_tag(
-            tag="span",
-            inner=escape_text(f":{title.replace(' ', '_')}:"),
+        writer.text_tag(
+            "span",
+            f":{title.replace(' ', '_')}:",
             aria_label=title,
             class_=self.zulip_class(),
             role="img",
@@ -911,12 +955,14 @@ class ListItemNode(ContentNode):
     def as_text(self) -> str:
         return self.children_text()
 
-    def tag(self, tag: str, **attrs: str | None) -> SafeHtml:
-        inner = SafeHtml.combine([c.as_html() for c in self.children])
-        return build_tag(tag=tag, inner=inner, **attrs)
+    def write_tag(self, writer: HtmlWriter, tag: str, **attrs: str | None) -> None:
+        start = writer.start_tag(tag, **attrs)
+        for c in self.children:
+            c.write_html(writer)
+        writer.end_tag(tag, start)
 
-    def as_html(self) -> SafeHtml:
-        return self.tag("li")
+    def write_html(self, writer: HtmlWriter) -> None:
+        self.write_tag(writer, "li")
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "ListItemNode":
@@ -959,14 +1005,11 @@ class OrderedListNode(ListNode):
             for i, c in enumerate(self.children)
         )
 
-    def as_html(self) -> SafeHtml:
+    def write_html(self, writer: HtmlWriter) -> None:
         start_attr: str | None = str(self.start) if self.start else None
-        list_items = SafeHtml.block_join([c.as_html() for c in self.children])
-        return build_tag(
-            tag="ol",
-            inner=list_items,
-            start=start_attr,
-        )
+        start = writer.start_tag("ol", start=start_attr)
+        write_block_children(writer, self.children)
+        writer.end_tag("ol", start)
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "OrderedListNode":
@@ -980,12 +1023,10 @@ class UnorderedListNode(ListNode):
     def as_text(self) -> str:
         return "".join("\n    - " + c.as_text() for c in self.children)
 
-    def as_html(self) -> SafeHtml:
-        list_items = SafeHtml.block_join([c.as_html() for c in self.children])
-        return build_tag(
-            tag="ul",
-            inner=list_items,
-        )
+    def write_html(self, writer: HtmlWriter) -> None:
+        start = writer.start_tag("ul")
+        write_block_children(writer, self.children)
+        writer.end_tag("ul", start)
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "UnorderedListNode":
@@ -1032,9 +1073,9 @@ class ThNode(BlockInlineContainerNode):
     def as_text(self) -> str:
         return f"    TH: {self.children_text()} ({self.text_align.value})\n"
 
-    def as_html(self) -> SafeHtml:
+    def write_html(self, writer: HtmlWriter) -> None:
         style = self.text_align.as_style()
-        return self.tag("th", style=style)
+        self.write_tag(writer, "th", style=style)
 
     @staticmethod
     def from_tag_element(th: TagElement) -> "ThNode":
@@ -1050,9 +1091,9 @@ class TdNode(BlockInlineContainerNode):
     def as_text(self) -> str:
         return f"    TD: {self.children_text()} ({self.text_align.value})\n"
 
-    def as_html(self) -> SafeHtml:
+    def write_html(self, writer: HtmlWriter) -> None:
         style = self.text_align.as_style()
-        return self.tag("td", style=style)
+        self.write_tag(writer, "td", style=style)
 
     @staticmethod
     def from_tag_element(td: TagElement) -> "TdNode":
@@ -1072,9 +1113,10 @@ class TrNode(ContentNode):
         s += "\n"
         return s
 
-    def as_html(self) -> SafeHtml:
-        inner = SafeHtml.block_join([td.as_html() for td in self.tds])
-        return build_tag(tag="tr", inner=inner)
+    def write_html(self, writer: HtmlWriter) -> None:
+        start = writer.start_tag("tr")
+        write_block_children(writer, self.tds)
+        writer.end_tag("tr", start)
 
     @staticmethod
     def from_tag_element(tr: TagElement) -> "TrNode":
@@ -1090,9 +1132,10 @@ class TBodyNode(ContentNode):
         tr_text = "".join(tr.as_text() for tr in self.trs)
         return f"\n-----------\n{tr_text}"
 
-    def as_html(self) -> SafeHtml:
-        inner = SafeHtml.block_join([tr.as_html() for tr in self.trs])
-        return build_tag(tag="tbody", inner=inner)
+    def write_html(self, writer: HtmlWriter) -> None:
+        start = writer.start_tag("tbody")
+        write_block_children(writer, self.trs)
+        writer.end_tag("tbody", start)
 
     @staticmethod
     def from_tag_element(tbody: TagElement) -> "TBodyNode":
@@ -1108,10 +1151,14 @@ class THeadNode(ContentNode):
         th_text = "".join(th.as_text() for th in self.ths)
         return f"\n-----------\n{th_text}"
 
-    def as_html(self) -> SafeHtml:
-        ths = SafeHtml.block_join([th.as_html() for th in self.ths])
-        tr = build_tag(tag="tr", inner=ths)
-        return build_tag(tag="thead", inner=SafeHtml.block_join([tr]))
+    def write_html(self, writer: HtmlWriter) -> None:
+        thead_start = writer.start_tag("thead")
+        writer.write_trusted("\n")
+        tr_start = writer.start_tag("tr")
+        write_block_children(writer, self.ths)
+        writer.end_tag("tr", tr_start)
+        writer.write_trusted("\n")
+        writer.end_tag("thead", thead_start)
 
     @staticmethod
     def from_tag_element(thead: TagElement) -> "THeadNode":
@@ -1128,11 +1175,10 @@ class TableNode(BlockContentNode):
     def as_text(self) -> str:
         return self.thead.as_text() + "\n" + self.tbody.as_text()
 
-    def as_html(self) -> SafeHtml:
-        thead = self.thead.as_html()
-        tbody = self.tbody.as_html()
-        inner = SafeHtml.block_join([thead, tbody])
-        return build_tag(tag="table", inner=inner)
+    def write_html(self, writer: HtmlWriter) -> None:
+        start = writer.start_tag("table")
+        write_block_children(writer, [self.thead, self.tbody])
+        writer.end_tag("table", start)
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "TableNode":
@@ -1161,12 +1207,12 @@ class SpoilerContentNode(ContainerNode):
     def zulip_class() -> str:
         return "spoiler-content"
 
-    def as_html(self) -> SafeHtml:
+    def write_html(self, writer: HtmlWriter) -> None:
         class_ = self.zulip_class()
         if self.aria_attribute_comes_first:
-            return self.tag("div", aria_hidden="true", class_=class_)
+            self.write_tag(writer, "div", aria_hidden="true", class_=class_)
         else:
-            return self.tag("div", class_=class_, aria_hidden="true")
+            self.write_tag(writer, "div", class_=class_, aria_hidden="true")
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "SpoilerContentNode":
@@ -1185,8 +1231,8 @@ class SpoilerHeaderNode(ContainerNode):
     def zulip_class() -> str:
         return "spoiler-header"
 
-    def as_html(self) -> SafeHtml:
-        return self.tag("div", class_=self.zulip_class())
+    def write_html(self, writer: HtmlWriter) -> None:
+        self.write_tag(writer, "div", class_=self.zulip_class())
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "SpoilerHeaderNode":
@@ -1209,14 +1255,11 @@ class SpoilerNode(DivNode):
     def zulip_class() -> str:
         return "spoiler-block"
 
-    def as_html(self) -> SafeHtml:
-        header = self.header.as_html()
-        content = self.content.as_html()
-        return build_tag(
-            tag="div",
-            inner=SafeHtml.combine([header, content]),
-            class_=self.zulip_class(),
-        )
+    def write_html(self, writer: HtmlWriter) -> None:
+        start = writer.start_tag("div", class_=self.zulip_class())
+        self.header.write_html(writer)
+        self.content.write_html(writer)
+        writer.end_tag("div", start)
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "SpoilerNode":
@@ -1242,10 +1285,9 @@ class InlineImageChildImgNode(ContentNode):
     def as_text(self) -> str:
         return f"(img {self.src})"
 
-    def as_html(self) -> SafeHtml:
-        return build_tag(
-            tag="img",
-            inner=SafeHtml.trust(""),
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.empty_tag(
+            "img",
             data_animated="true" if self.animated else None,
             data_original_content_type=self.original_content_type,
             data_original_dimensions=self.original_dimensions,
@@ -1286,18 +1328,12 @@ class InlineImageNode(DivNode):
     def zulip_class() -> str:
         return "message_inline_image"
 
-    def as_html(self) -> SafeHtml:
-        anchor = build_tag(
-            tag="a",
-            inner=self.img.as_html(),
-            href=self.href,
-            title=self.title,
-        )
-        return build_tag(
-            tag="div",
-            inner=anchor,
-            class_=self.zulip_class(),
-        )
+    def write_html(self, writer: HtmlWriter) -> None:
+        div_start = writer.start_tag("div", class_=self.zulip_class())
+        a_start = writer.start_tag("a", href=self.href, title=self.title)
+        self.img.write_html(writer)
+        writer.end_tag("a", a_start)
+        writer.end_tag("div", div_start)
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "InlineImageNode":
@@ -1328,20 +1364,12 @@ class InlineVideoNode(DivNode):
     def zulip_class() -> str:
         return "message_inline_image message_inline_video"
 
-    def as_html(self) -> SafeHtml:
-        video = build_tag(
-            tag="video",
-            inner=SafeHtml.trust(""),
-            preload="metadata",
-            src=self.src,
-        )
-        anchor = build_tag(
-            tag="a",
-            inner=video,
-            href=self.href,
-            title=self.title,
-        )
-        return build_tag(tag="div", inner=anchor, class_=self.zulip_class())
+    def write_html(self, writer: HtmlWriter) -> None:
+        div_start = writer.start_tag("div", class_=self.zulip_class())
+        a_start = writer.start_tag("a", href=self.href, title=self.title)
+        writer.empty_tag("video", preload="metadata", src=self.src)
+        writer.end_tag("a", a_start)
+        writer.end_tag("div", div_start)
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "InlineVideoNode":
@@ -1377,10 +1405,9 @@ class AudioNode(InlineContentNode):
     def as_text(self) -> str:
         return f"AUDIO: {self.src}"
 
-    def as_html(self) -> SafeHtml:
-        return build_tag(
-            tag="audio",
-            inner=SafeHtml.trust(""),
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.empty_tag(
+            "audio",
             controls="",
             data_original_url=self.original_url,
             preload="metadata",
@@ -1476,10 +1503,10 @@ class ChannelWildcardMentionNode(LoudMentionNode):
     def zulip_class() -> str:
         return "user-mention channel-wildcard-mention"
 
-    def as_html(self) -> SafeHtml:
-        return build_tag(
-            tag="span",
-            inner=escape_text(self.name),
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.text_tag(
+            "span",
+            self.name,
             class_=self.zulip_class(),
             data_user_id="*",
         )
@@ -1511,10 +1538,10 @@ class ChannelWildcardMentionSilentNode(SilentMentionNode):
     def zulip_class() -> str:
         return "user-mention channel-wildcard-mention silent"
 
-    def as_html(self) -> SafeHtml:
-        return build_tag(
-            tag="span",
-            inner=escape_text(self.name),
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.text_tag(
+            "span",
+            self.name,
             class_=self.zulip_class(),
             data_user_id="*",
         )
@@ -1546,10 +1573,10 @@ class TopicMentionNode(LoudMentionNode):
     def zulip_class() -> str:
         return "topic-mention"
 
-    def as_html(self) -> SafeHtml:
-        return build_tag(
-            tag="span",
-            inner=escape_text("@topic"),
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.text_tag(
+            "span",
+            "@topic",
             class_=self.zulip_class(),
         )
 
@@ -1571,10 +1598,10 @@ class TopicMentionSilentNode(SilentMentionNode):
     def zulip_class() -> str:
         return "topic-mention silent"
 
-    def as_html(self) -> SafeHtml:
-        return build_tag(
-            tag="span",
-            inner=escape_text("topic"),
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.text_tag(
+            "span",
+            "topic",
             class_=self.zulip_class(),
         )
 
@@ -1599,10 +1626,10 @@ class UserGroupMentionNode(LoudMentionNode):
     def zulip_class() -> str:
         return "user-group-mention"
 
-    def as_html(self) -> SafeHtml:
-        return build_tag(
-            tag="span",
-            inner=escape_text(self.name),
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.text_tag(
+            "span",
+            self.name,
             class_=self.zulip_class(),
             data_user_group_id=str(self.group_id),
         )
@@ -1627,10 +1654,10 @@ class UserGroupMentionSilentNode(SilentMentionNode):
     def zulip_class() -> str:
         return "user-group-mention silent"
 
-    def as_html(self) -> SafeHtml:
-        return build_tag(
-            tag="span",
-            inner=escape_text(self.name),
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.text_tag(
+            "span",
+            self.name,
             class_=self.zulip_class(),
             data_user_group_id=str(self.group_id),
         )
@@ -1655,10 +1682,10 @@ class UserMentionNode(LoudMentionNode):
     def zulip_class() -> str:
         return "user-mention"
 
-    def as_html(self) -> SafeHtml:
-        return build_tag(
-            tag="span",
-            inner=escape_text(self.name),
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.text_tag(
+            "span",
+            self.name,
             class_=self.zulip_class(),
             data_user_id=str(self.user_id),
         )
@@ -1683,10 +1710,10 @@ class UserMentionSilentNode(SilentMentionNode):
     def zulip_class() -> str:
         return "user-mention silent"
 
-    def as_html(self) -> SafeHtml:
-        return build_tag(
-            tag="span",
-            inner=escape_text(self.name),
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.text_tag(
+            "span",
+            self.name,
             class_=self.zulip_class(),
             data_user_id=str(self.user_id),
         )
@@ -1718,10 +1745,10 @@ class TimeWidgetNode(InlineContentNode):
     def as_text(self) -> str:
         return self.text
 
-    def as_html(self) -> SafeHtml:
-        return build_tag(
-            tag="time",
-            inner=escape_text(self.text),
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.text_tag(
+            "time",
+            self.text,
             datetime=self.datetime,
         )
 
@@ -1747,8 +1774,8 @@ class KatexNode(SpanNode):
     def as_text(self) -> str:
         return f"<<<some katex html (not shown) with {self.tag_class} class>>>"
 
-    def as_html(self) -> SafeHtml:
-        return self.html
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.write(self.html)
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "KatexNode":
@@ -1766,8 +1793,8 @@ class PygmentsCodeBlockNode(DivNode):
     def as_text(self) -> str:
         return f"\n~~~~~~~~ lang: {self.lang}\n{self.content}~~~~~~~~\n"
 
-    def as_html(self) -> SafeHtml:
-        return self.html
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.write(self.html)
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "PygmentsCodeBlockNode":
@@ -1791,10 +1818,10 @@ class ParseErrorNode(SpanNode, ABC):
     def zulip_class(self) -> str:
         pass
 
-    def as_html(self) -> SafeHtml:
-        return build_tag(
-            tag="span",
-            inner=escape_text(self.text),
+    def write_html(self, writer: HtmlWriter) -> None:
+        writer.text_tag(
+            "span",
+            self.text,
             class_=self.zulip_class(),
         )
 
@@ -1854,41 +1881,22 @@ class WebsitePreviewNode(DivNode):
     def as_text(self) -> str:
         return f"WEB PREVIEW {self.href} {self.title}"
 
-    def as_html(self) -> SafeHtml:
-        image_a = build_tag(
-            tag="a",
-            inner=SafeHtml.trust(""),
+    def write_html(self, writer: HtmlWriter) -> None:
+        embed_start = writer.start_tag("div", class_="message_embed")
+        writer.empty_tag(
+            "a",
             class_="message_embed_image",
             href=self.href,
             style=f"background-image: {self.background_url}",
         )
-        title_a = build_tag(
-            tag="a",
-            inner=escape_text(self.title),
-            href=self.title_href,
-            title=self.title,
-        )
-        embed_title = build_tag(
-            tag="div",
-            inner=title_a,
-            class_="message_embed_title",
-        )
-        embed_description = build_tag(
-            tag="div",
-            class_="message_embed_description",
-            inner=escape_text(self.description),
-        )
 
-        data_container = build_tag(
-            tag="div",
-            inner=SafeHtml.combine([embed_title, embed_description]),
-            class_="data-container",
-        )
-        return build_tag(
-            tag="div",
-            inner=SafeHtml.combine([image_a, data_container]),
-            class_="message_embed",
-        )
+        container_start = writer.start_tag("div", class_="data-container")
+        title_start = writer.start_tag("div", class_="message_embed_title")
+        writer.text_tag("a", self.title, href=self.title_href, title=self.title)
+        writer.end_tag("div", title_start)
+        writer.text_tag("div", self.description, class_="message_embed_description")
+        writer.end_tag("div", container_start)
+        writer.end_tag("div", embed_start)
 
     @staticmethod
     def from_tag_element(elem: TagElement) -> "WebsitePreviewNode":
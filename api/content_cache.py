@@ -0,0 +1,199 @@
+import hashlib
+import os
+import struct
+from collections import OrderedDict
+
+"""
+ContentCache remembers the parsed text of messages, so that
+re-opening a narrow (or restarting the app) doesn't run every
+message back through lxml and the ZulipContent parser.
+
+Entries are keyed by message id, and each one carries a hash of the
+content that it was parsed from.  When a message gets edited, its
+content (and hence its hash) changes, so the stale entry just stops
+matching; we never have to hear about the edit.
+
+There are two tiers:
+
+    - An LRU of up to max_size entries in memory.
+    - Optionally, an append-only file on disk.  We keep a dict of
+      message id -> offset for it in memory, and read the text back
+      on demand.  A record that is newer than another for the same
+      message wins, and a truncated record at the end (say, we died
+      mid-write) gets cut off, the same as for snapshots.
+
+Disk layout (little-endian):
+
+    MAGIC, parser_version (int64), then records of:
+
+    message_id (int64), content_hash (uint64), text_len (int64), text (UTF-8)
+
+When more than half of the records on disk are stale, we rewrite
+the file on open.  The content hash can't tell us that the parser
+changed, so bump PARSER_VERSION whenever the parsed text would come
+out differently; a file from another version gets thrown away.
+"""
+
+CONTENT_CACHE_SIZE = 5_000
+MAGIC = b"ZULIPTXT"
+PARSER_VERSION = 1
+FILE_HEADER = struct.Struct("<8sq")
+RECORD_HEADER = struct.Struct("<qQq")
+
+
+def get_content_hash(content: str) -> int:
+    digest = hashlib.blake2b(content.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class ContentCache:
+    def __init__(
+        self,
+        *,
+        max_size: int = CONTENT_CACHE_SIZE,
+        fn: str | None = None,
+        parser_version: int = PARSER_VERSION,
+    ) -> None:
+        self.max_size = max_size
+        self.fn = fn
+        self.parser_version = parser_version
+        self.entries: OrderedDict[int, tuple[int, str]] = OrderedDict()
+        self.disk_offsets: dict[int, int] = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+        if fn is not None:
+            num_records = self.load_disk_offsets(fn)
+            if num_records > 2 * len(self.disk_offsets):
+                self.compact()
+            self.file = open(fn, "a+b")
+            if self.file.tell() == 0:
+                self.file.write(FILE_HEADER.pack(MAGIC, parser_version))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, message_id: int, content: str) -> str | None:
+        content_hash = get_content_hash(content)
+
+        entry = self.entries.get(message_id)
+        if entry is not None:
+            if entry[0] == content_hash:
+                self.entries.move_to_end(message_id)
+                self.hits += 1
+                return entry[1]
+            del self.entries[message_id]
+            self.invalidations += 1
+
+        if message_id in self.disk_offsets:
+            record = self.read_record(self.disk_offsets[message_id])
+            if record[0] == content_hash:
+                self.put_in_memory(message_id, content_hash, record[1])
+                self.disk_hits += 1
+                return record[1]
+
+        self.misses += 1
+        return None
+
+    def put(self, message_id: int, content: str, text: str) -> None:
+        content_hash = get_content_hash(content)
+        self.put_in_memory(message_id, content_hash, text)
+        if self.fn is not None:
+            self.disk_offsets[message_id] = self.write_record(
+                message_id, content_hash, text
+            )
+
+    def put_in_memory(self, message_id: int, content_hash: int, text: str) -> None:
+        self.entries[message_id] = (content_hash, text)
+        self.entries.move_to_end(message_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def flush(self) -> None:
+        if self.fn is not None:
+            self.file.flush()
+
+    def close(self) -> None:
+        if self.fn is not None:
+            self.file.close()
+
+    def get_stats(self) -> dict[str, int]:
+        return dict(
+            size=len(self.entries),
+            disk_size=len(self.disk_offsets),
+            hits=self.hits,
+            disk_hits=self.disk_hits,
+            misses=self.misses,
+            invalidations=self.invalidations,
+            evictions=self.evictions,
+        )
+
+    def write_record(self, message_id: int, content_hash: int, text: str) -> int:
+        data = text.encode()
+        self.file.seek(0, os.SEEK_END)
+        offset = self.file.tell()
+        self.file.write(RECORD_HEADER.pack(message_id, content_hash, len(data)))
+        self.file.write(data)
+        return offset
+
+    def read_record(self, offset: int) -> tuple[int, str]:
+        self.file.seek(offset)
+        _, content_hash, text_len = RECORD_HEADER.unpack(
+            self.file.read(RECORD_HEADER.size)
+        )
+        return content_hash, self.file.read(text_len).decode()
+
+    def load_disk_offsets(self, fn: str) -> int:
+        # Returns the number of records on disk, stale ones included.
+        if not os.path.exists(fn):
+            return 0
+
+        with open(fn, "rb") as f:
+            buf = f.read()
+        if len(buf) < FILE_HEADER.size or buf[: len(MAGIC)] != MAGIC:
+            print(f"ignoring content cache {fn} (bad header)")
+            os.remove(fn)
+            return 0
+        _, parser_version = FILE_HEADER.unpack_from(buf)
+        if parser_version != self.parser_version:
+            print(f"ignoring content cache {fn} (parser version {parser_version})")
+            os.remove(fn)
+            return 0
+
+        offset = FILE_HEADER.size
+        num_records = 0
+        while offset + RECORD_HEADER.size <= len(buf):
+            message_id, _, text_len = RECORD_HEADER.unpack_from(buf, offset)
+            end = offset + RECORD_HEADER.size + text_len
+            if end > len(buf):
+                break
+            self.disk_offsets[message_id] = offset
+            num_records += 1
+            offset = end
+
+        if offset < len(buf):
+            print(f"ignoring truncated record at end of {fn}")
+            with open(fn, "r+b") as f:
+                f.truncate(offset)
+        return num_records
+
+    def compact(self) -> None:
+        # Rewrite the file with only the newest record per message.
+        assert self.fn is not None
+        tmp_fn = self.fn + ".tmp"
+        new_offsets = {}
+        with open(self.fn, "rb") as src, open(tmp_fn, "wb") as dst:
+            dst.write(FILE_HEADER.pack(MAGIC, self.parser_version))
+            for message_id, offset in self.disk_offsets.items():
+                src.seek(offset)
+                header = src.read(RECORD_HEADER.size)
+                _, _, text_len = RECORD_HEADER.unpack(header)
+                new_offsets[message_id] = dst.tell()
+                dst.write(header)
+                dst.write(src.read(text_len))
+        os.replace(tmp_fn, self.fn)
+        self.disk_offsets = new_offsets
@@ -0,0 +1,354 @@
+import types
+import typing
+from collections.abc import Sequence
+from typing import Any
+
+from content import (
+    AnchorNode,
+    AudioNode,
+    BlockWhiteSpaceNode,
+    ChannelWildcardMentionNode,
+    ChannelWildcardMentionSilentNode,
+    CodeNode,
+    DeleteNode,
+    EmojiImageNode,
+    EmojiSpanNode,
+    EmphasisNode,
+    HeadingNode,
+    InlineImageChildImgNode,
+    InlineImageNode,
+    InlineVideoNode,
+    KatexNode,
+    LineBreakBlockNode,
+    LineBreakInlineNode,
+    ListItemNode,
+    MessageLinkNode,
+    OrderedListNode,
+    ParagraphNode,
+    PygmentsCodeBlockNode,
+    QuotationNode,
+    SpoilerContentNode,
+    SpoilerHeaderNode,
+    SpoilerNode,
+    StreamLinkNode,
+    StreamTopicLinkNode,
+    StrongNode,
+    TableNode,
+    TBodyNode,
+    TdNode,
+    TexErrorNode,
+    TextAlignment,
+    TextNode,
+    THeadNode,
+    ThematicBreakNode,
+    ThNode,
+    TimeStampErrorNode,
+    TimeWidgetNode,
+    TopicMentionNode,
+    TopicMentionSilentNode,
+    TrNode,
+    UnorderedListNode,
+    UserGroupMentionNode,
+    UserGroupMentionSilentNode,
+    UserMentionNode,
+    UserMentionSilentNode,
+    WebsitePreviewNode,
+    ZulipContent,
+)
+from html_helpers import SafeHtml
+from pydantic import BaseModel
+
+"""
+A compact binary form of a ZulipContent tree, so that we can store
+parsed content (say, next to the message store) and load it back
+without going through lxml and the parser again.
+
+encode_content(zulip_content) -> bytes
+decode_content(data) -> ZulipContent
+
+Layout:
+
+    FORMAT_VERSION (one byte), then the root node
+
+    node: type id (from NODE_TYPES), then the node's fields, in the
+          order that the pydantic model declares them
+
+    field, depending on its annotation:
+        str               length, UTF-8 bytes
+        str | None        0 for None, else length + 1, UTF-8 bytes
+        int               zigzag varint
+        int | None        0 for None, else zigzag + 1
+        bool              one byte
+        Sequence[int]     count, then zigzag varints
+        a model           a node
+        Sequence[model]   count, then nodes
+
+Lengths, counts and type ids are unsigned LEB128 varints, so most of
+them take one byte.  (Literal strings count as str; SafeHtml and
+TextAlignment are models like any other.)
+
+NODE_TYPES is the node-type table.  Type ids are positions in it, so
+only ever append to it.  Bump FORMAT_VERSION for anything that would
+change how existing data decodes, such as a new field on a node.
+
+The loader trusts the data to have come from encode_content, and
+skips pydantic validation (model_construct).  It does check the
+structure: bad type ids, truncated data and trailing bytes raise
+ContentCodecError.
+"""
+
+FORMAT_VERSION = 1
+
+NODE_TYPES: list[type[BaseModel]] = [
+    ZulipContent,
+    ParagraphNode,
+    TextNode,
+    BlockWhiteSpaceNode,
+    LineBreakInlineNode,
+    LineBreakBlockNode,
+    ThematicBreakNode,
+    HeadingNode,
+    DeleteNode,
+    EmphasisNode,
+    StrongNode,
+    QuotationNode,
+    CodeNode,
+    AnchorNode,
+    MessageLinkNode,
+    StreamLinkNode,
+    StreamTopicLinkNode,
+    EmojiImageNode,
+    EmojiSpanNode,
+    ListItemNode,
+    OrderedListNode,
+    UnorderedListNode,
+    TextAlignment,
+    ThNode,
+    TdNode,
+    TrNode,
+    TBodyNode,
+    THeadNode,
+    TableNode,
+    SpoilerContentNode,
+    SpoilerHeaderNode,
+    SpoilerNode,
+    InlineImageChildImgNode,
+    InlineImageNode,
+    InlineVideoNode,
+    AudioNode,
+    ChannelWildcardMentionNode,
+    ChannelWildcardMentionSilentNode,
+    TopicMentionNode,
+    TopicMentionSilentNode,
+    UserGroupMentionNode,
+    UserGroupMentionSilentNode,
+    UserMentionNode,
+    UserMentionSilentNode,
+    TimeWidgetNode,
+    KatexNode,
+    PygmentsCodeBlockNode,
+    TexErrorNode,
+    TimeStampErrorNode,
+    WebsitePreviewNode,
+    SafeHtml,
+]
+
+STR = 0
+OPT_STR = 1
+INT = 2
+OPT_INT = 3
+BOOL = 4
+INT_LIST = 5
+NODE = 6
+NODE_LIST = 7
+
+
+class ContentCodecError(Exception):
+    pass
+
+
+def get_field_kind(annotation: Any) -> int:
+    origin = typing.get_origin(annotation)
+    args = typing.get_args(annotation)
+
+    if annotation is str or origin is typing.Literal:
+        return STR
+    if annotation is bool:
+        return BOOL
+    if annotation is int:
+        return INT
+    if origin in (typing.Union, types.UnionType) and type(None) in args:
+        (inner,) = [arg for arg in args if arg is not type(None)]
+        inner_kind = get_field_kind(inner)
+        if inner_kind == STR:
+            return OPT_STR
+        if inner_kind == INT:
+            return OPT_INT
+    if origin is Sequence:
+        if args[0] is int:
+            return INT_LIST
+        if issubclass(args[0], BaseModel):
+            return NODE_LIST
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return NODE
+    raise TypeError(f"no encoding for {annotation}")
+
+
+def get_fields(cls: type[BaseModel]) -> list[tuple[str, int]]:
+    return [
+        (name, get_field_kind(field.annotation))
+        for name, field in cls.model_fields.items()
+    ]
+
+
+TYPE_IDS = {cls: i for i, cls in enumerate(NODE_TYPES)}
+FIELDS = [get_fields(cls) for cls in NODE_TYPES]
+
+
+"""
+Encoding
+"""
+
+
+def write_uvarint(buf: bytearray, n: int) -> None:
+    while n >= 0x80:
+        buf.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def zigzag(n: int) -> int:
+    # 0, -1, 1, -2, ... -> 0, 1, 2, 3, ...
+    return n * 2 if n >= 0 else -n * 2 - 1
+
+
+def unzigzag(n: int) -> int:
+    return n >> 1 if not n & 1 else -((n + 1) >> 1)
+
+
+def write_str(buf: bytearray, s: str, *, bias: int = 0) -> None:
+    data = s.encode()
+    write_uvarint(buf, len(data) + bias)
+    buf += data
+
+
+def write_node(buf: bytearray, node: BaseModel) -> None:
+    type_id = TYPE_IDS[type(node)]
+    write_uvarint(buf, type_id)
+    for name, kind in FIELDS[type_id]:
+        value = getattr(node, name)
+        if kind == STR:
+            write_str(buf, value)
+        elif kind == NODE_LIST:
+            write_uvarint(buf, len(value))
+            for child in value:
+                write_node(buf, child)
+        elif kind == NODE:
+            write_node(buf, value)
+        elif kind == OPT_STR:
+            if value is None:
+                buf.append(0)
+            else:
+                write_str(buf, value, bias=1)
+        elif kind == INT:
+            write_uvarint(buf, zigzag(value))
+        elif kind == OPT_INT:
+            write_uvarint(buf, 0 if value is None else zigzag(value) + 1)
+        elif kind == BOOL:
+            buf.append(1 if value else 0)
+        elif kind == INT_LIST:
+            write_uvarint(buf, len(value))
+            for n in value:
+                write_uvarint(buf, zigzag(n))
+
+
+def encode_content(zulip_content: ZulipContent) -> bytes:
+    buf = bytearray([FORMAT_VERSION])
+    write_node(buf, zulip_content)
+    return bytes(buf)
+
+
+"""
+Decoding
+"""
+
+
+class Decoder:
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self.pos = 0
+
+    def read_uvarint(self) -> int:
+        data = self.data
+        b = data[self.pos]
+        self.pos += 1
+        if b < 0x80:
+            return b
+        n = b & 0x7F
+        shift = 7
+        while True:
+            b = data[self.pos]
+            self.pos += 1
+            n |= (b & 0x7F) << shift
+            if b < 0x80:
+                return n
+            shift += 7
+
+    def read_bytes_as_str(self, length: int) -> str:
+        end = self.pos + length
+        if end > len(self.data):
+            raise ContentCodecError("truncated string")
+        s = self.data[self.pos : end].decode()
+        self.pos = end
+        return s
+
+    def read_node(self) -> BaseModel:
+        type_id = self.read_uvarint()
+        if type_id >= len(NODE_TYPES):
+            raise ContentCodecError(f"bad node type {type_id}")
+
+        values: dict[str, Any] = {}
+        for name, kind in FIELDS[type_id]:
+            if kind == STR:
+                values[name] = self.read_bytes_as_str(self.read_uvarint())
+            elif kind == NODE_LIST:
+                count = self.read_uvarint()
+                values[name] = [self.read_node() for _ in range(count)]
+            elif kind == NODE:
+                values[name] = self.read_node()
+            elif kind == OPT_STR:
+                length = self.read_uvarint()
+                values[name] = (
+                    None if length == 0 else self.read_bytes_as_str(length - 1)
+                )
+            elif kind == INT:
+                values[name] = unzigzag(self.read_uvarint())
+            elif kind == OPT_INT:
+                n = self.read_uvarint()
+                values[name] = None if n == 0 else unzigzag(n - 1)
+            elif kind == BOOL:
+                values[name] = self.data[self.pos] != 0
+                self.pos += 1
+            elif kind == INT_LIST:
+                count = self.read_uvarint()
+                values[name] = [unzigzag(self.read_uvarint()) for _ in range(count)]
+        return NODE_TYPES[type_id].model_construct(**values)
+
+
+def decode_content(data: bytes) -> ZulipContent:
+    if not data or data[0] != FORMAT_VERSION:
+        raise ContentCodecError("unknown format version")
+
+    decoder = Decoder(data)
+    decoder.pos = 1
+    try:
+        node = decoder.read_node()
+    except IndexError:
+        raise ContentCodecError("truncated data")
+    except UnicodeDecodeError:
+        raise ContentCodecError("bad UTF-8 in string")
+    if decoder.pos != len(data):
+        raise ContentCodecError("trailing bytes")
+    if not isinstance(node, ZulipContent):
+        raise ContentCodecError("root is not ZulipContent")
+    return node
@@ -1,13 +1,26 @@
 import asyncio
 import json
+import os
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable
 
-from config import API_KEY, HOST, USER_NAME
+from backfill import Backfill, BackfillCheckpoint
 from database import Database
-from event_info import EventInfo
+from event_applier import EventApplier
+from event_info import EventInfo, EventMetrics
+from message import Message
 from register import RegisterInfo, register
-from zulip import ZulipApi
+from snapshot import append_snapshot, read_snapshot, write_snapshot
+from zulip import EventQueueExpired, ZulipApi
 
 MESSAGE_BATCH_SIZE = 5_000
+RESYNC_BATCH_SIZE = 1_000
+SNAPSHOT_FN = "database.snapshot"
+BACKFILL_CHECKPOINT_FN = "backfill.json"
+CONTENT_CACHE_FN = "content_cache.bin"
+BACKFILL_DAYS = 90
 
 
 async def fetch_and_populate_messages(zulip_api: ZulipApi, database: Database) -> None:
@@ -23,14 +36,221 @@ async def fetch_and_populate_messages(zulip_api: ZulipApi, database: Database) -
         database.populate_messages(data["messages"])
 
 
-async def process_events(zulip_api: ZulipApi, event_info: EventInfo) -> None:
-    def handle_event(event: object) -> None:
-        print(event)
+async def fetch_and_populate_newer_messages(
+    zulip_api: ZulipApi, database: Database, anchor_id: int
+) -> list[Message]:
+    print("\n\n---------\n\n")
+    print(f"FETCH MESSAGES (newer than {anchor_id})")
+    new_messages: list[Message] = []
+    found_newest = False
+
+    while not found_newest:
+        params = dict(
+            anchor=anchor_id,
+            include_anchor=json.dumps(False),
+            num_before=0,
+            num_after=MESSAGE_BATCH_SIZE,
+            client_gravatar=json.dumps(False),
+            apply_markdown=json.dumps(True),
+        )
+        async with zulip_api.GET_json("messages", params) as data:
+            raw_messages = data["messages"]
+            new_messages += database.populate_messages(raw_messages)
+            found_newest = data["found_newest"] or not raw_messages
+            if raw_messages:
+                anchor_id = raw_messages[-1]["id"]
+
+    print(f"{len(new_messages)} new messages")
+    return new_messages
+
+
+@dataclass
+class CatchUp:
+    """
+    What catch_up_database changed in the Database.  None of it came
+    through the event queue, so we hand it to the listener as one
+    synthetic "catch_up" event (see as_event) instead.
+    """
+
+    new_message_ids: list[int] = field(default_factory=list)
+    changed_message_ids: list[int] = field(default_factory=list)
+    deleted_message_ids: list[int] = field(default_factory=list)
+    # users that populate_users added to the UserTable
+    user_ids: list[int] = field(default_factory=list)
+
+    def is_empty(self) -> bool:
+        return not any(asdict(self).values())
+
+    def as_event(self) -> dict[str, Any]:
+        return dict(type="catch_up", **asdict(self))
+
+
+async def resync_recent_messages(
+    zulip_api: ZulipApi, database: Database, max_id: int, catch_up: CatchUp
+) -> list[Message]:
+    """
+    While we had no event queue, we missed any update_message and
+    delete_message events.  We can't afford to refetch everything we
+    have, so we refetch the newest RESYNC_BATCH_SIZE messages up to
+    max_id (where nearly all edits, moves and deletes happen) and
+    reconcile them with the table.  Changes to older messages during
+    the gap are still missed, until the next full fetch.
+
+    We note what actually changed in catch_up.
+    """
+    print("\n\n---------\n\n")
+    print(f"RESYNC MESSAGES (up to {max_id})")
+    params = dict(
+        anchor=max_id + 1,
+        include_anchor=json.dumps(False),
+        num_before=RESYNC_BATCH_SIZE,
+        num_after=0,
+        client_gravatar=json.dumps(False),
+        apply_markdown=json.dumps(True),
+    )
+    async with zulip_api.GET_json("messages", params) as data:
+        raw_messages = data["messages"]
+        found_oldest = data["found_oldest"]
+
+    message_table = database.message_table
+    max_row = message_table.maybe_get_row(max_id)
+    if not raw_messages or max_row is None:
+        return []
+
+    # Anything we have in the refetched id range that the server
+    # didn't send back was deleted (or moved out of our reach).
+    min_id = 0 if found_oldest else min(m["id"] for m in raw_messages)
+    min_timestamp = 0 if found_oldest else min(m["timestamp"] for m in raw_messages)
+    server_ids = {m["id"] for m in raw_messages}
+    deleted_ids = [
+        row.id
+        for row in message_table.get_rows_between(min_timestamp, max_row.timestamp)
+        if min_id <= row.id <= max_id and row.id not in server_ids
+    ]
+    for id in deleted_ids:
+        message_table.delete(id)
+    catch_up.deleted_message_ids += deleted_ids
+
+    old_values = {}
+    for id in server_ids:
+        row = message_table.maybe_get_row(id)
+        if row is not None:
+            old_values[id] = (row.content, row.address.key())
+
+    # Re-inserting updates edited content and moved topics in place.
+    messages = database.populate_messages(raw_messages)
+    for message in messages:
+        old_value = old_values.get(message.id)
+        if old_value is None:
+            catch_up.new_message_ids.append(message.id)
+        elif old_value != (message.content, message.address.key()):
+            catch_up.changed_message_ids.append(message.id)
+    print(f"{len(messages)} messages resynced")
+    return messages
+
+
+EventListener = Callable[[dict[str, Any]], None]
+
+
+async def process_events(
+    zulip_api: ZulipApi,
+    event_info: EventInfo,
+    database: Database,
+    *,
+    raw_streams: list[dict[str, Any]],
+    on_event: EventListener | None = None,
+) -> None:
+    event_applier = EventApplier(database, host=zulip_api.host, raw_streams=raw_streams)
+    metrics = EventMetrics()
+
+    def handle_event(event: dict[str, Any]) -> None:
+        print(event["type"], event["id"], f"(queue depth {metrics.queue_depth})")
+        event_applier.apply(event)
+        # Listeners (i.e. the UI) hear about the event once the
+        # Database reflects it.
+        if on_event is not None:
+            on_event(event)
 
     await zulip_api.process_events(
         event_info=event_info,
         callback=handle_event,
+        metrics=metrics,
+    )
+
+
+async def catch_up_database(
+    zulip_api: ZulipApi,
+    register_info: RegisterInfo,
+    database: Database,
+    *,
+    on_event: EventListener | None = None,
+) -> None:
+    # We register *before* fetching, so that anything sent or changed
+    # after our fetch arrives on the new queue (re-inserting a message
+    # is fine).  See resync_recent_messages for what we can't recover.
+    catch_up = CatchUp()
+    old_user_ids = set(database.user_table.table)
+    max_id = database.message_table.get_max_id()
+    if max_id is None:
+        await fetch_and_populate_messages(zulip_api, database)
+        new_messages = None
+        catch_up.new_message_ids = [m.id for m in database.message_table.get_rows()]
+    else:
+        new_messages = await resync_recent_messages(
+            zulip_api, database, max_id, catch_up
+        )
+        newer_messages = await fetch_and_populate_newer_messages(
+            zulip_api, database, max_id
+        )
+        new_messages += newer_messages
+        catch_up.new_message_ids += [m.id for m in newer_messages]
+
+    database.populate_users(
+        email=zulip_api.user_name,
+        host=zulip_api.host,
+        raw_realm_users=register_info.realm_users,
+        messages=new_messages,
     )
+    database.populate_streams(register_info.streams, messages=new_messages)
+
+    catch_up.user_ids = sorted(set(database.user_table.table) - old_user_ids)
+    if on_event is not None and not catch_up.is_empty():
+        on_event(catch_up.as_event())
+
+
+async def run_event_loop(
+    zulip_api: ZulipApi,
+    register_info: RegisterInfo,
+    database: Database,
+    *,
+    on_event: EventListener | None = None,
+) -> None:
+    """
+    Apply events forever.  Whenever our event queue expires (see
+    ZulipApi.process_events), we register a new queue and catch up by
+    fetching the messages newer than the newest one we have, and
+    refetching the most recent ones (for edits and deletes), instead
+    of starting over.  Edits and deletes of older messages while we
+    had no queue are lost.
+    """
+    while True:
+        event_info = EventInfo(
+            queue_id=register_info.queue_id,
+            last_event_id=register_info.last_event_id,
+        )
+        try:
+            await process_events(
+                zulip_api,
+                event_info,
+                database,
+                raw_streams=register_info.streams,
+                on_event=on_event,
+            )
+        except EventQueueExpired as e:
+            print(f"event queue expired ({e}); registering a new one")
+
+        register_info = await register(zulip_api)
+        await catch_up_database(zulip_api, register_info, database, on_event=on_event)
 
 
 async def populate_database(
@@ -42,27 +262,137 @@ async def populate_database(
 
     # Make sure messages are already populated for these
     database.populate_users(
-        email=USER_NAME, host=HOST, raw_realm_users=register_info.realm_users
+        email=zulip_api.user_name,
+        host=zulip_api.host,
+        raw_realm_users=register_info.realm_users,
     )
     database.populate_streams(register_info.streams)
 
     return database
 
 
-async def main() -> None:
-    zulip_api = ZulipApi(HOST, USER_NAME, API_KEY)
+async def sync_database(zulip_api: ZulipApi, register_info: RegisterInfo) -> None:
+    """
+    Bring an existing snapshot up to date by fetching only the messages
+    newer than the newest one we have, and appending them to the
+    snapshot as a new segment (see snapshot.py).
+    """
+    database = read_snapshot(SNAPSHOT_FN)
+    max_id = database.message_table.get_max_id()
+    assert max_id is not None
+
+    new_messages = await fetch_and_populate_newer_messages(zulip_api, database, max_id)
+    if not new_messages:
+        print(f"{SNAPSHOT_FN} is already up to date")
+        return
+
+    database.populate_users(
+        email=zulip_api.user_name,
+        host=zulip_api.host,
+        raw_realm_users=register_info.realm_users,
+        messages=new_messages,
+    )
+    database.populate_streams(register_info.streams, messages=new_messages)
+
+    append_snapshot(database, SNAPSHOT_FN, new_messages)
+    print(f"Database synced to {SNAPSHOT_FN}")
+
+
+async def backfill_database(
+    zulip_api: ZulipApi, register_info: RegisterInfo, *, days: int = BACKFILL_DAYS
+) -> None:
+    """
+    Extend an existing snapshot back in time (see backfill.py).  Each
+    batch gets appended to the snapshot as it arrives; once the
+    backfill is complete, we rewrite the snapshot as one segment.
+    """
+    database = read_snapshot(SNAPSHOT_FN)
+
+    checkpoint = None
+    if os.path.exists(BACKFILL_CHECKPOINT_FN):
+        checkpoint = BackfillCheckpoint.load(BACKFILL_CHECKPOINT_FN)
+        if database.message_table.maybe_get_row(checkpoint.start_id) is None:
+            print(f"ignoring {BACKFILL_CHECKPOINT_FN} from a different snapshot")
+            checkpoint = None
+        else:
+            print(f"resuming backfill from {BACKFILL_CHECKPOINT_FN}")
+
+    if checkpoint is None:
+        stop_timestamp = int(time.time()) - days * 24 * 60 * 60
+        checkpoint = BackfillCheckpoint.create(database, stop_timestamp=stop_timestamp)
+
+    def on_batch(messages: list[Message]) -> None:
+        database.populate_users(
+            email=zulip_api.user_name,
+            host=zulip_api.host,
+            raw_realm_users=register_info.realm_users,
+            messages=messages,
+        )
+        database.populate_streams(register_info.streams, messages=messages)
+        append_snapshot(database, SNAPSHOT_FN, messages)
+        print(f"backfilled {len(messages)} messages")
+
+    print("\n\n---------\n\n")
+    print(f"BACKFILL MESSAGES (back to {days} days ago)")
+    backfill = Backfill(
+        zulip_api=zulip_api,
+        database=database,
+        checkpoint=checkpoint,
+        checkpoint_fn=BACKFILL_CHECKPOINT_FN,
+        on_batch=on_batch,
+    )
+    await backfill.run()
+    print(f"{backfill.num_messages} messages backfilled")
+
+    if checkpoint.is_complete():
+        write_snapshot(database, SNAPSHOT_FN)
+        os.remove(BACKFILL_CHECKPOINT_FN)
+        print(f"Backfill complete; {SNAPSHOT_FN} compacted")
+
+
+async def listen_for_events(
+    zulip_api: ZulipApi, database: Database, *, on_event: EventListener
+) -> None:
+    # For a client that already has a Database (e.g. from the
+    # snapshot): register, catch up, and then apply events forever.
     register_info = await register(zulip_api)
+    await catch_up_database(zulip_api, register_info, database, on_event=on_event)
+    await run_event_loop(zulip_api, register_info, database, on_event=on_event)
 
-    database = await populate_database(zulip_api, register_info)
 
-    db_json = database.model_dump_json()
-    fn = "database.json"
-    with open(fn, "w", encoding="utf8") as database_file:
-        database_file.write(db_json)
-    print(f"Database saved to {fn}")
+def make_zulip_api() -> ZulipApi:
+    # We read the zuliprc here, rather than at import time, so that
+    # importing data_layer (e.g. from tests) doesn't need one.
+    from config import API_KEY, HOST, USER_NAME
+
+    return ZulipApi(HOST, USER_NAME, API_KEY)
+
+
+async def main(*, sync: bool = False, backfill: bool = False) -> None:
+    async with make_zulip_api() as zulip_api:
+        register_info = await register(zulip_api)
+
+        if sync and os.path.exists(SNAPSHOT_FN):
+            await sync_database(zulip_api, register_info)
+            return
+
+        if backfill and os.path.exists(SNAPSHOT_FN):
+            await backfill_database(zulip_api, register_info)
+            return
+
+        database = await populate_database(zulip_api, register_info)
+
+    write_snapshot(database, SNAPSHOT_FN)
+    print(f"Database saved to {SNAPSHOT_FN}")
 
 
 async def get_database() -> Database:
+    if os.path.exists(SNAPSHOT_FN):
+        database = read_snapshot(SNAPSHOT_FN)
+        print(f"cached data loaded from {SNAPSHOT_FN}")
+        return database
+
+    # Fall back to the legacy JSON cache (see snapshot.py to convert it).
     fn = "database.json"
     with open(fn, encoding="utf8") as database_file:
         db_json = database_file.read()
@@ -72,18 +402,15 @@ async def get_database() -> Database:
 
 
 async def original_main() -> None:
-    zulip_api = ZulipApi(HOST, USER_NAME, API_KEY)
-    register_info = await register(zulip_api)
-
-    await populate_database(zulip_api, register_info)
+    async with make_zulip_api() as zulip_api:
+        register_info = await register(zulip_api)
 
-    event_info = EventInfo(
-        queue_id=register_info.queue_id,
-        last_event_id=register_info.last_event_id,
-    )
+        database = await populate_database(zulip_api, register_info)
 
-    await process_events(zulip_api, event_info)
+        await run_event_loop(zulip_api, register_info, database)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # python api/data_layer.py --sync       (fetch only new messages)
+    # python api/data_layer.py --backfill   (fetch older history)
+    asyncio.run(main(sync="--sync" in sys.argv, backfill="--backfill" in sys.argv))
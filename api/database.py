@@ -1,6 +1,10 @@
-from message import Message
+from typing import Sequence
+
+from columnar_message_table import ColumnarMessageTable
+from message import Message, MessageRecord
+from message_store import MessageStore
 from message_table import MessageTable
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, field_serializer
 from stream import Stream
 from stream_table import StreamTable
 from topic_table import TopicTable
@@ -9,32 +13,60 @@ from user_table import UserTable
 
 
 class Database(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     current_user_id: int
-    message_table: MessageTable
+    message_table: MessageStore
     user_table: UserTable
     stream_table: StreamTable
     topic_table: TopicTable
 
+    @field_serializer("message_table")
+    def serialize_message_table(self, message_table: MessageStore) -> MessageTable:
+        # database.json always uses the plain MessageTable layout.
+        if isinstance(message_table, ColumnarMessageTable):
+            return MessageTable(table={m.id: m for m in message_table.to_rows()})
+        return message_table
+
     @staticmethod
-    def create_empty_database() -> "Database":
+    def create_empty_database(*, columnar: bool = False) -> "Database":
+        message_table: MessageStore
+        if columnar:
+            message_table = ColumnarMessageTable()
+        else:
+            message_table = MessageTable()
         return Database(
             current_user_id=0,
-            message_table=MessageTable(),
+            message_table=message_table,
             user_table=UserTable(),
             stream_table=StreamTable(),
             topic_table=TopicTable(),
         )
 
-    def populate_messages(self, raw_messages: list[dict[str, object]]) -> None:
-        for message in raw_messages:
-            self.message_table.insert(
-                Message.from_raw(message, topic_table=self.topic_table)
-            )
+    def populate_messages(self, raw_messages: list[dict[str, object]]) -> list[Message]:
+        messages = [
+            Message.from_raw(message, topic_table=self.topic_table)
+            for message in raw_messages
+        ]
+        self.message_table.insert_many(messages)
+        return messages
+
+    # By default, populate_streams and populate_users look at every
+    # message in the table.  When merging in a batch of new messages,
+    # pass just that batch as `messages`.
+
+    def populate_streams(
+        self,
+        raw_streams: list[dict[str, object]],
+        *,
+        messages: Sequence[MessageRecord] | None = None,
+    ) -> None:
+        if messages is None:
+            messages = self.message_table.get_rows()
 
-    def populate_streams(self, raw_streams: list[dict[str, object]]) -> None:
         used_stream_ids = {
             message.get_stream_id(topic_table=self.topic_table)
-            for message in self.message_table.get_rows()
+            for message in messages
             if message.address.type == "stream"
         }
 
@@ -45,13 +77,21 @@ class Database(BaseModel):
                 self.stream_table.insert(row)
 
     def populate_users(
-        self, *, email: str, host: str, raw_realm_users: list[dict[str, object]]
+        self,
+        *,
+        email: str,
+        host: str,
+        raw_realm_users: list[dict[str, object]],
+        messages: Sequence[MessageRecord] | None = None,
     ) -> None:
+        if messages is None:
+            messages = self.message_table.get_rows()
+
         realm_user_dict = {user["user_id"]: user for user in raw_realm_users}
 
         user_ids = set()
 
-        for message in self.message_table.get_rows():
+        for message in messages:
             user_ids.add(message.sender_id)
 
             if message.address.type == "private":
@@ -65,6 +105,5 @@ class Database(BaseModel):
                     print("USER_ID", user_id)
                 row = User.from_raw(host, realm_user)
                 self.user_table.insert(row)
-            else:
-                print("\n\nUNKNOWN USER:", user_id)
-                # TODO: grab system bots and mentioned users
+            # Anybody else (system bots, deleted users) gets fetched
+            # on demand when we render them; see remote_users.py.
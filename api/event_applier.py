@@ -0,0 +1,176 @@
+from typing import Any, Callable
+
+from address import Address
+from database import Database
+from message import Message, MessageRecord, fix_content
+from stream import Stream
+from user import User
+
+"""
+EventApplier keeps a Database current by applying the events that
+come back from the Zulip event queue (see ZulipApi.process_events).
+
+Every event only touches the rows it names.  Looking a row up is a
+dict lookup (or a bisect, for ColumnarMessageTable), and a new
+message lands at the end of each sorted index, so it's an append.
+Edits that don't change a message's index keys (i.e. content edits)
+just replace the row; topic/stream moves and deletes remove the
+row from the buckets it leaves.  Nothing ever rescans a table.
+
+Events for messages that we don't have locally (older than our
+history, say) are ignored, as are event types that we don't model.
+
+The StreamTable only holds the streams that our messages use, so a
+message that arrives in (or gets moved to) any other stream would
+leave us with a topic that we can't label.  EventApplier keeps the
+raw streams from register around, and adds a stream to the table
+the first time an event puts a message in it.
+
+We register with apply_markdown=True, so message content in events
+is rendered HTML, like the messages that we fetch.
+"""
+
+EventHandler = Callable[[dict[str, Any]], None]
+
+
+def copy_message(row: MessageRecord, **updates: Any) -> Message:
+    message = Message(
+        id=row.id,
+        sender_id=row.sender_id,
+        address=row.address,
+        timestamp=row.timestamp,
+        content=row.content,
+    )
+    return message.model_copy(update=updates)
+
+
+class EventApplier:
+    def __init__(
+        self,
+        database: Database,
+        *,
+        host: str,
+        raw_streams: list[dict[str, Any]] | None = None,
+    ) -> None:
+        self.database = database
+        self.host = host
+        self.raw_stream_dict = {s["stream_id"]: s for s in raw_streams or []}
+        self.num_applied = 0
+        self.num_ignored = 0
+        self.handlers: dict[str, EventHandler] = dict(
+            message=self.apply_message,
+            update_message=self.apply_update_message,
+            delete_message=self.apply_delete_message,
+            realm_user=self.apply_realm_user,
+            stream=self.apply_stream,
+        )
+
+    def apply(self, event: dict[str, Any]) -> None:
+        handler = self.handlers.get(event["type"])
+        if handler is None:
+            self.num_ignored += 1
+            return
+        handler(event)
+        self.num_applied += 1
+
+    def apply_message(self, event: dict[str, Any]) -> None:
+        database = self.database
+        raw_message = event["message"]
+        if raw_message["type"] == "stream":
+            self.ensure_stream(raw_message["stream_id"])
+        message = Message.from_raw(raw_message, topic_table=database.topic_table)
+        database.message_table.insert(message)
+
+    def apply_update_message(self, event: dict[str, Any]) -> None:
+        message_table = self.database.message_table
+        topic_table = self.database.topic_table
+
+        rendered_content = event.get("rendered_content")
+        if rendered_content is not None:
+            row = message_table.maybe_get_row(event["message_id"])
+            if row is not None:
+                content = fix_content(rendered_content)
+                message_table.insert(copy_message(row, content=content))
+
+        new_topic_name = event.get("subject")
+        new_stream_id = event.get("new_stream_id")
+        if new_topic_name is None and new_stream_id is None:
+            return
+        if new_stream_id is not None:
+            self.ensure_stream(new_stream_id)
+
+        # A topic and/or stream move; every message moves to the same
+        # new topic, so we can reuse the new address for all of them.
+        new_address_dict: dict[tuple[int, str], Address] = {}
+        for message_id in event.get("message_ids", [event["message_id"]]):
+            row = message_table.maybe_get_row(message_id)
+            if row is None or row.address.type != "stream":
+                continue
+            old_topic = topic_table.get_topic(row.address.topic_id)
+            stream_id = new_stream_id or old_topic.stream_id
+            topic_name = new_topic_name or old_topic.name
+            new_address = new_address_dict.get((stream_id, topic_name))
+            if new_address is None:
+                topic_id = topic_table.get_topic_id(stream_id, topic_name)
+                new_address = row.address.model_copy(update=dict(topic_id=topic_id))
+                new_address_dict[(stream_id, topic_name)] = new_address
+            message_table.insert(copy_message(row, address=new_address))
+
+    def apply_delete_message(self, event: dict[str, Any]) -> None:
+        message_table = self.database.message_table
+        for message_id in event.get("message_ids", [event.get("message_id")]):
+            if message_id is not None:
+                message_table.delete(message_id)
+
+    def apply_realm_user(self, event: dict[str, Any]) -> None:
+        user_table = self.database.user_table
+        person = event["person"]
+        op = event["op"]
+
+        if op == "add":
+            # The UserTable only holds the people in our messages (see
+            # Database.populate_users); anybody else gets fetched into
+            # the Service's UserCache if we ever need to render them.
+            if user_table.maybe_get_row(person["user_id"]) is not None:
+                user_table.insert(User.from_raw(self.host, person))
+        elif op == "update":
+            user = user_table.maybe_get_row(person["user_id"])
+            if user is None:
+                return
+            if "full_name" in person:
+                user = user.model_copy(update=dict(name=person["full_name"]))
+            if "avatar_url" in person:
+                avatar_url = person["avatar_url"]
+                if avatar_url.startswith("/"):
+                    avatar_url = self.host + avatar_url
+                user = user.model_copy(update=dict(avatar_url=avatar_url))
+            user_table.insert(user)
+        # For op == "remove" (deactivation), we keep the user, since
+        # their old messages still need a sender.
+
+    def apply_stream(self, event: dict[str, Any]) -> None:
+        stream_table = self.database.stream_table
+        op = event["op"]
+
+        if op == "create":
+            for raw_stream in event["streams"]:
+                self.raw_stream_dict[raw_stream["stream_id"]] = raw_stream
+                stream_table.insert(Stream.from_raw(raw_stream))
+        elif op == "update" and event["property"] == "name":
+            stream_id = event["stream_id"]
+            raw_stream = self.raw_stream_dict.get(stream_id)
+            if raw_stream is not None:
+                self.raw_stream_dict[stream_id] = dict(raw_stream, name=event["value"])
+            stream = stream_table.table.get(stream_id)
+            if stream is not None:
+                stream_table.insert(stream.model_copy(update=dict(name=event["value"])))
+        # For op == "delete", we keep the stream, since topics and
+        # messages still refer to it.
+
+    def ensure_stream(self, stream_id: int) -> None:
+        stream_table = self.database.stream_table
+        if stream_id in stream_table.table:
+            return
+        raw_stream = self.raw_stream_dict.get(stream_id)
+        if raw_stream is not None:
+            stream_table.insert(Stream.from_raw(raw_stream))
@@ -5,3 +5,18 @@ from dataclasses import dataclass
 class EventInfo:
     queue_id: str
     last_event_id: int
+
+
+@dataclass
+class EventMetrics:
+    # how many received events are waiting to be applied
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    num_polls: int = 0
+    num_received: int = 0
+    num_applied: int = 0
+    # seconds between receiving an event and applying it
+    lag: float = 0.0
+    max_lag: float = 0.0
+    # total seconds the receiver spent waiting on a full queue
+    blocked_time: float = 0.0
@@ -1,34 +1,57 @@
+from abc import ABC, abstractmethod
+from typing import Sequence
+
 from address import Address
-from message import Message
+from message import MessageRecord
+from message_store import MessageStore
+from message_table import IndexKey, get_index_keys
+
+"""
+Each filter maps to exactly one bucket of the secondary indexes
+that MessageTable maintains, so get_rows never has to look at
+messages outside the result.
+"""
+
+
+class MessageFilter(ABC):
+    @abstractmethod
+    def index_key(self) -> IndexKey:
+        pass
+
+    def get_rows(self, message_table: MessageStore) -> Sequence[MessageRecord]:
+        return message_table.get_indexed_rows(self.index_key())
+
+    def matches(self, message: MessageRecord) -> bool:
+        return self.index_key() in get_index_keys(message)
 
 
-class DirectMessageFilter:
+class DirectMessageFilter(MessageFilter):
     def __init__(self, *, user_id: int) -> None:
         self.user_id = user_id
 
-    def get_rows(self, all_messages: list[Message]) -> list[Message]:
-        return [m for m in all_messages if self.user_id in m.address.user_ids]
+    def index_key(self) -> IndexKey:
+        return ("participant", self.user_id)
 
 
-class SentByFilter:
+class SentByFilter(MessageFilter):
     def __init__(self, sender_id: int) -> None:
         self.sender_id = sender_id
 
-    def get_rows(self, all_messages: list[Message]) -> list[Message]:
-        return [m for m in all_messages if m.sender_id == self.sender_id]
+    def index_key(self) -> IndexKey:
+        return ("sender", self.sender_id)
 
 
-class TopicFilter:
+class TopicFilter(MessageFilter):
     def __init__(self, *, topic_id: int) -> None:
         self.topic_id = topic_id
 
-    def get_rows(self, all_messages: list[Message]) -> list[Message]:
-        return [m for m in all_messages if m.address.topic_id == self.topic_id]
+    def index_key(self) -> IndexKey:
+        return ("topic", self.topic_id)
 
 
-class AddressFilter:
+class AddressFilter(MessageFilter):
     def __init__(self, address: Address) -> None:
         self.address = address
 
-    def get_rows(self, all_messages: list[Message]) -> list[Message]:
-        return [m for m in all_messages if m.address == self.address]
+    def index_key(self) -> IndexKey:
+        return ("address", self.address.key())
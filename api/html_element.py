@@ -1,34 +1,112 @@
+from abc import ABC, abstractmethod
+from typing import Any
+
 from html_helpers import SafeHtml, escape_text
 from lxml import etree
-from pydantic import BaseModel
 
+"""
+TagElement and TextElement are what the validation code in
+content.py walks over.  They are thin wrappers around lxml
+elements, and everything about them is computed on first use:
+
+    - A TagElement's children only get wrapped when somebody asks
+      for them, so subtrees that we never descend into (KaTeX and
+      pygments output, which we keep as raw HTML) cost nothing.
+    - The html of an element only gets serialized when somebody
+      asks for it (the round-trip check, KaTeX, pygments), so we
+      never serialize a subtree just because its parent got
+      serialized.
+
+So get_zulip_content builds ContentNodes in a single walk over the
+lxml tree, rather than first copying the whole tree into elements
+and then walking the copy.  TagElement.from_lxml still does the
+eager copy, for comparison (see benchmarks/content_parser.py).
+"""
+
+
+class Element(ABC):
+    __slots__ = ()
 
-class Element(BaseModel):
-    html: SafeHtml
+    @property
+    @abstractmethod
+    def html(self) -> SafeHtml:
+        pass
 
 
 class TextElement(Element):
-    text: str
+    __slots__ = ("text", "_html")
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self._html: SafeHtml | None = None
+
+    def __repr__(self) -> str:
+        return f"TextElement(text={self.text!r})"
+
+    @property
+    def html(self) -> SafeHtml:
+        if self._html is None:
+            self._html = escape_text(self.text)
+        return self._html
 
     @staticmethod
     def from_text(text: str) -> "TextElement":
-        return TextElement(
-            html=escape_text(text),
-            text=text,
-        )
+        text_elem = TextElement(text)
+        text_elem._html = escape_text(text)
+        return text_elem
 
 
 class TagElement(Element):
-    tag: str
-    attrib: dict[str, str]
-    children: list["Element"]
+    __slots__ = ("lxml_elem", "tag", "_attrib", "_children", "_html")
+
+    def __init__(self, lxml_elem: Any) -> None:
+        self.lxml_elem = lxml_elem
+        self.tag: str = lxml_elem.tag
+        self._attrib: dict[str, str] | None = None
+        self._children: list[Element] | None = None
+        self._html: SafeHtml | None = None
+
+    def __repr__(self) -> str:
+        return f"TagElement(tag={self.tag!r}, html={str(self.html)!r})"
+
+    @property
+    def attrib(self) -> dict[str, str]:
+        if self._attrib is None:
+            self._attrib = {str(k): str(v) for k, v in self.lxml_elem.attrib.items()}
+        return self._attrib
+
+    @property
+    def children(self) -> list[Element]:
+        if self._children is None:
+            elem = self.lxml_elem
+            children: list[Element] = []
+
+            if elem.text is not None:
+                children.append(TextElement(elem.text))
+
+            for c in elem.iterchildren():
+                children.append(TagElement(c))
+
+                if c.tail is not None:
+                    children.append(TextElement(c.tail))
+
+            self._children = children
+        return self._children
+
+    @property
+    def html(self) -> SafeHtml:
+        if self._html is None:
+            html = etree.tostring(self.lxml_elem, with_tail=False).decode("utf-8")
+            self._html = SafeHtml.trust(html)
+        return self._html
 
     def get(self, field: str) -> str | None:
         return self.attrib.get(field)
 
     @staticmethod
     def from_lxml(elem: etree._Element) -> "TagElement":
-        children: list["Element"] = []
+        # The eager version: copy the whole tree up front.
+        children: list[Element] = []
 
         if elem.text is not None:
             children.append(TextElement.from_text(elem.text))
@@ -39,12 +117,10 @@ class TagElement(Element):
             if c.tail is not None:
                 children.append(TextElement.from_text(c.tail))
 
-        return TagElement(
-            html=SafeHtml.trust(etree.tostring(elem, with_tail=False).decode("utf-8")),
-            tag=elem.tag,
-            attrib={str(k): str(v) for k, v in elem.attrib.items()},
-            children=children,
-        )
+        tag_elem = TagElement(elem)
+        tag_elem._attrib = {str(k): str(v) for k, v in elem.attrib.items()}
+        tag_elem._children = children
+        return tag_elem
 
 
 class IllegalMessage(Exception):
@@ -27,26 +27,59 @@ class SafeHtml(BaseModel):
     def trust(s: str) -> "SafeHtml":
         return SafeHtml(html_that_we_trust=s)
 
-    @staticmethod
-    def combine(items: list["SafeHtml"]) -> "SafeHtml":
-        return SafeHtml.trust("".join(str(item) for item in items))
 
-    @staticmethod
-    def block_join(items: list["SafeHtml"]) -> "SafeHtml":
-        if not items:
-            return SafeHtml.trust("\n")
-        return SafeHtml.trust("\n" + "\n".join(str(item) for item in items) + "\n")
+class HtmlWriter:
+    """
+    HtmlWriter accumulates the HTML for a whole tree in one list of
+    strings, which we join once at the end (see ContentNode.as_html).
+    Nodes write themselves with write_html, so we never build an
+    intermediate SafeHtml per node.
+
+    Like lxml, we write <tag/> for an element with nothing inside,
+    so start_tag hands back the position of the start tag, and
+    end_tag turns it into a self-closing one if nothing got written
+    after it.
+    """
 
+    def __init__(self) -> None:
+        self.parts: list[str] = []
 
-def build_tag(*, tag: str, inner: SafeHtml, **attrs: str | None) -> SafeHtml:
-    attr_suffix = "".join(
-        f''' {attr.rstrip("_").replace("_", "-")}="{escape_text(value, replace_quotes=True)}"'''
-        for attr, value in attrs.items()
-        if value is not None
-    )
-    if str(inner) == "":
-        return SafeHtml.trust(f"<{tag}{attr_suffix}/>")
-    return SafeHtml.trust(f"<{tag}{attr_suffix}>{inner}</{tag}>")
+    def write(self, html: SafeHtml) -> None:
+        self.write_trusted(str(html))
+
+    def write_trusted(self, s: str) -> None:
+        if s:
+            self.parts.append(s)
+
+    def write_text(self, text: str) -> None:
+        if text:
+            self.parts.append(escape(text))
+
+    def start_tag(self, tag: str, **attrs: str | None) -> int:
+        attr_suffix = "".join(
+            f''' {attr.rstrip("_").replace("_", "-")}="{escape(value, replace_quotes=True)}"'''
+            for attr, value in attrs.items()
+            if value is not None
+        )
+        self.parts.append(f"<{tag}{attr_suffix}>")
+        return len(self.parts) - 1
+
+    def end_tag(self, tag: str, start: int) -> None:
+        if len(self.parts) == start + 1:
+            self.parts[start] = self.parts[start][:-1] + "/>"
+        else:
+            self.parts.append(f"</{tag}>")
+
+    def empty_tag(self, tag: str, **attrs: str | None) -> None:
+        self.end_tag(tag, self.start_tag(tag, **attrs))
+
+    def text_tag(self, tag: str, text: str, **attrs: str | None) -> None:
+        start = self.start_tag(tag, **attrs)
+        self.write_text(text)
+        self.end_tag(tag, start)
+
+    def get_html(self) -> SafeHtml:
+        return SafeHtml.trust("".join(self.parts))
 
 
 def canonicalize_escape_text(text: str) -> str:
@@ -57,16 +90,24 @@ def canonicalize_escape_text(text: str) -> str:
     return re.sub(r"&#x(.*?);", replace, text)
 
 
-def escape_text(text: str, replace_quotes: bool = False) -> SafeHtml:
+def escape(text: str, replace_quotes: bool = False) -> str:
     # This is very similar to html.escape, but we want to match the
     # lxml output for now.  The lxml parser is annoying in that
     # it doesn't easily round trip the original HTML.
-    text = text.replace("&", "&amp;")
-    special_chars = [c for c in text if ord(c) > 128]
-    for c in special_chars:
-        text = text.replace(c, f"&#{ord(c)};")
-    text = text.replace(">", "&gt;")
-    text = text.replace("<", "&lt;")
+    #
+    # Everything past U+0080 (but not U+0080 itself) becomes a numeric
+    # reference; we let the codec do that in one pass rather than
+    # replacing each character.
+    text = text.replace("&", "&amp;").replace(">", "&gt;").replace("<", "&lt;")
     if replace_quotes:
         text = text.replace('"', "&quot;")
-    return SafeHtml.trust(text)
+    if text.isascii():
+        return text
+    return "\x80".join(
+        part.encode("ascii", "xmlcharrefreplace").decode("ascii")
+        for part in text.split("\x80")
+    )
+
+
+def escape_text(text: str, replace_quotes: bool = False) -> SafeHtml:
+    return SafeHtml.trust(escape(text, replace_quotes=replace_quotes))
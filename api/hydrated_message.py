@@ -3,11 +3,12 @@ from dataclasses import dataclass
 from address import Address
 from database import Database
 from deferred_user import DeferredUser, DeferredUserFactory
-from message import Message
+from message import MessageRecord
 
 
 @dataclass
 class HydratedMessage:
+    id: int
     deferred_sender: DeferredUser
     content: str
     timestamp: int
@@ -16,16 +17,26 @@ class HydratedMessage:
 
     @staticmethod
     def create(
-        *, message: Message, factory: DeferredUserFactory, database: Database
+        *, message: MessageRecord, factory: DeferredUserFactory, database: Database
     ) -> "HydratedMessage":
+        # The factory must be finalized already, since we need the
+        # names of the direct message participants right away.
+        address = message.address
+        if address.type == "private":
+            names = [factory.get_user(user_id).name for user_id in address.user_ids]
+            address_name = ", ".join(sorted(names))
+        else:
+            address_name = address.name(
+                stream_table=database.stream_table,
+                topic_table=database.topic_table,
+                user_table=database.user_table,
+            )
+
         return HydratedMessage(
+            id=message.id,
             deferred_sender=factory.create_user(message.sender_id),
             content=message.content,
             timestamp=message.timestamp,
-            address=message.address,
-            address_name=message.address.name(
-                stream_table=database.stream_table,
-                topic_table=database.topic_table,
-                user_table=database.user_table,
-            ),
+            address=address,
+            address_name=address_name,
         )
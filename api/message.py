@@ -1,9 +1,40 @@
-from typing import Any
+from typing import Any, Protocol
 
 from address import Address
 from pydantic import BaseModel
 from topic_table import TopicTable
 
+# Messages are ordered by (timestamp, id); the id breaks ties between
+# messages sent in the same second.
+MessageKey = tuple[int, int]
+
+
+class MessageRecord(Protocol):
+    """
+    The read-only shape shared by Message and the lightweight row
+    views that ColumnarMessageTable hands out.  Code that only reads
+    messages (filters, hydration, etc.) should accept this.
+    """
+
+    @property
+    def id(self) -> int: ...
+
+    @property
+    def sender_id(self) -> int: ...
+
+    @property
+    def address(self) -> Address: ...
+
+    @property
+    def timestamp(self) -> int: ...
+
+    @property
+    def content(self) -> str: ...
+
+    def key(self) -> MessageKey: ...
+
+    def get_stream_id(self, topic_table: TopicTable) -> int: ...
+
 
 def fix_content(content: str) -> str:
     host = "https://chat.zulip.org"
@@ -45,6 +76,9 @@ class Message(BaseModel):
             content=content,
         )
 
+    def key(self) -> MessageKey:
+        return (self.timestamp, self.id)
+
     def get_stream_id(self, topic_table: TopicTable) -> int:
         assert self.address.type == "stream"
         topic = topic_table.get_topic(self.address.topic_id)
@@ -1,26 +1,94 @@
-from content import ZulipContent
+import random
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Sequence
+
+from content import ZulipContent, check_round_trip
 from html_element import TagElement, get_only_child, restrict
 from lxml import etree
+from trivial_content import maybe_get_trivial_content
+
+"""
+get_zulip_contents parses a batch of messages.  Each message that
+fails (bad HTML, something our AST doesn't model, a round trip
+mismatch) gets its error recorded in its ParsedMessage, and the
+rest of the batch carries on.
+
+lxml parsers can be reused, but not shared between threads, so each
+thread keeps one strict and one recovering parser around (see
+ThreadParsers) instead of making a new one per message.
+
+Plain paragraphs skip lxml altogether (see trivial_content.py).
+
+If you change what the parser (or as_text) produces, bump
+content_cache.PARSER_VERSION, so that cached texts get thrown away.
+"""
+
+# We try to be strict, but lxml doesn't like math/video/time and doesn't
+# recover from certain <br> tags in paragraphs.
+RECOVER_PATTERN = re.compile(r"<math|<video|<audio|<time|<br|</a></a>")
+
+
+class ThreadParsers(threading.local):
+    def __init__(self) -> None:
+        self.strict = etree.HTMLParser(recover=False)
+        self.recover = etree.HTMLParser(recover=True)
+
+
+thread_parsers = ThreadParsers()
+
 
+@dataclass
+class ParsedMessage:
+    zulip_content: ZulipContent | None
+    error: Exception | None
 
-def get_zulip_content(html: str) -> ZulipContent:
-    # We try to be strict, but lxml doesn't like math/video/time and doesn't
-    # recover from certain <br> tags in paragraphs.
-    if (
-        "<math" in html
-        or "<video" in html
-        or "<audio" in html
-        or "<time" in html
-        or "<br" in html
-        or "</a></a>" in html
-    ):
-        recover = True
+
+def get_zulip_content(html: str, *, sample_rate: float = 1.0) -> ZulipContent:
+    zulip_content = maybe_get_trivial_content(html)
+    if zulip_content is not None:
+        return zulip_content
+
+    # We check that a random sample_rate fraction of messages round
+    # trip back to their HTML.  Tests want every message checked;
+    # the UI can get away with spot checks.
+    verify = sample_rate >= 1.0 or random.random() < sample_rate
+    return parse_zulip_content(html, verify=verify)
+
+
+def parse_zulip_content(html: str, *, verify: bool = True) -> ZulipContent:
+    # the full parser, without the fast path
+    root = TagElement(get_lxml_root(html))
+    return build_zulip_content(root, verify=verify)
+
+
+def get_zulip_contents(
+    htmls: Sequence[str], *, sample_rate: float = 1.0
+) -> list[ParsedMessage]:
+    results = []
+    for html in htmls:
+        try:
+            zulip_content = get_zulip_content(html, sample_rate=sample_rate)
+        except Exception as e:
+            results.append(ParsedMessage(zulip_content=None, error=e))
+        else:
+            results.append(ParsedMessage(zulip_content=zulip_content, error=None))
+    return results
+
+
+def get_lxml_root(html: str) -> Any:
+    if RECOVER_PATTERN.search(html):
+        parser = thread_parsers.recover
     else:
-        recover = False
-    parser = etree.HTMLParser(recover=recover)
-    lxml_root = etree.fromstring("<body>" + html + "</body>", parser=parser)
-    root = TagElement.from_lxml(lxml_root)
+        parser = thread_parsers.strict
+    return etree.fromstring("<body>" + html + "</body>", parser=parser)
+
+
+def build_zulip_content(root: TagElement, *, verify: bool = True) -> ZulipContent:
     restrict(root, "html")
     body = get_only_child(root, "body")
     message_node = ZulipContent.from_tag_element(body)
+    if verify:
+        check_round_trip(body, message_node)
     return message_node
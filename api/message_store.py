@@ -0,0 +1,15 @@
+from columnar_message_table import ColumnarMessageTable
+from message_table import MessageTable
+
+"""
+We have two interchangeable message backends:
+
+    MessageTable: pydantic rows, simple, serializes straight to JSON
+    ColumnarMessageTable: typed arrays, for large local histories
+
+Both expose the same query methods (get_row, get_rows,
+get_indexed_rows, get_rows_before/after/between, insert) and return
+rows that satisfy MessageRecord.
+"""
+
+MessageStore = MessageTable | ColumnarMessageTable
@@ -1,12 +1,184 @@
-from message import Message
-from pydantic import BaseModel
+from typing import Any
+
+from message import Message, MessageKey, MessageRecord
+from pydantic import BaseModel, PrivateAttr
+from sorted_keys import SortedKeys
+
+"""
+The MessageTable keeps secondary indexes so that our filters can
+answer queries in time proportional to the size of the result,
+rather than scanning every message we have stored locally.
+
+Each message lands in a handful of index buckets:
+
+    ("sender", sender_id)
+    ("address", address.key())
+    ("topic", topic_id)            (stream messages only)
+    ("participant", user_id)       (direct messages only, once per recipient)
+
+Both the whole table and every bucket keep their messages in
+(timestamp, id) order (see sorted_keys.py), so callers never have
+to sort, and they can ask for a window around an anchor instead of
+materializing a whole narrow.  Passing index_key=None to the
+windowed methods means "all messages".
+
+The order and indexes are not part of the serialized table; we
+rebuild them whenever a table gets constructed (including from
+database.json).
+"""
+
+IndexKey = tuple[str, int | str]
+
+
+def get_index_keys(message: MessageRecord) -> list[IndexKey]:
+    address = message.address
+    keys: list[IndexKey] = [
+        ("sender", message.sender_id),
+        ("address", address.key()),
+    ]
+    if address.type == "stream":
+        keys.append(("topic", address.topic_id))
+    else:
+        keys.extend(("participant", user_id) for user_id in address.user_ids)
+    return keys
+
+
+def has_same_index_keys(old_row: MessageRecord, new_row: MessageRecord) -> bool:
+    return old_row.key() == new_row.key() and set(get_index_keys(old_row)) == set(
+        get_index_keys(new_row)
+    )
 
 
 class MessageTable(BaseModel):
     table: dict[int, Message] = {}
+    _order: SortedKeys = PrivateAttr(default_factory=SortedKeys)
+    _index: dict[IndexKey, SortedKeys] = PrivateAttr(default_factory=dict)
+
+    def model_post_init(self, context: Any) -> None:
+        self._merge_into_index(list(self.table.values()))
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def get_row(self, id: int) -> Message:
+        return self.table[id]
+
+    def maybe_get_row(self, id: int) -> Message | None:
+        return self.table.get(id, None)
+
+    def maybe_get_row_at_or_after(self, id: int) -> Message | None:
+        # the row with the smallest id >= id (a scan, but we only
+        # need it for anchors that aren't in the table)
+        next_id = min((i for i in self.table if i >= id), default=None)
+        return None if next_id is None else self.table[next_id]
+
+    def get_max_id(self) -> int | None:
+        return max(self.table, default=None)
+
+    def get_min_id(self) -> int | None:
+        return min(self.table, default=None)
 
     def get_rows(self) -> list[Message]:
-        return list(self.table.values())
+        return self._get_rows_for_keys(self._order.keys)
+
+    def get_indexed_rows(self, key: IndexKey) -> list[Message]:
+        return self._get_rows_for_keys(self._get_sorted_keys(key).keys)
+
+    def get_rows_before(
+        self, anchor: MessageKey, num: int, *, index_key: IndexKey | None = None
+    ) -> list[Message]:
+        keys = self._get_sorted_keys(index_key).before(anchor, num)
+        return self._get_rows_for_keys(keys)
+
+    def get_rows_after(
+        self,
+        anchor: MessageKey,
+        num: int,
+        *,
+        index_key: IndexKey | None = None,
+        include_anchor: bool = False,
+    ) -> list[Message]:
+        sorted_keys = self._get_sorted_keys(index_key)
+        keys = sorted_keys.after(anchor, num, include_anchor=include_anchor)
+        return self._get_rows_for_keys(keys)
+
+    def get_rows_between(
+        self,
+        start_timestamp: int,
+        end_timestamp: int,
+        *,
+        index_key: IndexKey | None = None,
+    ) -> list[Message]:
+        sorted_keys = self._get_sorted_keys(index_key)
+        keys = sorted_keys.between(start_timestamp, end_timestamp)
+        return self._get_rows_for_keys(keys)
 
     def insert(self, row: Message) -> None:
+        old_row = self.table.get(row.id)
+        if old_row is not None:
+            if has_same_index_keys(old_row, row):
+                # e.g. a content edit, which doesn't move the row
+                self.table[row.id] = row
+                return
+            self._remove_from_index(old_row)
         self.table[row.id] = row
+        self._add_to_index(row)
+
+    def delete(self, id: int) -> bool:
+        row = self.table.pop(id, None)
+        if row is None:
+            return False
+        self._remove_from_index(row)
+        return True
+
+    def insert_many(self, rows: list[Message]) -> None:
+        rows = list({row.id: row for row in rows}.values())
+        for row in rows:
+            old_row = self.table.get(row.id)
+            if old_row is not None:
+                self._remove_from_index(old_row)
+            self.table[row.id] = row
+        self._merge_into_index(rows)
+
+    def _get_rows_for_keys(self, keys: list[MessageKey]) -> list[Message]:
+        table = self.table
+        return [table[id] for _, id in keys]
+
+    def _get_sorted_keys(self, index_key: IndexKey | None) -> SortedKeys:
+        if index_key is None:
+            return self._order
+        return self._index.get(index_key) or SortedKeys()
+
+    def _add_to_index(self, row: Message) -> None:
+        message_key = row.key()
+        self._order.add(message_key)
+        for key in get_index_keys(row):
+            bucket = self._index.get(key)
+            if bucket is None:
+                bucket = self._index[key] = SortedKeys()
+            bucket.add(message_key)
+
+    def _merge_into_index(self, rows: list[Message]) -> None:
+        order_keys: list[MessageKey] = []
+        bucket_keys: dict[IndexKey, list[MessageKey]] = {}
+        for row in rows:
+            message_key = row.key()
+            order_keys.append(message_key)
+            for key in get_index_keys(row):
+                bucket_keys.setdefault(key, []).append(message_key)
+
+        self._order.merge(order_keys)
+        for key, keys in bucket_keys.items():
+            bucket = self._index.get(key)
+            if bucket is None:
+                bucket = self._index[key] = SortedKeys()
+            bucket.merge(keys)
+
+    def _remove_from_index(self, row: Message) -> None:
+        message_key = row.key()
+        self._order.remove(message_key)
+        for key in get_index_keys(row):
+            bucket = self._index[key]
+            bucket.remove(message_key)
+            if not bucket:
+                del self._index[key]
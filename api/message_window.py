@@ -0,0 +1,34 @@
+from dataclasses import dataclass
+from typing import Literal
+
+from filter import MessageFilter
+from hydrated_message import HydratedMessage
+from message import MessageKey
+
+"""
+Instead of handing the UI every message in a narrow, the Service
+returns a MessageWindow: a page of hydrated messages around some
+anchor, plus cursors for fetching the next page in either direction.
+
+Anchors follow the Zulip API (num_before/num_after): either a
+message id or one of "newest"/"oldest".  Cursors hold the
+(timestamp, id) key of the edge message rather than its id, so they
+stay valid even if that message goes away.
+"""
+
+Anchor = int | Literal["newest", "oldest"]
+
+
+@dataclass
+class MessageCursor:
+    narrow: MessageFilter
+    anchor: MessageKey
+
+
+@dataclass
+class MessageWindow:
+    hydrated_messages: list[HydratedMessage]
+    older_cursor: MessageCursor
+    newer_cursor: MessageCursor
+    found_oldest: bool
+    found_newest: bool
@@ -0,0 +1,123 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterator, Sequence
+
+from content import (
+    AnchorNode,
+    AudioNode,
+    ContentNode,
+    InlineImageNode,
+    InlineVideoNode,
+    MessageLinkNode,
+    StreamLinkNode,
+    StreamTopicLinkNode,
+    UserGroupMentionNode,
+    UserGroupMentionSilentNode,
+    UserMentionNode,
+    UserMentionSilentNode,
+    WebsitePreviewNode,
+    ZulipContent,
+)
+from message_parser import get_zulip_contents
+
+"""
+Parsing the whole local history (to build a search index, or in
+test_content.test_real_world) is CPU-bound in lxml and pydantic, so
+parse_in_pool spreads it over a ProcessPoolExecutor.
+
+We hand each worker a shard of SHARD_SIZE messages at a time, and
+the workers send back a ContentSummary per message rather than the
+ZulipContent itself: pickling a big pydantic tree costs about as much
+as parsing it again.  Pass include_ast=True if you really want the
+trees too.
+
+Results come back in the same order as the input.  A message that
+fails to parse gets a summary with the error (as a string, since not
+every exception pickles) and no text.
+"""
+
+SHARD_SIZE = 200
+
+
+@dataclass
+class ContentSummary:
+    text: str | None = None
+    error: str | None = None
+    user_ids: list[int] = field(default_factory=list)
+    user_group_ids: list[int] = field(default_factory=list)
+    stream_ids: list[int] = field(default_factory=list)
+    links: list[str] = field(default_factory=list)
+    media: list[str] = field(default_factory=list)
+    zulip_content: ZulipContent | None = None
+
+
+def iter_nodes(node: ContentNode) -> Iterator[ContentNode]:
+    # Every node, depth first.  Children live in different fields for
+    # different node types (children, thead, img, ...), so we look at
+    # all of them.
+    yield node
+    for value in node.__dict__.values():
+        if isinstance(value, ContentNode):
+            yield from iter_nodes(value)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                if isinstance(item, ContentNode):
+                    yield from iter_nodes(item)
+
+
+def summarize(zulip_content: ZulipContent, *, include_ast: bool) -> ContentSummary:
+    summary = ContentSummary(text=zulip_content.as_text())
+    if include_ast:
+        summary.zulip_content = zulip_content
+
+    for node in iter_nodes(zulip_content):
+        if isinstance(node, (UserMentionNode, UserMentionSilentNode)):
+            summary.user_ids.append(node.user_id)
+        elif isinstance(node, (UserGroupMentionNode, UserGroupMentionSilentNode)):
+            summary.user_group_ids.append(node.group_id)
+        elif isinstance(node, (StreamLinkNode, StreamTopicLinkNode)):
+            summary.stream_ids.append(node.stream_id)
+            summary.links.append(node.href)
+        elif isinstance(node, (AnchorNode, MessageLinkNode, WebsitePreviewNode)):
+            summary.links.append(node.href)
+        elif isinstance(node, InlineImageNode):
+            summary.media.append(node.img.src)
+        elif isinstance(node, (InlineVideoNode, AudioNode)):
+            summary.media.append(node.src)
+    return summary
+
+
+def summarize_shard(
+    htmls: Sequence[str], include_ast: bool = False
+) -> list[ContentSummary]:
+    summaries = []
+    for parsed_message in get_zulip_contents(htmls):
+        if parsed_message.zulip_content is None:
+            summaries.append(ContentSummary(error=repr(parsed_message.error)))
+        else:
+            summaries.append(
+                summarize(parsed_message.zulip_content, include_ast=include_ast)
+            )
+    return summaries
+
+
+def parse_in_pool(
+    htmls: Sequence[str],
+    *,
+    num_workers: int | None = None,
+    include_ast: bool = False,
+    shard_size: int = SHARD_SIZE,
+) -> list[ContentSummary]:
+    num_workers = num_workers or os.cpu_count() or 1
+    shards = [htmls[i : i + shard_size] for i in range(0, len(htmls), shard_size)]
+
+    summaries: list[ContentSummary] = []
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        # map hands back the shards in order, whichever worker
+        # finishes first.
+        for shard_summaries in executor.map(
+            summarize_shard, shards, [include_ast] * len(shards)
+        ):
+            summaries.extend(shard_summaries)
+    return summaries
@@ -5,7 +5,8 @@ from typing import Any
 from zulip import ZulipApi
 
 REGISTER_OPTIONS = dict(
-    apply_markdown=json.dumps(False),
+    # so that message events carry rendered HTML, like GET /messages
+    apply_markdown=json.dumps(True),
     include_subscribers=json.dumps(False),
     client_gravatar=json.dumps(False),
     include_streams=json.dumps(False),
@@ -0,0 +1,99 @@
+import asyncio
+import json
+from typing import Any
+
+import aiohttp
+from user import User
+from user_cache import UserCache
+from zulip import ZulipApi, ZulipApiError
+
+"""
+RemoteUserFetcher is what backs DeferredUserHelper.get_remote_users.
+
+Each call makes (at most) one bulk GET /users request for all the
+ids that the caller's DeferredUserFactory couldn't find locally.
+If some of those ids are already being fetched on behalf of another
+caller (say, two panes rendering at once), we wait on that request
+instead of asking again, so a caller never waits on more than one
+round trip's worth of requests.  The results go into the shared
+UserCache (see user_cache.py), so the next render finds them there.
+
+Servers that don't know the user_ids parameter send us the whole
+realm; we only keep the users that we asked for.
+
+Users the server doesn't give us (e.g. deleted users) come back as
+placeholders, and get cached like everybody else.  If the request
+fails, we return placeholders without caching them, so that we
+try again next time.
+"""
+
+
+def make_placeholder_user(user_id: int) -> User:
+    return User(id=user_id, name=f"Unknown user {user_id}", avatar_url="")
+
+
+class RemoteUserFetcher:
+    def __init__(
+        self, *, zulip_api: ZulipApi | None, host: str, user_cache: UserCache
+    ) -> None:
+        self.zulip_api = zulip_api
+        self.host = host
+        self.user_cache = user_cache
+        self.in_flight: dict[int, asyncio.Task[dict[int, User]]] = {}
+        self.num_requests = 0
+
+    async def get_users(self, user_ids: set[int]) -> dict[int, User]:
+        tasks = {self.in_flight[id] for id in user_ids if id in self.in_flight}
+
+        new_ids = sorted(id for id in user_ids if id not in self.in_flight)
+        if new_ids:
+            task = asyncio.create_task(self.fetch_users(new_ids))
+            for id in new_ids:
+                self.in_flight[id] = task
+            tasks.add(task)
+
+        # Shield the shared requests, so that one caller going away
+        # doesn't cancel them for everybody else.
+        results = await asyncio.gather(*(asyncio.shield(task) for task in tasks))
+
+        user_dict: dict[int, User] = {}
+        for result in results:
+            user_dict.update(result)
+        return {id: user_dict.get(id) or make_placeholder_user(id) for id in user_ids}
+
+    async def fetch_users(self, user_ids: list[int]) -> dict[int, User]:
+        try:
+            raw_users = await self.fetch_raw_users(user_ids)
+        except (ZulipApiError, aiohttp.ClientError) as e:
+            print(f"could not fetch users {user_ids}: {e!r}")
+            return {}
+        finally:
+            for id in user_ids:
+                del self.in_flight[id]
+        if raw_users is None:
+            return {}
+
+        raw_user_dict = {raw_user["user_id"]: raw_user for raw_user in raw_users}
+        user_dict = {}
+        for id in user_ids:
+            raw_user = raw_user_dict.get(id)
+            if raw_user is None:
+                user = make_placeholder_user(id)
+            else:
+                user = User.from_raw(self.host, raw_user)
+            self.user_cache.put(user)
+            user_dict[id] = user
+        return user_dict
+
+    async def fetch_raw_users(self, user_ids: list[int]) -> list[dict[str, Any]] | None:
+        # Returns None when we are offline.
+        if self.zulip_api is None:
+            return None
+        self.num_requests += 1
+        params = dict(
+            user_ids=json.dumps(user_ids),
+            client_gravatar=json.dumps(False),
+        )
+        async with self.zulip_api.GET_json("users", params) as data:
+            members: list[dict[str, Any]] = data["members"]
+            return members
@@ -0,0 +1,140 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import AsyncGenerator, Mapping
+
+"""
+Zulip tells us how much of our rate-limit budget is left on every
+response:
+
+    X-RateLimit-Limit: 200
+    X-RateLimit-Remaining: 187
+    X-RateLimit-Reset: 1700000060   (epoch seconds)
+
+and answers 429 with a Retry-After header once we've overspent it.
+
+RequestScheduler hands out request slots.  It keeps at most
+max_in_flight requests running, and when the budget runs out (or the
+server tells us to back off), it holds new requests until the reset
+time instead of letting them fail.  Waiting requests are served in
+priority order, FIFO within a priority, so an interactive lookup
+jumps ahead of any queued backfill pages.  Backfill also leaves
+BACKFILL_RESERVE requests of the budget unspent, so that interactive
+requests don't have to wait for the reset.
+
+We spend the budget optimistically as we grant slots, and then
+correct it from the headers of each response.
+"""
+
+BACKFILL_RESERVE = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BACKFILL = 1
+
+
+def get_backoff(attempt: int) -> float:
+    # exponential backoff with jitter
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2.0**attempt) * random.uniform(0.5, 1.0)
+
+
+class RequestScheduler:
+    def __init__(self, *, max_in_flight: int) -> None:
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.remaining: int | None = None
+        self.reset_at = 0.0
+        self.paused_until = 0.0
+        self.waiters: list[tuple[int, int, asyncio.Future[None]]] = []
+        self._counter = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority) -> AsyncGenerator[None, None]:
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority: Priority) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self._counter), future))
+        self.dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # We got the slot just as we were cancelled.
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self.dispatch()
+
+    def get_delay(self, priority: Priority) -> float:
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        if now >= self.reset_at:
+            self.remaining = None
+        if self.remaining is None:
+            return 0.0
+        reserve = BACKFILL_RESERVE if priority == Priority.BACKFILL else 0
+        if self.remaining - reserve <= 0:
+            return self.reset_at - now
+        return 0.0
+
+    def dispatch(self) -> None:
+        while self.waiters:
+            priority, _, future = self.waiters[0]
+            if future.cancelled():
+                heapq.heappop(self.waiters)
+                continue
+            if self.in_flight >= self.max_in_flight:
+                return
+            delay = self.get_delay(Priority(priority))
+            if delay > 0:
+                self.wake_up_later(delay)
+                return
+            heapq.heappop(self.waiters)
+            self.in_flight += 1
+            if self.remaining is not None:
+                self.remaining -= 1
+            future.set_result(None)
+
+    def wake_up_later(self, delay: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_later(delay, self.on_timer)
+
+    def on_timer(self) -> None:
+        self._timer = None
+        self.dispatch()
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+        reset_at = time.monotonic() + max(0.0, float(reset) - time.time())
+        if reset_at > self.reset_at + 1:
+            # a new rate-limit window
+            self.remaining = int(remaining)
+        elif self.remaining is None or int(remaining) < self.remaining:
+            self.remaining = int(remaining)
+        self.reset_at = max(self.reset_at, reset_at)
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.remaining = 0
+        self.reset_at = max(self.reset_at, self.paused_until)
@@ -1,28 +1,70 @@
+from typing import Sequence
+
 import data_layer
 from address import Address
+from content_cache import ContentCache
 from database import Database
 from deferred_user import DeferredUserFactory, DeferredUserHelper
-from filter import AddressFilter, DirectMessageFilter, SentByFilter, TopicFilter
+from filter import (
+    AddressFilter,
+    DirectMessageFilter,
+    MessageFilter,
+    SentByFilter,
+    TopicFilter,
+)
 from hydrated_message import HydratedMessage
-from message import Message
+from message import MessageKey, MessageRecord
+from message_window import Anchor, MessageCursor, MessageWindow
+from remote_users import RemoteUserFetcher
+from sorted_keys import NEWEST_KEY, OLDEST_KEY
 from topic import Topic
 from user import User
+from user_cache import UserCache
+from zulip import ZulipApi
+
+WINDOW_SIZE = 50
 
 
 class Service:
-    def __init__(self, database: Database):
+    def __init__(
+        self,
+        database: Database,
+        *,
+        zulip_api: ZulipApi | None = None,
+        host: str = "",
+        content_cache: ContentCache | None = None,
+    ):
         self.database = database
+        self.zulip_api = zulip_api
+        self.content_cache = content_cache or ContentCache()
+        self.user_cache = UserCache()
+        self.remote_user_fetcher = RemoteUserFetcher(
+            zulip_api=zulip_api, host=host, user_cache=self.user_cache
+        )
 
     async def get_remote_users(self, user_ids: set[int]) -> dict[int, User]:
-        # TODO: Actually get remote users!  This function only exists
-        # now to test out async logic.
-        import asyncio
+        return await self.remote_user_fetcher.get_users(user_ids)
+
+    async def process_events(self, on_event: data_layer.EventListener) -> None:
+        # Keep the Database current, telling on_event about each event
+        # after it has been applied.  Runs until cancelled.
+        if self.zulip_api is None:
+            return
+        await data_layer.listen_for_events(
+            self.zulip_api, self.database, on_event=on_event
+        )
 
-        await asyncio.sleep(2)
-        user_dict = {}
-        for user_id in user_ids:
-            user_dict[user_id] = self.database.user_table.get_row(user_id)
-        return user_dict
+    async def get_hydrated_messages_for_ids(
+        self, message_ids: Sequence[int]
+    ) -> list[HydratedMessage]:
+        message_table = self.database.message_table
+        messages: list[MessageRecord] = []
+        for message_id in message_ids:
+            message = message_table.maybe_get_row(message_id)
+            if message is not None:
+                messages.append(message)
+        messages.sort(key=lambda m: m.key())
+        return await self._get_hydrated_messages(messages)
 
     def get_sorted_local_users(self) -> list[User]:
         users = self.database.user_table.get_rows()
@@ -36,45 +78,194 @@ class Service:
         )
 
     def maybe_get_local_user(self, user_id: int) -> User | None:
-        return self.database.user_table.maybe_get_row(user_id)
+        user = self.database.user_table.maybe_get_row(user_id)
+        if user is None:
+            user = self.user_cache.get(user_id)
+        return user
 
-    async def get_messages_sent_by_user(self, user: User) -> list[HydratedMessage]:
-        all_messages = self.database.message_table.get_rows()
-        messages = SentByFilter(user.id).get_rows(all_messages)
-        return await self._get_hydrated_messages(messages)
+    async def get_messages_sent_by_user(
+        self,
+        user: User,
+        *,
+        anchor: Anchor = "newest",
+        num_before: int = WINDOW_SIZE,
+        num_after: int = 0,
+    ) -> MessageWindow:
+        return await self._get_message_window(
+            SentByFilter(user.id),
+            anchor=anchor,
+            num_before=num_before,
+            num_after=num_after,
+        )
 
-    async def get_direct_messages_for_user(self, user: User) -> list[HydratedMessage]:
-        all_messages = self.database.message_table.get_rows()
-        messages = DirectMessageFilter(user_id=user.id).get_rows(all_messages)
-        return await self._get_hydrated_messages(messages)
+    async def get_direct_messages_for_user(
+        self,
+        user: User,
+        *,
+        anchor: Anchor = "newest",
+        num_before: int = WINDOW_SIZE,
+        num_after: int = 0,
+    ) -> MessageWindow:
+        return await self._get_message_window(
+            DirectMessageFilter(user_id=user.id),
+            anchor=anchor,
+            num_before=num_before,
+            num_after=num_after,
+        )
 
-    async def get_messages_for_address(self, address: Address) -> list[HydratedMessage]:
-        all_messages = self.database.message_table.get_rows()
-        messages = AddressFilter(address).get_rows(all_messages)
-        return await self._get_hydrated_messages(messages)
+    async def get_messages_for_address(
+        self,
+        address: Address,
+        *,
+        anchor: Anchor = "newest",
+        num_before: int = WINDOW_SIZE,
+        num_after: int = 0,
+    ) -> MessageWindow:
+        return await self._get_message_window(
+            AddressFilter(address),
+            anchor=anchor,
+            num_before=num_before,
+            num_after=num_after,
+        )
 
-    async def get_messages_for_topic(self, topic: Topic) -> list[HydratedMessage]:
-        all_messages = self.database.message_table.get_rows()
+    async def get_messages_for_topic(
+        self,
+        topic: Topic,
+        *,
+        anchor: Anchor = "newest",
+        num_before: int = WINDOW_SIZE,
+        num_after: int = 0,
+    ) -> MessageWindow:
         topic_id = self.database.topic_table.get_id(topic)
-        messages = TopicFilter(topic_id=topic_id).get_rows(all_messages)
-        return await self._get_hydrated_messages(messages)
+        return await self._get_message_window(
+            TopicFilter(topic_id=topic_id),
+            anchor=anchor,
+            num_before=num_before,
+            num_after=num_after,
+        )
+
+    async def get_older_messages(
+        self, cursor: MessageCursor, num: int = WINDOW_SIZE
+    ) -> MessageWindow:
+        return await self._get_message_window_for_key(
+            cursor.narrow, anchor=cursor.anchor, num_before=num, num_after=0
+        )
+
+    async def get_newer_messages(
+        self, cursor: MessageCursor, num: int = WINDOW_SIZE
+    ) -> MessageWindow:
+        return await self._get_message_window_for_key(
+            cursor.narrow, anchor=cursor.anchor, num_before=0, num_after=num
+        )
+
+    async def _get_message_window(
+        self,
+        narrow: MessageFilter,
+        *,
+        anchor: Anchor,
+        num_before: int,
+        num_after: int,
+    ) -> MessageWindow:
+        if anchor == "newest":
+            anchor_key = NEWEST_KEY
+        elif anchor == "oldest":
+            anchor_key = OLDEST_KEY
+        else:
+            # Like Zulip, if the anchor message isn't there, we snap
+            # to the next message after it (or to the newest one).
+            message_table = self.database.message_table
+            row = message_table.maybe_get_row(anchor)
+            if row is None:
+                row = message_table.maybe_get_row_at_or_after(anchor)
+            anchor_key = NEWEST_KEY if row is None else row.key()
+
+        return await self._get_message_window_for_key(
+            narrow,
+            anchor=anchor_key,
+            num_before=num_before,
+            num_after=num_after,
+            include_anchor=True,
+        )
+
+    async def _get_message_window_for_key(
+        self,
+        narrow: MessageFilter,
+        *,
+        anchor: MessageKey,
+        num_before: int,
+        num_after: int,
+        include_anchor: bool = False,
+    ) -> MessageWindow:
+        message_table = self.database.message_table
+        index_key = narrow.index_key()
+
+        # We fetch one extra message on each side to learn whether
+        # we have hit the end of the narrow.
+        before = message_table.get_rows_before(
+            anchor, num_before + 1, index_key=index_key
+        )
+        found_oldest = len(before) <= num_before
+        before = before[max(0, len(before) - num_before) :]
+
+        after = message_table.get_rows_after(
+            anchor, num_after + 2, index_key=index_key, include_anchor=include_anchor
+        )
+        if after and after[0].key() == anchor:
+            anchor_rows, after = after[:1], after[1:]
+        else:
+            anchor_rows = []
+        found_newest = len(after) <= num_after
+        after = after[:num_after]
+
+        messages: list[MessageRecord] = [*before, *anchor_rows, *after]
+        if messages:
+            first_key = messages[0].key()
+            last_key = messages[-1].key()
+        else:
+            first_key = last_key = anchor
+
+        hydrated_messages = await self._get_hydrated_messages(messages)
+        return MessageWindow(
+            hydrated_messages=hydrated_messages,
+            older_cursor=MessageCursor(narrow=narrow, anchor=first_key),
+            newer_cursor=MessageCursor(narrow=narrow, anchor=last_key),
+            found_oldest=found_oldest,
+            found_newest=found_newest,
+        )
 
     async def _get_hydrated_messages(
-        self, messages: list[Message]
+        self, messages: Sequence[MessageRecord]
     ) -> list[HydratedMessage]:
+        # Collect every user we need (senders and direct message
+        # participants) up front, so that finalize can fetch all of
+        # the remote ones in one round trip.
         factory = DeferredUserFactory()
-        hydrated_messages = [
-            HydratedMessage.create(message=m, factory=factory, database=self.database)
-            for m in messages
-        ]
+        for message in messages:
+            factory.create_user(message.sender_id)
+            if message.address.type == "private":
+                for user_id in message.address.user_ids:
+                    factory.create_user(user_id)
+
         helper = DeferredUserHelper(
             maybe_get_local_user=self.maybe_get_local_user,
             get_remote_users=self.get_remote_users,
         )
         await factory.finalize(helper=helper)
-        return sorted(hydrated_messages, key=lambda m: m.timestamp)
+
+        # The message table hands us messages in timestamp order already.
+        return [
+            HydratedMessage.create(message=m, factory=factory, database=self.database)
+            for m in messages
+        ]
 
 
 async def get_service() -> Service:
     database = await data_layer.get_database()
-    return Service(database)
+    zulip_api = data_layer.make_zulip_api()
+    content_cache = ContentCache(fn=data_layer.CONTENT_CACHE_FN)
+    return Service(
+        database,
+        zulip_api=zulip_api,
+        host=zulip_api.host,
+        content_cache=content_cache,
+    )
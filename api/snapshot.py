@@ -0,0 +1,320 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Any, BinaryIO, Sequence
+
+from address import Address
+from columnar_message_table import ColumnarMessageTable
+from database import Database
+from message import MessageRecord
+from message_table import IndexKey, get_index_keys
+from stream_table import StreamTable
+from topic_table import TopicTable
+from user_table import UserTable
+
+"""
+A binary snapshot of the Database, as a replacement for database.json.
+
+The point is that loading a snapshot doesn't parse or validate every
+message.  We mmap the file, memcpy the fixed-width columns straight
+into a ColumnarMessageTable, and leave the content in a UTF-8 string
+heap that only gets decoded for the rows somebody actually looks at.
+The secondary indexes are stored too, so we don't rebuild them.
+
+Layout (all integers are little-endian int64):
+
+    MAGIC, version
+
+    then one or more segments, each of which is:
+
+        header: b"SEGM", num_rows, metadata_len, num_postings, heap_len
+        metadata: JSON (users, streams, topics, interned addresses,
+                  index directory), padded to 8 bytes
+        columns: ids, sender_ids, timestamps, topic_ids, address_refs
+                 (num_rows each), content_offsets (num_rows + 1)
+        postings: positions for every index bucket, back to back
+        heap: UTF-8 content, padded to 8 bytes
+
+Within a segment, rows are in (timestamp, id) order and every
+bucket's positions are segment-relative.  The small tables (users,
+streams, topics) are cheap to parse, so they just go in the metadata;
+the last segment's copy wins.  Later segments let us append new
+messages without rewriting the file (see append_snapshot).
+
+Convert an existing database.json with:
+
+    python api/snapshot.py database.json database.snapshot
+"""
+
+MAGIC = b"ZULIPSNP"
+VERSION = 1
+FILE_HEADER = struct.Struct("<8sq")
+SEGMENT_HEADER = struct.Struct("<4sqqqq")
+SEGMENT_TAG = b"SEGM"
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def build_segment(database: Database, rows: Sequence[MessageRecord]) -> bytes:
+    ids = array("q")
+    sender_ids = array("q")
+    timestamps = array("q")
+    topic_ids = array("q")
+    address_refs = array("q")
+    content_offsets = array("q", [0])
+    heap = bytearray()
+
+    addresses: list[Address] = []
+    address_ref_dict: dict[str, int] = {}
+    buckets: dict[IndexKey, array[int]] = {}
+
+    rows = sorted(rows, key=lambda m: m.key())
+
+    for position, row in enumerate(rows):
+        address = row.address
+        address_key = address.key()
+        address_ref = address_ref_dict.get(address_key)
+        if address_ref is None:
+            address_ref = address_ref_dict[address_key] = len(addresses)
+            addresses.append(address)
+
+        ids.append(row.id)
+        sender_ids.append(row.sender_id)
+        timestamps.append(row.timestamp)
+        topic_ids.append(address.topic_id)
+        address_refs.append(address_ref)
+        heap += row.content.encode("utf-8")
+        content_offsets.append(len(heap))
+
+        for key in get_index_keys(row):
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = array("q")
+            bucket.append(position)
+
+    postings = array("q")
+    index_directory = []
+    for (kind, value), bucket in buckets.items():
+        index_directory.append([kind, value, len(postings), len(bucket)])
+        postings.extend(bucket)
+
+    metadata = dict(
+        current_user_id=database.current_user_id,
+        user_table=database.user_table.model_dump(mode="json"),
+        stream_table=database.stream_table.model_dump(mode="json"),
+        topic_table=database.topic_table.model_dump(mode="json"),
+        addresses=[
+            [address.type, address.topic_id, sorted(address.user_ids)]
+            for address in addresses
+        ],
+        ids_sorted=list(ids) == sorted(ids),
+        index=index_directory,
+    )
+    metadata_bytes = json.dumps(metadata).encode("utf-8")
+    metadata_len = pad8(len(metadata_bytes))
+    heap_len = len(heap)
+
+    parts = [
+        SEGMENT_HEADER.pack(
+            SEGMENT_TAG, len(rows), metadata_len, len(postings), heap_len
+        ),
+        metadata_bytes.ljust(metadata_len, b" "),
+        ids.tobytes(),
+        sender_ids.tobytes(),
+        timestamps.tobytes(),
+        topic_ids.tobytes(),
+        address_refs.tobytes(),
+        content_offsets.tobytes(),
+        postings.tobytes(),
+        bytes(heap).ljust(pad8(heap_len), b"\0"),
+    ]
+    return b"".join(parts)
+
+
+def write_snapshot(database: Database, fn: str) -> None:
+    # Write to a temp file and rename, so that a process that has the
+    # old snapshot mapped never sees it change underneath it.
+    tmp_fn = fn + ".tmp"
+    with open(tmp_fn, "wb") as f:
+        f.write(FILE_HEADER.pack(MAGIC, VERSION))
+        f.write(build_segment(database, database.message_table.get_rows()))
+        f.flush()
+        os.fsync(f.fileno())
+
+    # If the database came from read_snapshot(fn) (say, we're compacting
+    # it after a backfill), it still has the old file mapped, and
+    # Windows won't let us replace a mapped file.
+    message_table = database.message_table
+    if isinstance(message_table, ColumnarMessageTable):
+        message_table.release_mappings()
+    os.replace(tmp_fn, fn)
+
+
+def append_snapshot(database: Database, fn: str, rows: Sequence[MessageRecord]) -> None:
+    """
+    Append rows to the snapshot as a new segment.  The database is
+    usually the one we got from read_snapshot(fn), so it still has the
+    file mapped.  Writing past the end of a mapped file is fine, but
+    truncating it is not (Windows refuses, and on POSIX, touching the
+    lost pages through the mapping raises SIGBUS), so if we have to
+    drop a torn segment first, we release the database's mapping.
+    """
+    with open(fn, "r+b") as f:
+        end = get_valid_length(f)
+        if end < os.fstat(f.fileno()).st_size:
+            # Drop the torn segment left behind by an interrupted append.
+            message_table = database.message_table
+            if isinstance(message_table, ColumnarMessageTable):
+                message_table.release_mappings()
+            f.truncate(end)
+        f.seek(end)
+        f.write(build_segment(database, rows))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_segment(
+    buf: memoryview, offset: int, message_table: ColumnarMessageTable
+) -> tuple[int, dict[str, Any]]:
+    tag, num_rows, metadata_len, num_postings, heap_len = SEGMENT_HEADER.unpack_from(
+        buf, offset
+    )
+    if tag != SEGMENT_TAG:
+        raise SnapshotError(f"bad segment tag at offset {offset}")
+    offset += SEGMENT_HEADER.size
+
+    metadata = json.loads(bytes(buf[offset : offset + metadata_len]))
+    offset += metadata_len
+
+    def take(num_bytes: int) -> memoryview:
+        nonlocal offset
+        chunk = buf[offset : offset + num_bytes]
+        offset += num_bytes
+        return chunk
+
+    column_len = 8 * num_rows
+    ids = take(column_len)
+    sender_ids = take(column_len)
+    timestamps = take(column_len)
+    topic_ids = take(column_len)
+    address_refs = take(column_len)
+    content_offsets = take(column_len + 8).cast("q")
+    postings = take(8 * num_postings)
+    heap = take(pad8(heap_len))[:heap_len]
+
+    index = {
+        (kind, value): postings[8 * start : 8 * (start + count)]
+        for kind, value, start, count in metadata["index"]
+    }
+    addresses = [
+        Address(type=type, topic_id=topic_id, user_ids=set(user_ids))
+        for type, topic_id, user_ids in metadata["addresses"]
+    ]
+
+    message_table.append_segment(
+        ids=ids,
+        sender_ids=sender_ids,
+        timestamps=timestamps,
+        topic_ids=topic_ids,
+        address_refs=address_refs,
+        addresses=addresses,
+        heap=heap,
+        content_offsets=content_offsets,
+        index=index,
+        ids_sorted=metadata["ids_sorted"],
+    )
+    return offset, metadata
+
+
+def get_segment_size(header: bytes | memoryview) -> int:
+    _, num_rows, metadata_len, num_postings, heap_len = SEGMENT_HEADER.unpack_from(
+        header
+    )
+    size = (
+        SEGMENT_HEADER.size
+        + metadata_len
+        + 8 * (6 * num_rows + 1)
+        + 8 * num_postings
+        + pad8(heap_len)
+    )
+    return int(size)
+
+
+def segment_size(buf: memoryview, offset: int) -> int | None:
+    # Returns None for a truncated (torn) segment at the end of the file.
+    if offset + SEGMENT_HEADER.size > len(buf):
+        return None
+    size = get_segment_size(buf[offset : offset + SEGMENT_HEADER.size])
+    if offset + size > len(buf):
+        return None
+    return size
+
+
+def get_valid_length(f: BinaryIO) -> int:
+    # Like segment_size, but reading just the segment headers from the
+    # file, so that we don't need to map it.
+    file_len = os.fstat(f.fileno()).st_size
+    offset = FILE_HEADER.size
+    while offset + SEGMENT_HEADER.size <= file_len:
+        f.seek(offset)
+        size = get_segment_size(f.read(SEGMENT_HEADER.size))
+        if offset + size > file_len:
+            break
+        offset += size
+    return offset
+
+
+def read_snapshot(fn: str) -> Database:
+    with open(fn, "rb") as f:
+        # The mapping stays alive as long as the table references it
+        # (see ColumnarMessageTable.release_mappings).
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    buf = memoryview(mapped)
+    magic, version = FILE_HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+        raise SnapshotError(f"{fn} is not a version {VERSION} snapshot")
+
+    message_table = ColumnarMessageTable()
+    message_table.mappings.append(mapped)
+    metadata: dict[str, Any] | None = None
+    offset = FILE_HEADER.size
+
+    while offset < len(buf):
+        if segment_size(buf, offset) is None:
+            print(f"ignoring truncated segment at end of {fn}")
+            break
+        offset, metadata = read_segment(buf, offset, message_table)
+
+    if metadata is None:
+        raise SnapshotError(f"{fn} has no segments")
+
+    return Database(
+        current_user_id=metadata["current_user_id"],
+        message_table=message_table,
+        user_table=UserTable.model_validate(metadata["user_table"]),
+        stream_table=StreamTable.model_validate(metadata["stream_table"]),
+        topic_table=TopicTable.model_validate(metadata["topic_table"]),
+    )
+
+
+def convert_json_to_snapshot(json_fn: str, snapshot_fn: str) -> None:
+    with open(json_fn, encoding="utf8") as database_file:
+        database = Database.model_validate_json(database_file.read())
+    write_snapshot(database, snapshot_fn)
+    print(f"converted {json_fn} to {snapshot_fn}")
+
+
+if __name__ == "__main__":
+    json_fn = sys.argv[1] if len(sys.argv) > 1 else "database.json"
+    snapshot_fn = sys.argv[2] if len(sys.argv) > 2 else "database.snapshot"
+    convert_json_to_snapshot(json_fn, snapshot_fn)
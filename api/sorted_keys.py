@@ -0,0 +1,72 @@
+import sys
+from bisect import bisect_left, bisect_right, insort
+
+from message import MessageKey
+
+"""
+SortedKeys keeps message keys in (timestamp, id) order, so that
+"N before/after some anchor" and "between two timestamps" are just
+bisects plus a slice.
+
+Messages almost always arrive in order, so inserting is usually an
+append.  Out-of-order inserts (backfill, for example) fall back to
+insort, which is a memmove rather than a re-sort.
+"""
+
+OLDEST_KEY: MessageKey = (-sys.maxsize, -sys.maxsize)
+NEWEST_KEY: MessageKey = (sys.maxsize, sys.maxsize)
+
+
+class SortedKeys:
+    def __init__(self) -> None:
+        self.keys: list[MessageKey] = []
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, key: MessageKey) -> None:
+        keys = self.keys
+        if not keys or key > keys[-1]:
+            keys.append(key)
+        else:
+            insort(keys, key)
+
+    def merge(self, keys: list[MessageKey]) -> None:
+        # Bulk version of add.  Timsort finds the two sorted runs, so
+        # merging costs a linear pass rather than one insort per key.
+        if not keys:
+            return
+        keys = sorted(keys)
+        if not self.keys or keys[0] > self.keys[-1]:
+            self.keys.extend(keys)
+        elif keys[-1] < self.keys[0]:
+            # e.g. backfilling older history
+            self.keys[:0] = keys
+        else:
+            self.keys = sorted(self.keys + keys)
+
+    def remove(self, key: MessageKey) -> None:
+        i = bisect_left(self.keys, key)
+        assert self.keys[i] == key
+        del self.keys[i]
+
+    def before(self, anchor: MessageKey, num: int) -> list[MessageKey]:
+        # strictly before the anchor
+        i = bisect_left(self.keys, anchor)
+        return self.keys[max(0, i - num) : i]
+
+    def after(
+        self, anchor: MessageKey, num: int, *, include_anchor: bool = False
+    ) -> list[MessageKey]:
+        # strictly after the anchor, unless include_anchor is set
+        if include_anchor:
+            i = bisect_left(self.keys, anchor)
+        else:
+            i = bisect_right(self.keys, anchor)
+        return self.keys[i : i + num]
+
+    def between(self, start_timestamp: int, end_timestamp: int) -> list[MessageKey]:
+        # inclusive on both ends
+        lo = bisect_left(self.keys, (start_timestamp, -sys.maxsize))
+        hi = bisect_right(self.keys, (end_timestamp, sys.maxsize))
+        return self.keys[lo:hi]
@@ -0,0 +1,134 @@
+import re
+
+from content import (
+    BlockContentNode,
+    BlockWhiteSpaceNode,
+    EmojiSpanNode,
+    InlineContentNode,
+    ParagraphNode,
+    TextNode,
+    UserMentionNode,
+    UserMentionSilentNode,
+    ZulipContent,
+)
+
+"""
+Most chat messages are a paragraph or two of plain text, maybe with
+an emoji or a user mention.  For those, going through lxml, the
+TagElement wrappers, the from_tag_element dispatch and the round
+trip check is a lot of work to end up with a ParagraphNode full of
+TextNodes.
+
+maybe_get_trivial_content recognizes exactly those shapes in the raw
+HTML and builds the ZulipContent directly.  It returns None for
+anything else, and the caller falls back to the full parser.
+
+The shapes are narrow on purpose: we only accept HTML that lxml
+would parse to the tree we build, and that our as_html would write
+back out byte for byte (so the round trip check would pass; we skip
+it).  That's why, for example, emoji codes must be lowercase and
+zero-padded, text must not contain raw ">", and the only entities
+we decode are the ones below.  test_content.test_trivial_content
+checks that we build the same tree as the full parser.
+
+The layout is paragraphs separated by single newlines:
+
+    <p>...</p>\n<p>...</p>
+
+where each paragraph holds text, emoji spans and user mentions.
+"""
+
+ENTITIES = {
+    "&amp;": "&",
+    "&lt;": "<",
+    "&gt;": ">",
+    "&quot;": '"',
+    "&#39;": "'",
+}
+# Control characters, U+0080 (which escape_text leaves alone), lone
+# surrogates and the non-characters all get mangled on the way
+# through lxml, so we leave them to the full parser.
+TEXT_CHAR = r"[^<>&\x00-\x09\x0b-\x1f\x7f\x80\ud800-\udfff\ufffe\uffff]"
+ENTITY = "|".join(ENTITIES)
+TEXT_RUN = rf"(?:{TEXT_CHAR}|{ENTITY})+"
+
+INLINE_PATTERN = re.compile(
+    rf"(?P<text>{TEXT_RUN})"
+    r'|<span aria-label="(?P<title>[a-z0-9_ +\-]+)"'
+    r' class="emoji emoji-(?P<codes>[0-9a-f]+(?:-[0-9a-f]+)*)"'
+    r' role="img" title="(?P=title)">:(?P<emoji_name>[a-z0-9_+\-]+):</span>'
+    r'|<span class="user-mention(?P<silent> silent)?"'
+    rf' data-user-id="(?P<user_id>0|[1-9][0-9]*)">(?P<name>{TEXT_RUN})</span>'
+)
+PARAGRAPH_PATTERN = re.compile(r"<p>(.*?)</p>(\n)?", re.DOTALL)
+ENTITY_PATTERN = re.compile(ENTITY)
+
+
+def unescape(text: str) -> str:
+    if "&" not in text:
+        return text
+    return ENTITY_PATTERN.sub(lambda m: ENTITIES[m.group(0)], text)
+
+
+def maybe_get_emoji_node(title: str, codes: str, name: str) -> EmojiSpanNode | None:
+    if name != title.replace(" ", "_"):
+        return None
+    unicode_points = []
+    for code in codes.split("-"):
+        unicode_point = int(code, 16)
+        # as_html writes the codes back out with at least 4 digits
+        if unicode_point > 0x10FFFF or code != f"{unicode_point:04x}":
+            return None
+        unicode_points.append(unicode_point)
+    return EmojiSpanNode(title=title, unicode_points=unicode_points)
+
+
+def maybe_get_inline_nodes(html: str) -> list[InlineContentNode] | None:
+    nodes: list[InlineContentNode] = []
+    pos = 0
+    while pos < len(html):
+        m = INLINE_PATTERN.match(html, pos)
+        if m is None:
+            return None
+        pos = m.end()
+
+        node: InlineContentNode | None
+        if m.group("text") is not None:
+            node = TextNode(value=unescape(m.group("text")))
+        elif m.group("codes") is not None:
+            node = maybe_get_emoji_node(
+                m.group("title"), m.group("codes"), m.group("emoji_name")
+            )
+        elif m.group("silent"):
+            node = UserMentionSilentNode(
+                name=unescape(m.group("name")), user_id=int(m.group("user_id"))
+            )
+        else:
+            node = UserMentionNode(
+                name=unescape(m.group("name")), user_id=int(m.group("user_id"))
+            )
+        if node is None:
+            return None
+        nodes.append(node)
+    return nodes
+
+
+def maybe_get_trivial_content(html: str) -> ZulipContent | None:
+    if not html.startswith("<p>"):
+        return None
+
+    children: list[BlockContentNode] = []
+    pos = 0
+    while pos < len(html):
+        m = PARAGRAPH_PATTERN.match(html, pos)
+        if m is None:
+            return None
+        pos = m.end()
+
+        inline_nodes = maybe_get_inline_nodes(m.group(1))
+        if inline_nodes is None:
+            return None
+        children.append(ParagraphNode(children=inline_nodes))
+        if m.group(2) is not None:
+            children.append(BlockWhiteSpaceNode(value="\n"))
+    return ZulipContent(children=children)
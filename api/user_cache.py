@@ -0,0 +1,84 @@
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from user import User
+
+"""
+UserCache holds the users that we had to fetch from the server (see
+remote_users.py), i.e. the ones that aren't in the UserTable that
+register gave us.  One cache is shared by the whole Service, so a
+user fetched for one narrow is still there for the next one.
+
+It is bounded two ways:
+
+    - Entries older than ttl seconds are treated as misses, so we
+      refetch them (and pick up renames and new avatars).
+    - Once we hold max_size users, we evict the least recently
+      used one.
+
+The hit/miss counters are there to help pick max_size and ttl for
+big realms.
+"""
+
+USER_CACHE_SIZE = 10_000
+USER_CACHE_TTL = 15 * 60.0
+
+
+class UserCache:
+    def __init__(
+        self,
+        *,
+        max_size: int = USER_CACHE_SIZE,
+        ttl: float = USER_CACHE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries: OrderedDict[int, tuple[User, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, user_id: int) -> User | None:
+        entry = self.entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        user, fetched_at = entry
+        if self.clock() - fetched_at >= self.ttl:
+            del self.entries[user_id]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(user_id)
+        self.hits += 1
+        return user
+
+    def put(self, user: User) -> None:
+        self.entries[user.id] = (user, self.clock())
+        self.entries.move_to_end(user.id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get_stats(self) -> dict[str, int | float]:
+        return dict(
+            size=len(self.entries),
+            hits=self.hits,
+            misses=self.misses,
+            expirations=self.expirations,
+            evictions=self.evictions,
+            hit_rate=self.get_hit_rate(),
+        )
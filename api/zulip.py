@@ -1,74 +1,325 @@
+import asyncio
+import time
 from contextlib import asynccontextmanager
-from dataclasses import asdict
+from dataclasses import asdict, replace
+from types import TracebackType
 from typing import Any, AsyncGenerator, Callable
 
 import aiohttp
-from event_info import EventInfo
+from event_info import EventInfo, EventMetrics
+from request_scheduler import Priority, RequestScheduler, get_backoff
+
+"""
+ZulipApi owns one long-lived aiohttp session, so that requests reuse
+pooled keep-alive connections instead of paying for a new TCP (and
+TLS) handshake every time.  The pool is shared by all callers,
+including the event long-poll, which holds one connection while it
+waits.
+
+Use it as an async context manager, so the session gets closed:
+
+    async with ZulipApi(HOST, USER_NAME, API_KEY) as zulip_api:
+        ...
+
+GET_json and POST_json go through a RequestScheduler (see
+request_scheduler.py), which keeps us within the server's rate
+limits and serves interactive requests ahead of backfill.  We retry
+429s (after Retry-After), and for GETs, which are safe to resend,
+5xx responses and dropped connections, with exponential backoff.
+One pooled connection is left outside the scheduler for the event
+long-poll.
+
+process_events pipelines the event long-poll: one task receives
+batches of events into a bounded queue and immediately issues the
+next poll, while another task applies the queued events.  If the
+applier falls behind and the queue fills up, the receiver waits
+for room before it polls again.  That's safe, because the server
+holds on to any events that we haven't asked for yet.
+
+The receiver survives dropped connections and server errors by
+polling again (with backoff) on the same queue.  The server sends a
+heartbeat event about once a minute, so a poll that hears nothing
+for HEARTBEAT_TIMEOUT is presumed dead and gets retried right away.
+The server garbage-collects queues that nobody polls for
+EVENT_QUEUE_LIFETIME.  If we can't get through for nearly that long
+(EVENT_QUEUE_GIVE_UP, so that we never poll a queue that the server
+may have just dropped), or the server says BAD_EVENT_QUEUE_ID, we
+raise EventQueueExpired (after applying whatever we already
+received), and the caller re-registers and catches up (see
+data_layer.run_event_loop).
+"""
+
+POOL_SIZE = 8
+KEEPALIVE_TIMEOUT = 60.0
+MAX_ATTEMPTS = 5
+EVENT_QUEUE_SIZE = 1_000
+HEARTBEAT_TIMEOUT = 90.0
+EVENT_QUEUE_LIFETIME = 10 * 60.0
+EVENT_QUEUE_GIVE_UP = EVENT_QUEUE_LIFETIME - 60.0
+
+
+class ZulipApiError(Exception):
+    pass
+
+
+class EventQueueExpired(ZulipApiError):
+    pass
+
+
+class EventPollFailed(ZulipApiError):
+    # a transient failure; we poll again on the same queue
+    def __init__(self, message: str, *, retry_after: float | None = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def get_retry_after(headers: Any) -> float | None:
+    retry_after = headers.get("Retry-After")
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        return None
 
 
 class ZulipApi:
-    def __init__(self, host: str, user_name: str, api_key: str) -> None:
+    def __init__(
+        self,
+        host: str,
+        user_name: str,
+        api_key: str,
+        *,
+        pool_size: int = POOL_SIZE,
+        keepalive_timeout: float = KEEPALIVE_TIMEOUT,
+    ) -> None:
+        self.host = host
+        self.user_name = user_name
         self.auth = aiohttp.BasicAuth(user_name, api_key)
         self.url_prefix = host + "/api/v1/"
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self._session: aiohttp.ClientSession | None = None
+        self.scheduler = RequestScheduler(max_in_flight=max(1, pool_size - 1))
+
+    async def __aenter__(self) -> "ZulipApi":
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        await self.close()
+
+    def get_session(self) -> aiohttp.ClientSession:
+        # We create the session lazily, since aiohttp wants it created
+        # inside the event loop that uses it.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Authorization": self.auth.encode()},
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
 
     @asynccontextmanager
     async def post(
         self, url_ending: str, data: dict[str, Any]
     ) -> AsyncGenerator[Any, None]:
-        async with aiohttp.ClientSession() as session:
-            url = self.url_prefix + url_ending
-            async with session.post(url, auth=self.auth, data=data) as response:
-                yield response
+        url = self.url_prefix + url_ending
+        async with self.get_session().post(url, data=data) as response:
+            yield response
 
     @asynccontextmanager
     async def POST_json(
-        self, url_ending: str, data: dict[str, Any]
+        self,
+        url_ending: str,
+        data: dict[str, Any],
+        *,
+        priority: Priority = Priority.INTERACTIVE,
     ) -> AsyncGenerator[Any, None]:
-        async with self.post(url_ending, data) as response:
-            assert response.status == 200
-            yield await response.json()
+        yield await self.fetch_json("POST", url_ending, data, priority=priority)
 
     @asynccontextmanager
     async def get(
         self, url_ending: str, params: dict[str, Any]
     ) -> AsyncGenerator[Any, None]:
-        async with aiohttp.ClientSession() as session:
-            url = self.url_prefix + url_ending
-            async with session.get(url, auth=self.auth, params=params) as response:
-                yield response
+        url = self.url_prefix + url_ending
+        async with self.get_session().get(url, params=params) as response:
+            yield response
 
     @asynccontextmanager
     async def GET_json(
-        self, url_ending: str, params: dict[str, Any]
+        self,
+        url_ending: str,
+        params: dict[str, Any],
+        *,
+        priority: Priority = Priority.INTERACTIVE,
     ) -> AsyncGenerator[Any, None]:
-        for _ in range(5):
-            async with self.get(url_ending, params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    assert data["result"] == "success"
-                    yield data
-                    return
-                else:
-                    print(response.status)
-                    print(response.text)
-                    print(await response.json())
-                    raise Exception("invalid response")
+        yield await self.fetch_json("GET", url_ending, params, priority=priority)
+
+    async def fetch_json(
+        self,
+        method: str,
+        url_ending: str,
+        payload: dict[str, Any],
+        *,
+        priority: Priority,
+    ) -> Any:
+        can_resend = method == "GET"
+        request = self.get if method == "GET" else self.post
+
+        for attempt in range(MAX_ATTEMPTS):
+            delay = get_backoff(attempt)
+            async with self.scheduler.slot(priority):
+                try:
+                    async with request(url_ending, payload) as response:
+                        self.scheduler.update(response.headers)
+                        if response.status == 200:
+                            data = await response.json()
+                            if data["result"] != "success":
+                                raise ZulipApiError(f"{url_ending}: {data}")
+                            return data
+
+                        if response.status == 429:
+                            retry_after = get_retry_after(response.headers)
+                            self.scheduler.pause(retry_after or delay)
+                            # The scheduler holds our retry until then.
+                            delay = 0
+                        elif not (can_resend and response.status >= 500):
+                            text = await response.text()
+                            raise ZulipApiError(
+                                f"{method} {url_ending}: {response.status} {text}"
+                            )
+                        print(f"{method} {url_ending}: {response.status}, will retry")
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    if not can_resend:
+                        raise
+                    print(f"{method} {url_ending}: {e!r}, will retry")
+            await asyncio.sleep(delay)
+
+        raise ZulipApiError(
+            f"{method} {url_ending}: gave up after {MAX_ATTEMPTS} tries"
+        )
+
+    async def poll_events(self, event_info: EventInfo) -> Any:
+        url = self.url_prefix + "events"
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=HEARTBEAT_TIMEOUT)
+        session = self.get_session()
+        params = asdict(event_info)
+        async with session.get(url, params=params, timeout=timeout) as response:
+            if response.status == 200:
+                return await response.json()
+            if response.status == 400:
+                data = await response.json()
+                if data.get("code") == "BAD_EVENT_QUEUE_ID":
+                    raise EventQueueExpired(data.get("msg", "BAD_EVENT_QUEUE_ID"))
+            if response.status == 429 or response.status >= 500:
+                retry_after = get_retry_after(response.headers)
+                raise EventPollFailed(
+                    f"events: {response.status}", retry_after=retry_after
+                )
+            text = await response.text()
+            raise ZulipApiError(f"events: {response.status} {text}")
 
     async def process_events(
-        self, *, event_info: EventInfo, callback: Callable[[dict[str, object]], None]
+        self,
+        *,
+        event_info: EventInfo,
+        callback: Callable[[dict[str, Any]], None],
+        metrics: EventMetrics | None = None,
+        queue_size: int = EVENT_QUEUE_SIZE,
     ) -> None:
-        async with aiohttp.ClientSession() as session:
-            url = self.url_prefix + "events"
+        if metrics is None:
+            metrics = EventMetrics()
+        queue: asyncio.Queue[tuple[float, dict[str, Any]]] = asyncio.Queue(queue_size)
+
+        async def receive_events() -> None:
+            try:
+                await poll_into_queue()
+            except EventQueueExpired:
+                # Apply what we already received (and acknowledged)
+                # before the caller re-registers.
+                await queue.join()
+                raise
+
+        # The poller acknowledges events as it queues them, but
+        # event_info.last_event_id only moves once an event has been
+        # applied, so that it always tells the caller how far the
+        # Database has really got.
+        poll_info = replace(event_info)
+
+        async def poll_into_queue() -> None:
             print("WAITING FOR EVENTS (infinite loop)")
+            last_contact = time.monotonic()
+            attempt = 0
             while True:
-                print("---> start new get")
-                async with session.get(
-                    url, auth=self.auth, params=asdict(event_info)
-                ) as response:
-                    assert response.status == 200
-                    data = await response.json()
-                    for event in data["events"]:
-                        callback(event)
-                        event_info.last_event_id = max(
-                            event_info.last_event_id, event["id"]
-                        )
+                try:
+                    data = await self.poll_events(poll_info)
+                except (
+                    EventPollFailed,
+                    aiohttp.ClientError,
+                    asyncio.TimeoutError,
+                ) as e:
+                    if time.monotonic() - last_contact > EVENT_QUEUE_GIVE_UP:
+                        raise EventQueueExpired(f"no contact since {e!r}")
+                    retry_after = getattr(e, "retry_after", None)
+                    delay = retry_after or get_backoff(attempt)
+                    print(f"event poll failed ({e!r}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    attempt = min(attempt + 1, MAX_ATTEMPTS)
+                    continue
+                last_contact = time.monotonic()
+                attempt = 0
+                metrics.num_polls += 1
+
+                received_at = time.monotonic()
+                for event in data["events"]:
+                    poll_info.last_event_id = max(poll_info.last_event_id, event["id"])
+                    if queue.full():
+                        start = time.monotonic()
+                        await queue.put((received_at, event))
+                        metrics.blocked_time += time.monotonic() - start
+                    else:
+                        queue.put_nowait((received_at, event))
+                    metrics.num_received += 1
+                    metrics.queue_depth = queue.qsize()
+                    metrics.max_queue_depth = max(
+                        metrics.max_queue_depth, metrics.queue_depth
+                    )
+
+        async def apply_events() -> None:
+            while True:
+                received_at, event = await queue.get()
+                try:
+                    callback(event)
+                finally:
+                    queue.task_done()
+                event_info.last_event_id = max(event_info.last_event_id, event["id"])
+                metrics.num_applied += 1
+                metrics.queue_depth = queue.qsize()
+                metrics.lag = time.monotonic() - received_at
+                metrics.max_lag = max(metrics.max_lag, metrics.lag)
+                # Let the receiver run between events, so that it can
+                # get the next poll going while we work through a batch.
+                await asyncio.sleep(0)
+
+        tasks = [
+            asyncio.create_task(receive_events()),
+            asyncio.create_task(apply_events()),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,91 @@
+"""
+Compare reloading parsed content from content_codec bytes with
+parsing the HTML again.
+
+Run from the top of the repo:
+
+    python benchmarks/ast_reload.py [num_messages]
+
+We use the messages in database.snapshot (falling back to
+markdown_test_cases.json if you haven't synced a snapshot), and
+report messages/sec for:
+
+    parse:   get_zulip_content (the fast path, else lxml and the
+             full parser, with the round trip check)
+    encode:  encode_content
+    decode:  decode_content
+
+plus the total size of the encoded trees, the HTML, and the as_dict
+JSON.  Messages that don't parse are left out.
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.append("api")
+
+from content_codec import decode_content, encode_content
+from message_parser import get_zulip_contents
+from snapshot import read_snapshot
+
+NUM_MESSAGES = 20_000
+NUM_REPEATS = 5
+
+
+def get_htmls(num_messages):
+    if os.path.exists("database.snapshot"):
+        database = read_snapshot("database.snapshot")
+        rows = database.message_table.get_rows()
+        return "database.snapshot", [m.content for m in rows[-num_messages:]]
+
+    with open("markdown_test_cases.json", encoding="utf8") as f:
+        fixtures = json.load(f)
+    htmls = [fixture["expected_output"] for fixture in fixtures["regular_tests"]]
+    return "markdown_test_cases.json", htmls
+
+
+def time_rate(label, f, items):
+    # Small corpora get repeated, so that the timing means something,
+    # and we report the best of NUM_REPEATS.
+    num_rounds = max(1, 5000 // len(items))
+    best = float("inf")
+    for _ in range(NUM_REPEATS):
+        t = time.perf_counter()
+        for _ in range(num_rounds):
+            for item in items:
+                f(item)
+        best = min(best, time.perf_counter() - t)
+    rate = num_rounds * len(items) / best
+    print(f"{label:>7}: {rate:9.0f} messages/sec")
+    return rate
+
+
+def main():
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_MESSAGES
+    source, htmls = get_htmls(num_messages)
+    parsed_messages = get_zulip_contents(htmls)
+    htmls = [h for h, m in zip(htmls, parsed_messages) if m.error is None]
+    nodes = [m.zulip_content for m in parsed_messages if m.error is None]
+    blobs = [encode_content(node) for node in nodes]
+    print(f"{len(htmls)} messages from {source}")
+
+    def parse(html):
+        get_zulip_contents([html])
+
+    parse_rate = time_rate("parse", parse, htmls)
+    time_rate("encode", encode_content, nodes)
+    decode_rate = time_rate("decode", decode_content, blobs)
+    print(f"decode is {decode_rate / parse_rate:.1f}x as fast as parse")
+
+    html_size = sum(len(h.encode()) for h in htmls)
+    blob_size = sum(len(b) for b in blobs)
+    json_size = sum(len(json.dumps(node.as_dict()).encode()) for node in nodes)
+    print(f"   HTML: {html_size:9} bytes")
+    print(f"encoded: {blob_size:9} bytes")
+    print(f"as_dict: {json_size:9} bytes (JSON)")
+
+
+if __name__ == "__main__":
+    main()
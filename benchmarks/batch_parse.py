@@ -0,0 +1,87 @@
+"""
+Measure messages/sec for parsing the real-world corpus in batches.
+
+Run from the top of the repo:
+
+    python benchmarks/batch_parse.py [num_messages]
+
+We parse the messages in database.snapshot (falling back to
+markdown_test_cases.json if you haven't synced a snapshot) two ways:
+
+    fresh parser: a new lxml HTMLParser per message, like
+                  get_zulip_content used to do
+    batch:        get_zulip_contents, which reuses the thread's parsers
+
+Messages that we can't parse count towards messages/sec (they still
+cost time), and we report how many there were.
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.append("api")
+
+from html_element import TagElement
+from lxml import etree
+from message_parser import RECOVER_PATTERN, build_zulip_content, get_zulip_contents
+from snapshot import read_snapshot
+
+NUM_MESSAGES = 20_000
+NUM_REPEATS = 5
+
+
+def get_htmls(num_messages):
+    if os.path.exists("database.snapshot"):
+        database = read_snapshot("database.snapshot")
+        rows = database.message_table.get_rows()
+        return "database.snapshot", [m.content for m in rows[-num_messages:]]
+
+    with open("markdown_test_cases.json", encoding="utf8") as f:
+        fixtures = json.load(f)
+    htmls = [fixture["expected_output"] for fixture in fixtures["regular_tests"]]
+    return "markdown_test_cases.json", htmls
+
+
+def parse_with_fresh_parsers(htmls):
+    num_errors = 0
+    for html in htmls:
+        parser = etree.HTMLParser(recover=bool(RECOVER_PATTERN.search(html)))
+        try:
+            root = etree.fromstring("<body>" + html + "</body>", parser=parser)
+            build_zulip_content(TagElement(root))
+        except Exception:
+            num_errors += 1
+    return num_errors
+
+
+def parse_in_batch(htmls):
+    parsed_messages = get_zulip_contents(htmls)
+    return sum(1 for m in parsed_messages if m.error is not None)
+
+
+def run(label, parse, htmls):
+    # Small corpora get repeated, so that the timing means something,
+    # and we report the best of NUM_REPEATS.
+    num_rounds = max(1, 5000 // len(htmls))
+    best = float("inf")
+    for _ in range(NUM_REPEATS):
+        t = time.perf_counter()
+        for _ in range(num_rounds):
+            num_errors = parse(htmls)
+        best = min(best, time.perf_counter() - t)
+    rate = num_rounds * len(htmls) / best
+    print(f"{label:>13}: {rate:8.0f} messages/sec  ({num_errors} errors)")
+
+
+def main():
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_MESSAGES
+    source, htmls = get_htmls(num_messages)
+    print(f"{len(htmls)} messages from {source}")
+    run("fresh parser", parse_with_fresh_parsers, htmls)
+    run("batch", parse_in_batch, htmls)
+
+
+if __name__ == "__main__":
+    main()
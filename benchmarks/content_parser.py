@@ -0,0 +1,75 @@
+"""
+Compare the two ways of getting from lxml to ContentNodes, on the
+messages in markdown_test_cases.json.
+
+Run from the top of the repo:
+
+    python benchmarks/content_parser.py [num_rounds]
+
+    two-pass:    TagElement.from_lxml copies the whole lxml tree into
+                 elements (serializing each one), then we walk the copy
+    single-pass: get_zulip_content wraps lxml elements lazily as it
+                 walks them
+
+We report messages/sec and the peak memory allocated while parsing
+the whole corpus once.
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+
+sys.path.append("api")
+
+from html_element import TagElement
+from message_parser import build_zulip_content, get_lxml_root
+
+NUM_ROUNDS = 20
+
+
+def two_pass(html):
+    return build_zulip_content(TagElement.from_lxml(get_lxml_root(html)))
+
+
+def single_pass(html):
+    return build_zulip_content(TagElement(get_lxml_root(html)))
+
+
+def get_htmls():
+    with open("markdown_test_cases.json", encoding="utf8") as f:
+        fixtures = json.load(f)
+    return [fixture["expected_output"] for fixture in fixtures["regular_tests"]]
+
+
+def run(label, parse, htmls, num_rounds):
+    tracemalloc.start()
+    for html in htmls:
+        parse(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    t = time.perf_counter()
+    for _ in range(num_rounds):
+        for html in htmls:
+            parse(html)
+    elapsed = time.perf_counter() - t
+    rate = num_rounds * len(htmls) / elapsed
+    print(f"{label:>12}: {rate:8.0f} messages/sec  peak {peak / 1024:7.0f} KiB")
+
+
+def main():
+    num_rounds = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_ROUNDS
+    htmls = get_htmls()
+
+    # Both paths must build the same thing.
+    for html in htmls:
+        assert two_pass(html).as_dict() == single_pass(html).as_dict()
+
+    print(f"{len(htmls)} messages from markdown_test_cases.json, {num_rounds} rounds")
+    run("two-pass", two_pass, htmls, num_rounds)
+    run("single-pass", single_pass, htmls, num_rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Measure how fast EventApplier keeps up with a synthetic event
+firehose, for both message table backends.
+
+Run from the top of the repo:
+
+    python benchmarks/event_firehose.py [num_messages] [num_events]
+
+We preload num_messages synthetic messages, then apply num_events
+events: mostly new messages, plus content edits, topic moves,
+deletes, and user/stream updates.  We report events/sec and the
+p50/p99 latency of a single apply() call.
+"""
+
+import random
+import sys
+import time
+
+sys.path.append("api")
+sys.path.append("benchmarks")
+
+from database import Database
+from event_applier import EventApplier
+from message_store_memory import NUM_STREAMS, NUM_USERS, synthetic_raw_messages
+
+NUM_MESSAGES = 200_000
+NUM_EVENTS = 100_000
+
+
+def synthetic_events(num_messages, num_events):
+    rng = random.Random(42)
+    raw_messages = synthetic_raw_messages(num_messages + num_events)
+    # skip the preloaded messages
+    for _ in range(num_messages):
+        next(raw_messages)
+
+    next_event_id = 0
+    live_ids = list(range(1_000_000, 1_000_000 + num_messages))
+
+    for _ in range(num_events):
+        r = rng.random()
+        if r < 0.75:
+            raw_message = next(raw_messages)
+            live_ids.append(raw_message["id"])
+            event = dict(type="message", message=raw_message)
+        elif r < 0.87:
+            event = dict(
+                type="update_message",
+                message_id=rng.choice(live_ids),
+                rendered_content="<p>edited</p>",
+            )
+        elif r < 0.92:
+            message_id = rng.choice(live_ids)
+            event = dict(
+                type="update_message",
+                message_id=message_id,
+                message_ids=[message_id],
+                subject=f"moved topic {rng.randrange(10)}",
+            )
+        elif r < 0.97:
+            i = rng.randrange(len(live_ids))
+            live_ids[i], live_ids[-1] = live_ids[-1], live_ids[i]
+            event = dict(type="delete_message", message_ids=[live_ids.pop()])
+        elif r < 0.99:
+            event = dict(
+                type="realm_user",
+                op="update",
+                person=dict(user_id=rng.randrange(NUM_USERS), full_name="renamed"),
+            )
+        else:
+            event = dict(
+                type="stream",
+                op="update",
+                stream_id=rng.randrange(NUM_STREAMS),
+                property="name",
+                value="renamed",
+            )
+        event["id"] = next_event_id
+        next_event_id += 1
+        yield event
+
+
+def run(backend, num_messages, num_events):
+    database = Database.create_empty_database(columnar=backend == "columnar")
+    database.populate_messages(list(synthetic_raw_messages(num_messages)))
+    event_applier = EventApplier(database, host="https://example.com")
+
+    events = list(synthetic_events(num_messages, num_events))
+    latencies = []
+    t = time.perf_counter()
+    for event in events:
+        start = time.perf_counter_ns()
+        event_applier.apply(event)
+        latencies.append(time.perf_counter_ns() - start)
+    elapsed = time.perf_counter() - t
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] / 1000
+    p99 = latencies[len(latencies) * 99 // 100] / 1000
+    print(
+        f"{backend:>9}: {num_events / elapsed:8.0f} events/sec"
+        f"  p50 {p50:6.1f}us  p99 {p99:6.1f}us"
+    )
+
+
+def main():
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_MESSAGES
+    num_events = int(sys.argv[2]) if len(sys.argv) > 2 else NUM_EVENTS
+    print(f"{num_events} events applied on top of {num_messages} messages")
+    for backend in ["pydantic", "columnar"]:
+        run(backend, num_messages, num_events)
+
+
+if __name__ == "__main__":
+    main()
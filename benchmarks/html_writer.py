@@ -0,0 +1,75 @@
+"""
+Time ContentNode.as_html on big tables, lists and non-English text.
+
+Run from the top of the repo:
+
+    python benchmarks/html_writer.py
+
+We build the HTML that Zulip would send for each shape, parse it
+once, and then time as_html on the resulting tree (best of
+NUM_REPEATS).  The script only uses as_html, so you can run it
+against older checkouts to compare.
+"""
+
+import sys
+import time
+
+sys.path.append("api")
+
+from message_parser import get_zulip_content
+
+NUM_REPEATS = 5
+
+
+def make_table(num_rows, num_cols):
+    ths = "\n".join(f"<th>col {c}</th>" for c in range(num_cols))
+    rows = []
+    for r in range(num_rows):
+        tds = "\n".join(
+            f'<td style="text-align: right;">{r} &amp; <em>{c}</em></td>'
+            for c in range(num_cols)
+        )
+        rows.append(f"<tr>\n{tds}\n</tr>")
+    tbody = "\n".join(rows)
+    return f"<table>\n<thead>\n<tr>\n{ths}\n</tr>\n</thead>\n<tbody>\n{tbody}\n</tbody>\n</table>"
+
+
+def make_list(num_items, depth):
+    if depth == 0:
+        return ""
+    items = "\n".join(
+        f"<li>item {i} <strong>bold</strong>{make_list(3, depth - 1)}</li>"
+        for i in range(num_items)
+    )
+    return f"\n<ul>\n{items}\n</ul>\n"
+
+
+def make_non_english(num_words):
+    words = ["café", "你好", "привет"]
+    text = " ".join(words[i % len(words)] + str(i) for i in range(num_words))
+    return f"<p>{text}</p>"
+
+
+def time_as_html(label, html):
+    node = get_zulip_content(html)
+    num_rounds = max(1, 2000 // len(html))
+    best = float("inf")
+    for _ in range(NUM_REPEATS):
+        t = time.perf_counter()
+        for _ in range(num_rounds):
+            node.as_html()
+        best = min(best, (time.perf_counter() - t) / num_rounds)
+    print(f"{label:>24}: {best * 1000:8.3f} ms per as_html ({len(html)} bytes)")
+
+
+def main():
+    time_as_html("table 50x5", make_table(50, 5))
+    time_as_html("table 500x10", make_table(500, 10))
+    time_as_html("list 30 wide, 3 deep", make_list(30, 3).strip())
+    time_as_html("list 100 wide, 4 deep", make_list(100, 4).strip())
+    time_as_html("non-English 1000 words", make_non_english(1000))
+    time_as_html("non-English 10000 words", make_non_english(10000))
+
+
+if __name__ == "__main__":
+    main()
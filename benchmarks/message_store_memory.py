@@ -0,0 +1,99 @@
+"""
+Compare the memory footprint of MessageTable and ColumnarMessageTable.
+
+Run from the top of the repo:
+
+    python benchmarks/message_store_memory.py [num_messages]
+
+Each backend gets loaded in its own subprocess, so that one backend's
+garbage doesn't inflate the other's numbers.  We report the growth in
+resident set size while inserting the synthetic messages.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+sys.path.append("api")
+
+NUM_MESSAGES = 200_000
+NUM_USERS = 2_000
+NUM_STREAMS = 50
+TOPICS_PER_STREAM = 40
+
+
+def get_rss_bytes():
+    with open("/proc/self/statm") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def synthetic_raw_messages(num_messages):
+    for i in range(num_messages):
+        id = 1_000_000 + i
+        sender_id = i % NUM_USERS
+        if i % 4 == 0:
+            user_ids = sorted({sender_id, (i * 7) % NUM_USERS})
+            yield dict(
+                id=id,
+                type="private",
+                sender_id=sender_id,
+                display_recipient=[dict(id=user_id) for user_id in user_ids],
+                timestamp=1_700_000_000 + i,
+                content=f"<p>direct message {i}</p>",
+            )
+        else:
+            stream_id = i % NUM_STREAMS
+            yield dict(
+                id=id,
+                type="stream",
+                sender_id=sender_id,
+                stream_id=stream_id,
+                subject=f"topic {i % TOPICS_PER_STREAM}",
+                display_recipient=f"stream {stream_id}",
+                timestamp=1_700_000_000 + i,
+                content=f"<p>stream message {i}</p>",
+            )
+
+
+def measure(backend, num_messages):
+    from database import Database
+    from message import Message
+
+    database = Database.create_empty_database(columnar=backend == "columnar")
+    before = get_rss_bytes()
+    t = time.perf_counter()
+    for raw_message in synthetic_raw_messages(num_messages):
+        database.message_table.insert(
+            Message.from_raw(raw_message, topic_table=database.topic_table)
+        )
+    elapsed = time.perf_counter() - t
+    growth = get_rss_bytes() - before
+    print(f"{growth} {elapsed}")
+
+
+def main():
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_MESSAGES
+    results = {}
+    for backend in ["pydantic", "columnar"]:
+        output = subprocess.check_output(
+            [sys.executable, __file__, "--measure", backend, str(num_messages)],
+            text=True,
+        )
+        growth, elapsed = output.split()
+        results[backend] = int(growth)
+        print(
+            f"{backend:>9}: {int(growth) / 2**20:8.1f} MiB"
+            f" ({int(growth) / num_messages:6.0f} bytes/message)"
+            f"  insert time {float(elapsed):.2f}s"
+        )
+    ratio = results["columnar"] / results["pydantic"]
+    print(f"columnar uses {ratio:.0%} of the pydantic backend's memory")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--measure":
+        measure(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
@@ -0,0 +1,71 @@
+"""
+Show what round-trip checking costs on deeply nested messages
+(blockquotes and lists inside each other).
+
+Run from the top of the repo:
+
+    python benchmarks/nested_content.py
+
+For each depth we parse the same message three ways:
+
+    every level: VERIFY_EVERY_LEVEL, i.e. check each subtree against
+                 its HTML (what we used to do)
+    per message: check the whole message once (the default)
+    sampled:     get_zulip_content(html, sample_rate=0.01)
+
+Checking every level serializes each subtree once per ancestor, so
+its cost grows with depth * size; the other two stay linear.
+"""
+
+import sys
+import time
+
+sys.path.append("api")
+
+import content
+from message_parser import get_zulip_content
+
+DEPTHS = [10, 25, 50, 100]
+
+
+def make_nested_html(depth):
+    html = "<p>" + "deep " * 20 + "</p>"
+    for i in range(depth):
+        paragraph = f"<p>level {i} " + "word " * 20 + "</p>"
+        if i % 2 == 0:
+            html = f"<blockquote>\n{paragraph}\n{html}\n</blockquote>"
+        else:
+            html = f"<ul>\n<li>\n{paragraph}\n{html}\n</li>\n</ul>"
+    return html
+
+
+def time_parse(html, *, every_level, sample_rate=1.0):
+    content.VERIFY_EVERY_LEVEL = every_level
+    try:
+        num_rounds = 0
+        t = time.perf_counter()
+        while time.perf_counter() - t < 0.5:
+            get_zulip_content(html, sample_rate=sample_rate)
+            num_rounds += 1
+        return (time.perf_counter() - t) / num_rounds * 1000
+    finally:
+        content.VERIFY_EVERY_LEVEL = False
+
+
+def main():
+    print(
+        f"{'depth':>5} {'size':>8} {'every level':>12} {'per message':>12} {'sampled':>9}"
+    )
+    for depth in DEPTHS:
+        html = make_nested_html(depth)
+        every_level = time_parse(html, every_level=True)
+        per_message = time_parse(html, every_level=False)
+        sampled = time_parse(html, every_level=False, sample_rate=0.01)
+        print(
+            f"{depth:>5} {len(html):>8}"
+            f" {every_level:>10.2f}ms {per_message:>10.2f}ms {sampled:>7.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Measure what the trivial-paragraph fast path saves.
+
+Run from the top of the repo:
+
+    python benchmarks/paragraph_fast_path.py [num_messages]
+
+We parse the messages in database.snapshot (falling back to
+markdown_test_cases.json if you haven't synced a snapshot) with the
+full parser (parse_zulip_content) and with get_zulip_content, which
+tries maybe_get_trivial_content first.  We report the whole corpus,
+and then just the messages that take the fast path.
+
+The markdown test cases are mostly there to exercise unusual
+markdown, so they have far fewer plain paragraphs than real chat.
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.append("api")
+
+from message_parser import get_zulip_content, parse_zulip_content
+from snapshot import read_snapshot
+from trivial_content import maybe_get_trivial_content
+
+NUM_MESSAGES = 20_000
+NUM_REPEATS = 5
+
+
+def get_htmls(num_messages):
+    if os.path.exists("database.snapshot"):
+        database = read_snapshot("database.snapshot")
+        rows = database.message_table.get_rows()
+        return "database.snapshot", [m.content for m in rows[-num_messages:]]
+
+    with open("markdown_test_cases.json", encoding="utf8") as f:
+        fixtures = json.load(f)
+    htmls = [fixture["expected_output"] for fixture in fixtures["regular_tests"]]
+    return "markdown_test_cases.json", htmls
+
+
+def parse_all(parse, htmls):
+    for html in htmls:
+        try:
+            parse(html)
+        except Exception:
+            pass
+
+
+def time_parse(parse, htmls):
+    # Small corpora get repeated, so that the timing means something,
+    # and we report the best of NUM_REPEATS.
+    num_rounds = max(1, 5000 // len(htmls))
+    best = float("inf")
+    for _ in range(NUM_REPEATS):
+        t = time.perf_counter()
+        for _ in range(num_rounds):
+            parse_all(parse, htmls)
+        best = min(best, time.perf_counter() - t)
+    return num_rounds * len(htmls) / best
+
+
+def compare(label, htmls):
+    full_rate = time_parse(parse_zulip_content, htmls)
+    fast_rate = time_parse(get_zulip_content, htmls)
+    print(f"{label} ({len(htmls)} messages)")
+    print(f"    full parser: {full_rate:8.0f} messages/sec")
+    print(f"      fast path: {fast_rate:8.0f} messages/sec")
+    print(f"        speedup: {fast_rate / full_rate:8.2f}x")
+
+
+def main():
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_MESSAGES
+    source, htmls = get_htmls(num_messages)
+    trivial_htmls = [h for h in htmls if maybe_get_trivial_content(h) is not None]
+    print(
+        f"{len(trivial_htmls)} of {len(htmls)} messages from {source}"
+        " take the fast path"
+    )
+    compare("all messages", htmls)
+    compare("trivial messages", trivial_htmls)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Measure how parse_in_pool scales with the number of worker processes.
+
+Run from the top of the repo:
+
+    python benchmarks/pool_scaling.py [num_messages]
+
+We parse the messages in database.snapshot (falling back to
+markdown_test_cases.json, repeated, if you haven't synced a snapshot)
+in-process with get_zulip_contents, and then with parse_in_pool for
+1, 2, 4, ... workers, up to the number of cores.  The pool numbers
+include starting the workers and pickling the summaries back, since
+that's what a caller pays.
+
+Speedup is against the in-process run; on N idle cores, N workers
+should get close to N.
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.append("api")
+
+from message_parser import get_zulip_contents
+from parse_pool import parse_in_pool
+from snapshot import read_snapshot
+
+NUM_MESSAGES = 20_000
+
+
+def get_htmls(num_messages):
+    if os.path.exists("database.snapshot"):
+        database = read_snapshot("database.snapshot")
+        rows = database.message_table.get_rows()
+        return "database.snapshot", [m.content for m in rows[-num_messages:]]
+
+    with open("markdown_test_cases.json", encoding="utf8") as f:
+        fixtures = json.load(f)
+    htmls = [fixture["expected_output"] for fixture in fixtures["regular_tests"]]
+    num_rounds = max(1, num_messages // len(htmls))
+    return "markdown_test_cases.json", htmls * num_rounds
+
+
+def summarize_in_process(htmls):
+    parsed_messages = get_zulip_contents(htmls)
+    for parsed_message in parsed_messages:
+        if parsed_message.zulip_content is not None:
+            parsed_message.zulip_content.as_text()
+
+
+def main():
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_MESSAGES
+    source, htmls = get_htmls(num_messages)
+    num_cores = os.cpu_count() or 1
+    print(f"{len(htmls)} messages from {source}, {num_cores} cores")
+
+    t = time.perf_counter()
+    summarize_in_process(htmls)
+    base = time.perf_counter() - t
+    print(f"  in process: {len(htmls) / base:8.0f} messages/sec")
+
+    num_workers = 1
+    while num_workers <= num_cores:
+        t = time.perf_counter()
+        summaries = parse_in_pool(htmls, num_workers=num_workers)
+        elapsed = time.perf_counter() - t
+        num_errors = sum(1 for s in summaries if s.error is not None)
+        print(
+            f"{num_workers:3} workers: {len(htmls) / elapsed:8.0f} messages/sec"
+            f"  speedup {base / elapsed:5.2f}  ({num_errors} errors)"
+        )
+        num_workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Compare startup cost of database.json against database.snapshot.
+
+Run from the top of the repo:
+
+    python benchmarks/snapshot_startup.py [num_messages]
+
+We write the same synthetic database both ways into a temp directory,
+then time loading each one.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append("api")
+sys.path.append("benchmarks")
+
+from database import Database
+from message_store_memory import synthetic_raw_messages
+from snapshot import read_snapshot, write_snapshot
+
+NUM_MESSAGES = 200_000
+
+
+def main():
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_MESSAGES
+
+    database = Database.create_empty_database(columnar=True)
+    database.populate_messages(list(synthetic_raw_messages(num_messages)))
+
+    with tempfile.TemporaryDirectory() as dir:
+        json_fn = os.path.join(dir, "database.json")
+        snapshot_fn = os.path.join(dir, "database.snapshot")
+
+        with open(json_fn, "w", encoding="utf8") as f:
+            f.write(database.model_dump_json())
+        write_snapshot(database, snapshot_fn)
+
+        t = time.perf_counter()
+        with open(json_fn, encoding="utf8") as f:
+            Database.model_validate_json(f.read())
+        json_elapsed = time.perf_counter() - t
+
+        t = time.perf_counter()
+        loaded = read_snapshot(snapshot_fn)
+        snapshot_elapsed = time.perf_counter() - t
+
+        print(f"{num_messages} messages")
+        print(f"    json:     {os.path.getsize(json_fn) / 2**20:7.1f} MiB", end="")
+        print(f"  load {json_elapsed:.3f}s")
+        print(f"    snapshot: {os.path.getsize(snapshot_fn) / 2**20:7.1f} MiB", end="")
+        print(f"  load {snapshot_elapsed:.3f}s")
+        print(f"    speedup: {json_elapsed / snapshot_elapsed:.0f}x")
+
+        del loaded
+
+
+if __name__ == "__main__":
+    main()
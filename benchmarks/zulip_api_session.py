@@ -0,0 +1,93 @@
+"""
+Compare requests/sec for ZulipApi with a fresh aiohttp session per
+request (how ZulipApi used to work) against the pooled session.
+
+Run from the top of the repo:
+
+    python benchmarks/zulip_api_session.py [num_requests]
+
+We stand up a stub Zulip server on localhost that answers
+GET /api/v1/messages, and fire num_requests GET_json calls at it,
+CONCURRENCY at a time.  This is plain HTTP over loopback, so it
+only measures the TCP handshake and session setup; against a real
+server, TLS and network round trips make the difference bigger.
+"""
+
+import asyncio
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator
+
+sys.path.append("api")
+
+import aiohttp
+from aiohttp import web
+from zulip import ZulipApi
+
+NUM_REQUESTS = 2_000
+CONCURRENCY = 8
+
+
+class PerRequestSessionApi(ZulipApi):
+    @asynccontextmanager
+    async def get(
+        self, url_ending: str, params: dict[str, Any]
+    ) -> AsyncGenerator[Any, None]:
+        headers = {"Authorization": self.auth.encode()}
+        async with aiohttp.ClientSession(headers=headers) as session:
+            url = self.url_prefix + url_ending
+            async with session.get(url, params=params) as response:
+                yield response
+
+
+async def handle_messages(request):
+    return web.json_response(
+        dict(result="success", messages=[], found_oldest=True, found_newest=True)
+    )
+
+
+async def time_requests(zulip_api, num_requests):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def fetch():
+        async with semaphore:
+            async with zulip_api.GET_json("messages", dict(anchor="newest")):
+                pass
+
+    t = time.perf_counter()
+    await asyncio.gather(*(fetch() for _ in range(num_requests)))
+    return time.perf_counter() - t
+
+
+async def main():
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_REQUESTS
+
+    app = web.Application()
+    app.router.add_get("/api/v1/messages", handle_messages)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    host = f"http://127.0.0.1:{port}"
+
+    try:
+        results = {}
+        for label, api_class in [
+            ("session per request", PerRequestSessionApi),
+            ("pooled session", ZulipApi),
+        ]:
+            async with api_class(host, "user@example.com", "key") as zulip_api:
+                elapsed = await time_requests(zulip_api, num_requests)
+            results[label] = num_requests / elapsed
+            print(f"{label:>20}: {results[label]:8.0f} requests/sec")
+
+        speedup = results["pooled session"] / results["session per request"]
+        print(f"pooled session is {speedup:.1f}x faster")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
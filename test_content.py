@@ -1,16 +1,34 @@
+import inspect
 import json
+import os
 import sys
 
 sys.path.append("api")
+from api.content import ContentNode
+from api.content_codec import (
+    NODE_TYPES,
+    ContentCodecError,
+    decode_content,
+    encode_content,
+)
 from api.database import Database
-from api.message_parser import get_zulip_content
+from api.message_parser import (
+    get_zulip_content,
+    get_zulip_contents,
+    parse_zulip_content,
+)
+from api.parse_pool import parse_in_pool
+from api.snapshot import read_snapshot
+from api.trivial_content import maybe_get_trivial_content
 
 
 def test_valid_messages(messages, label):
     num_successes = 0
-    for html in messages:
+    for html, parsed_message in zip(messages, get_zulip_contents(messages)):
         try:
-            node = get_zulip_content(html)
+            if parsed_message.error is not None:
+                raise parsed_message.error
+            node = parsed_message.zulip_content
             node.as_text()
             node.as_html()
             node.as_dict()
@@ -49,22 +67,29 @@ def test_custom_test_cases():
 
 
 def test_real_world():
+    if os.path.exists("database.snapshot"):
+        database = read_snapshot("database.snapshot")
+    else:
+        database = get_json_database()
+
+    messages = [m.content for m in database.message_table.get_rows()]
+    test_valid_messages(messages, "real world")
+
+
+def get_json_database():
     fn = "database.json"
     try:
         with open(fn, encoding="utf8") as database_file:
             db_json = database_file.read()
     except FileNotFoundError:
         print("""
-            ERROR: can't find database.json!!!!
+            ERROR: can't find database.snapshot or database.json!!!!
 
             Try running python .\\api\\data_layer.py
         """)
         raise
 
-    database = Database.model_validate_json(db_json)
-
-    messages = [m.content for m in database.message_table.get_rows()]
-    test_valid_messages(messages, "real world")
+    return Database.model_validate_json(db_json)
 
 
 def test_markdown_test_cases():
@@ -75,6 +100,127 @@ def test_markdown_test_cases():
     test_valid_messages(messages, "markdown_test_cases.json (from Zulip)")
 
 
-test_custom_test_cases()
-test_markdown_test_cases()
-test_real_world()
+def test_parse_pool():
+    fn = "markdown_test_cases.json"
+    with open(fn, encoding="utf8") as fp:
+        fixtures = json.load(fp)
+    messages = [fixture["expected_output"] for fixture in fixtures["regular_tests"]]
+    # <b> isn't something we support, so this one should fail
+    messages.insert(5, "<p><b>bold</b></p>")
+
+    summaries = parse_in_pool(messages, num_workers=2, shard_size=20)
+    assert len(summaries) == len(messages)
+    for html, summary in zip(messages, summaries):
+        if html == messages[5]:
+            assert summary.text is None
+            assert "IllegalMessage" in summary.error
+        else:
+            assert summary.error is None
+            assert summary.text == get_zulip_content(html).as_text()
+    assert any(summary.user_ids for summary in summaries)
+    assert any(summary.links for summary in summaries)
+    assert any(summary.media for summary in summaries)
+
+    summaries = parse_in_pool(messages[:3], num_workers=2, include_ast=True)
+    for html, summary in zip(messages, summaries):
+        assert summary.zulip_content == get_zulip_content(html)
+    print(f"parse_in_pool matched for {len(messages)} messages")
+
+
+def test_trivial_content():
+    # The fast path must build exactly what the full parser builds,
+    # whenever it applies.
+    fn = "markdown_test_cases.json"
+    with open(fn, encoding="utf8") as fp:
+        fixtures = json.load(fp)
+    messages = [fixture["expected_output"] for fixture in fixtures["regular_tests"]]
+    messages += [
+        "<p>hello</p>",
+        "<p>one &amp; two &lt;3 caf\u00e9 \U0001f600</p>\n<p>second</p>",
+        '<p>hi <span class="user-mention" data-user-id="8">@Cordelia</span> '
+        + '<span class="user-mention silent" data-user-id="9">Iago</span></p>',
+        '<p><span aria-label="thumbs up" class="emoji emoji-1f44d" role="img" '
+        + 'title="thumbs up">:thumbs_up:</span></p>',
+    ]
+    # These look trivial, but lxml would change them on us (or the
+    # emoji code isn't how we write it back out).
+    fallbacks = [
+        "<p>caf&#233;</p>",
+        "<p>a > b</p>",
+        "<p>\x80</p>",
+        '<p><span aria-label="c" class="emoji emoji-a9" role="img" title="c">:c:</span></p>',
+        '<p><span class="user-mention" data-user-id="08">@x</span></p>',
+    ]
+
+    num_fast = 0
+    for html in messages + fallbacks:
+        node = maybe_get_trivial_content(html)
+        if html in fallbacks:
+            assert node is None
+        elif node is not None:
+            assert node == parse_zulip_content(html)
+            num_fast += 1
+    assert maybe_get_trivial_content(messages[-1]) is not None
+    print(f"{num_fast} of {len(messages)} messages took the fast path")
+
+
+def get_concrete_node_types(cls):
+    for subclass in cls.__subclasses__():
+        if not inspect.isabstract(subclass):
+            yield subclass
+        yield from get_concrete_node_types(subclass)
+
+
+def test_content_codec():
+    # (compare names, since api.content and content are different modules)
+    node_type_names = {cls.__name__ for cls in NODE_TYPES}
+    missing = {
+        cls.__name__
+        for cls in get_concrete_node_types(ContentNode)
+        if cls.__name__ not in node_type_names
+    }
+    assert not missing, f"add {missing} to content_codec.NODE_TYPES"
+
+    fn = "markdown_test_cases.json"
+    with open(fn, encoding="utf8") as fp:
+        fixtures = json.load(fp)
+    messages = [fixture["expected_output"] for fixture in fixtures["regular_tests"]]
+    messages += [
+        '<p><span class="user-mention" data-user-id="8">@Cordelia</span> '
+        + '<span class="user-group-mention silent" data-user-group-id="3">'
+        + "devs</span> "
+        + '<span class="user-mention channel-wildcard-mention" data-user-id="*">'
+        + "@all</span></p>",
+        '<p><a class="stream" data-stream-id="-1" href="/#narrow/channel/-1">'
+        + "#nowhere</a></p>",
+    ]
+
+    num_bytes = 0
+    for html in messages:
+        node = get_zulip_content(html)
+        data = encode_content(node)
+        num_bytes += len(data)
+        assert decode_content(data) == node
+
+        for bad_data in [data[:-1], data + b"\0", b"\xff" + data[1:]]:
+            try:
+                decode_content(bad_data)
+            except ContentCodecError:
+                pass
+            else:
+                assert False, f"decoded bad data for {html!r}"
+    html_bytes = sum(len(html.encode()) for html in messages)
+    print(
+        f"{len(messages)} messages encoded in {num_bytes} bytes ({html_bytes} in HTML)"
+    )
+
+
+# parse_in_pool starts worker processes, which (on platforms that spawn
+# rather than fork) import this module again.
+if __name__ == "__main__":
+    test_custom_test_cases()
+    test_markdown_test_cases()
+    test_trivial_content()
+    test_content_codec()
+    test_parse_pool()
+    test_real_world()
@@ -0,0 +1,640 @@
+import asyncio
+import os
+import sys
+import tempfile
+from contextlib import asynccontextmanager
+
+sys.path.append("api")
+from address import Address
+from backfill import Backfill, BackfillCheckpoint
+from content_cache import PARSER_VERSION, ContentCache
+from data_layer import catch_up_database
+from database import Database
+from event_applier import EventApplier
+from filter import AddressFilter, DirectMessageFilter, SentByFilter, TopicFilter
+from message import Message
+from message_table import MessageTable
+from register import RegisterInfo
+from service import Service
+from snapshot import append_snapshot, read_snapshot, write_snapshot
+from sorted_keys import NEWEST_KEY, OLDEST_KEY
+from user import User
+
+
+def make_stream_message(id, *, sender_id, stream_id, topic, timestamp=None):
+    return dict(
+        id=id,
+        type="stream",
+        sender_id=sender_id,
+        stream_id=stream_id,
+        subject=topic,
+        display_recipient="some stream",
+        timestamp=timestamp if timestamp is not None else 1_000 + id,
+        content=f"<p>message {id}</p>",
+    )
+
+
+def make_direct_message(id, *, sender_id, user_ids, timestamp=None):
+    return dict(
+        id=id,
+        type="private",
+        sender_id=sender_id,
+        display_recipient=[dict(id=user_id) for user_id in user_ids],
+        timestamp=timestamp if timestamp is not None else 1_000 + id,
+        content=f"<p>message {id}</p>",
+    )
+
+
+def make_database(columnar=False):
+    database = Database.create_empty_database(columnar=columnar)
+    database.populate_messages(
+        [
+            make_stream_message(1, sender_id=10, stream_id=5, topic="lunch"),
+            make_stream_message(2, sender_id=11, stream_id=5, topic="lunch"),
+            make_stream_message(3, sender_id=10, stream_id=5, topic="dinner"),
+            make_direct_message(4, sender_id=10, user_ids=[10, 11]),
+            make_direct_message(5, sender_id=11, user_ids=[10, 11, 12]),
+        ]
+    )
+    return database
+
+
+def ids(messages):
+    return [m.id for m in messages]
+
+
+def test_indexes():
+    for columnar in [False, True]:
+        check_indexes(make_database(columnar=columnar))
+
+
+def check_indexes(database):
+    message_table = database.message_table
+    topic_table = database.topic_table
+
+    assert ids(SentByFilter(10).get_rows(message_table)) == [1, 3, 4]
+    assert ids(DirectMessageFilter(user_id=12).get_rows(message_table)) == [5]
+    assert ids(DirectMessageFilter(user_id=11).get_rows(message_table)) == [4, 5]
+
+    lunch_id = topic_table.get_topic_id(5, "lunch")
+    assert ids(TopicFilter(topic_id=lunch_id).get_rows(message_table)) == [1, 2]
+
+    address = Address(type="private", topic_id=0, user_ids={11, 10})
+    assert ids(AddressFilter(address).get_rows(message_table)) == [4]
+    assert list(SentByFilter(999).get_rows(message_table)) == []
+
+
+def test_index_update_on_reinsert():
+    for columnar in [False, True]:
+        database = make_database(columnar=columnar)
+        check_index_update_on_reinsert(database.message_table)
+
+
+def check_index_update_on_reinsert(message_table):
+    message = Message.model_validate(message_table.get_row(1), from_attributes=True)
+    edited = message.model_copy(update=dict(sender_id=12))
+    message_table.insert(edited)
+    assert ids(SentByFilter(10).get_rows(message_table)) == [3, 4]
+    assert ids(SentByFilter(12).get_rows(message_table)) == [1]
+
+
+def test_indexes_survive_json_round_trip():
+    database = make_database()
+    message_table = MessageTable.model_validate_json(
+        database.message_table.model_dump_json()
+    )
+    assert ids(SentByFilter(11).get_rows(message_table)) == [2, 5]
+
+
+def test_timestamp_order():
+    for columnar in [False, True]:
+        check_timestamp_order(Database.create_empty_database(columnar=columnar))
+
+
+def check_timestamp_order(database):
+    database.populate_messages(
+        [
+            make_stream_message(3, sender_id=10, stream_id=5, topic="a", timestamp=50),
+            make_stream_message(1, sender_id=10, stream_id=5, topic="a", timestamp=70),
+            make_stream_message(2, sender_id=11, stream_id=5, topic="a", timestamp=50),
+            make_stream_message(4, sender_id=10, stream_id=5, topic="a", timestamp=90),
+        ]
+    )
+    message_table = database.message_table
+    sender_key = SentByFilter(10).index_key()
+
+    assert ids(message_table.get_rows()) == [2, 3, 1, 4]
+    assert ids(message_table.get_indexed_rows(sender_key)) == [3, 1, 4]
+
+    assert ids(message_table.get_rows_before(NEWEST_KEY, 2)) == [1, 4]
+    assert ids(message_table.get_rows_after(OLDEST_KEY, 2)) == [2, 3]
+
+    anchor = message_table.get_row(3).key()
+    assert ids(message_table.get_rows_before(anchor, 5)) == [2]
+    assert ids(message_table.get_rows_after(anchor, 1)) == [1]
+    assert ids(message_table.get_rows_after(anchor, 5, index_key=sender_key)) == [1, 4]
+
+    assert ids(message_table.get_rows_between(50, 70)) == [2, 3, 1]
+    assert ids(message_table.get_rows_between(51, 70, index_key=sender_key)) == [1]
+    assert list(message_table.get_rows_between(91, 100)) == []
+
+
+def test_columnar_json_round_trip():
+    database = make_database(columnar=True)
+    database = Database.model_validate_json(database.model_dump_json())
+    assert isinstance(database.message_table, MessageTable)
+    assert ids(database.message_table.get_rows()) == [1, 2, 3, 4, 5]
+    assert database.message_table.get_row(5).address.user_ids == {10, 11, 12}
+
+
+def test_snapshot_round_trip():
+    database = make_database()
+    database.populate_messages(
+        [
+            make_stream_message(
+                6, sender_id=12, stream_id=5, topic="lunch", timestamp=900
+            ),
+        ]
+    )
+    database.message_table.insert(
+        database.message_table.get_row(2).model_copy(update=dict(content="<p>é</p>"))
+    )
+
+    with tempfile.TemporaryDirectory() as dir:
+        fn = os.path.join(dir, "database.snapshot")
+        write_snapshot(database, fn)
+        loaded = read_snapshot(fn)
+
+    message_table = loaded.message_table
+    assert ids(message_table.get_rows()) == [6, 1, 2, 3, 4, 5]
+    assert message_table.get_row(2).content == "<p>é</p>"
+    assert message_table.get_row(5).address.user_ids == {10, 11, 12}
+    assert ids(SentByFilter(10).get_rows(message_table)) == [1, 3, 4]
+    assert ids(DirectMessageFilter(user_id=11).get_rows(message_table)) == [4, 5]
+    lunch_id = loaded.topic_table.get_topic_id(5, "lunch")
+    assert ids(TopicFilter(topic_id=lunch_id).get_rows(message_table)) == [6, 1, 2]
+
+    # The loaded table still accepts new messages.
+    loaded.populate_messages(
+        [make_stream_message(7, sender_id=10, stream_id=5, topic="lunch")]
+    )
+    assert ids(SentByFilter(10).get_rows(message_table)) == [1, 3, 4, 7]
+
+
+def test_snapshot_append():
+    with tempfile.TemporaryDirectory() as dir:
+        fn = os.path.join(dir, "database.snapshot")
+        write_snapshot(make_database(), fn)
+
+        database = read_snapshot(fn)
+        assert database.message_table.get_max_id() == 5
+        new_messages = database.populate_messages(
+            [
+                make_stream_message(6, sender_id=10, stream_id=5, topic="lunch"),
+                make_direct_message(7, sender_id=12, user_ids=[10, 12]),
+                make_stream_message(8, sender_id=11, stream_id=6, topic="new"),
+            ]
+        )
+        append_snapshot(database, fn, new_messages)
+        # a plain append leaves the database's mapping alone
+        assert len(database.message_table.mappings) == 1
+
+        # simulate a torn write at the end of the file, then another append
+        with open(fn, "ab") as f:
+            f.write(b"SEGM")
+        assert ids(read_snapshot(fn).message_table.get_rows())[-1] == 8
+
+        new_messages = database.populate_messages(
+            [make_stream_message(9, sender_id=11, stream_id=6, topic="new")]
+        )
+        append_snapshot(database, fn, new_messages)
+        loaded = read_snapshot(fn)
+
+        # we had to truncate the file, so the live database let go of
+        # its mapping, but it can still read the mapped rows
+        assert database.message_table.mappings == []
+        assert database.message_table.get_row(2).content == "<p>message 2</p>"
+        assert ids(database.message_table.get_rows()) == ids(
+            loaded.message_table.get_rows()
+        )
+
+    message_table = loaded.message_table
+    assert message_table.get_max_id() == 9
+    assert ids(message_table.get_rows()) == [1, 2, 3, 4, 5, 6, 7, 8, 9]
+    assert ids(SentByFilter(10).get_rows(message_table)) == [1, 3, 4, 6]
+    assert ids(DirectMessageFilter(user_id=12).get_rows(message_table)) == [5, 7]
+    new_topic_id = loaded.topic_table.get_topic_id(6, "new")
+    assert ids(TopicFilter(topic_id=new_topic_id).get_rows(message_table)) == [8, 9]
+    assert message_table.get_row(7).content == "<p>message 7</p>"
+
+
+def test_snapshot_rewrite():
+    with tempfile.TemporaryDirectory() as dir:
+        fn = os.path.join(dir, "database.snapshot")
+        write_snapshot(make_database(), fn)
+
+        # rewrite the file that the database is mapped from
+        database = read_snapshot(fn)
+        database.populate_messages(
+            [make_stream_message(6, sender_id=10, stream_id=5, topic="lunch")]
+        )
+        write_snapshot(database, fn)
+        assert database.message_table.mappings == []
+        assert database.message_table.get_row(1).content == "<p>message 1</p>"
+
+        loaded = read_snapshot(fn)
+
+    assert ids(loaded.message_table.get_rows()) == [1, 2, 3, 4, 5, 6]
+    assert loaded.message_table.get_row(6).content == "<p>message 6</p>"
+
+
+def test_event_applier():
+    for columnar in [False, True]:
+        check_event_applier(make_database(columnar=columnar))
+
+
+def check_event_applier(database):
+    message_table = database.message_table
+    topic_table = database.topic_table
+    raw_streams = [dict(stream_id=6, name="news"), dict(stream_id=7, name="misc")]
+    event_applier = EventApplier(
+        database, host="https://example.com", raw_streams=raw_streams
+    )
+    lunch_id = topic_table.get_topic_id(5, "lunch")
+
+    event_applier.apply(
+        dict(
+            type="message",
+            message=make_stream_message(6, sender_id=10, stream_id=5, topic="lunch"),
+        )
+    )
+    assert ids(TopicFilter(topic_id=lunch_id).get_rows(message_table)) == [1, 2, 6]
+
+    event_applier.apply(
+        dict(type="update_message", message_id=2, rendered_content="<p>edited</p>")
+    )
+    assert message_table.get_row(2).content == "<p>edited</p>"
+
+    event_applier.apply(
+        dict(
+            type="update_message",
+            message_id=1,
+            message_ids=[1, 6],
+            stream_id=5,
+            orig_subject="lunch",
+            subject="brunch",
+        )
+    )
+    brunch_id = topic_table.get_topic_id(5, "brunch")
+    assert ids(TopicFilter(topic_id=lunch_id).get_rows(message_table)) == [2]
+    assert ids(TopicFilter(topic_id=brunch_id).get_rows(message_table)) == [1, 6]
+    assert ids(SentByFilter(10).get_rows(message_table)) == [1, 3, 4, 6]
+
+    event_applier.apply(dict(type="delete_message", message_ids=[4, 6, 999]))
+    assert ids(SentByFilter(10).get_rows(message_table)) == [1, 3]
+    assert ids(DirectMessageFilter(user_id=11).get_rows(message_table)) == [5]
+    assert message_table.maybe_get_row(4) is None
+    assert message_table.get_max_id() == 5
+
+    # a message in a stream that none of our messages were in, and a
+    # move to another such stream
+    event_applier.apply(
+        dict(
+            type="message",
+            message=make_stream_message(7, sender_id=11, stream_id=6, topic="new"),
+        )
+    )
+    news_topic = topic_table.get_topic(message_table.get_row(7).address.topic_id)
+    assert news_topic.label(stream_table=database.stream_table) == "news: new"
+    event_applier.apply(
+        dict(type="update_message", message_id=7, stream_id=6, new_stream_id=7)
+    )
+    misc_topic = topic_table.get_topic(message_table.get_row(7).address.topic_id)
+    assert misc_topic.label(stream_table=database.stream_table) == "misc: new"
+
+    # A brand new user hasn't been in any of our messages, so they
+    # don't go in the UserTable (or the buddy list).
+    person = dict(user_id=99, full_name="Newbie", avatar_url="/new.png")
+    event_applier.apply(dict(type="realm_user", op="add", person=person))
+    assert database.user_table.maybe_get_row(99) is None
+
+    database.user_table.insert(User(id=12, name="C", avatar_url=""))
+    person = dict(user_id=12, full_name="Cy", avatar_url="/cy.png")
+    event_applier.apply(dict(type="realm_user", op="add", person=person))
+    person = dict(user_id=12, full_name="Cyrus")
+    event_applier.apply(dict(type="realm_user", op="update", person=person))
+    user = database.user_table.get_row(12)
+    assert (user.name, user.avatar_url) == ("Cyrus", "https://example.com/cy.png")
+
+    streams = [dict(stream_id=5, name="food")]
+    event_applier.apply(dict(type="stream", op="create", streams=streams))
+    event_applier.apply(
+        dict(type="stream", op="update", stream_id=5, property="name", value="eats")
+    )
+    assert database.stream_table.get_row(5).name == "eats"
+
+    event_applier.apply(dict(type="heartbeat"))
+    assert (event_applier.num_applied, event_applier.num_ignored) == (11, 1)
+
+
+class FakeZulipApi:
+    # Serves GET /messages (anchor, num_before, num_after) from a list.
+    host = "https://example.com"
+    user_name = "me@example.com"
+
+    def __init__(self, raw_messages, *, fail_after=None):
+        self.raw_messages = sorted(raw_messages, key=lambda m: m["id"])
+        self.fail_after = fail_after
+        self.num_requests = 0
+
+    @asynccontextmanager
+    async def GET_json(self, url_ending, params, *, priority=None):
+        assert url_ending == "messages"
+        self.num_requests += 1
+        await asyncio.sleep(0)
+        if self.fail_after is not None and self.num_requests > self.fail_after:
+            raise ConnectionError("simulated disconnect")
+        older = [m for m in self.raw_messages if m["id"] < params["anchor"]]
+        newer = [m for m in self.raw_messages if m["id"] > params["anchor"]]
+        num_before = params["num_before"]
+        num_after = params.get("num_after", 0)
+        yield dict(
+            messages=older[max(0, len(older) - num_before) :] + newer[:num_after],
+            found_oldest=len(older) <= num_before,
+            found_newest=len(newer) <= num_after,
+        )
+
+
+def run_backfill(fn, zulip_api, *, stop_timestamp=0):
+    database = read_snapshot(fn)
+    checkpoint_fn = fn + ".checkpoint"
+    if os.path.exists(checkpoint_fn):
+        checkpoint = BackfillCheckpoint.load(checkpoint_fn)
+    else:
+        checkpoint = BackfillCheckpoint.create(
+            database, stop_timestamp=stop_timestamp, batch_size=7
+        )
+    backfill = Backfill(
+        zulip_api=zulip_api,
+        database=database,
+        checkpoint=checkpoint,
+        checkpoint_fn=checkpoint_fn,
+        on_batch=lambda messages: append_snapshot(database, fn, messages),
+        batch_size=7,
+        max_in_flight=3,
+    )
+    try:
+        asyncio.run(backfill.run())
+    except ConnectionError:
+        pass
+    return checkpoint
+
+
+def test_backfill_resumes():
+    history = [
+        make_stream_message(id, sender_id=10 + id % 3, stream_id=5, topic="t")
+        for id in range(1, 201)
+    ]
+    with tempfile.TemporaryDirectory() as dir:
+        fn = os.path.join(dir, "database.snapshot")
+        database = Database.create_empty_database()
+        database.populate_messages(history[180:])
+        write_snapshot(database, fn)
+
+        checkpoint = run_backfill(fn, FakeZulipApi(history, fail_after=5))
+        assert not checkpoint.is_complete()
+        partial_ids = ids(read_snapshot(fn).message_table.get_rows())
+        assert 20 < len(partial_ids) < 200
+
+        zulip_api = FakeZulipApi(history)
+        checkpoint = run_backfill(fn, zulip_api)
+        assert checkpoint.is_complete()
+        # fewer requests than fetching all 180 missing messages again
+        assert zulip_api.num_requests < 180 / 7
+
+        message_table = read_snapshot(fn).message_table
+
+    assert ids(message_table.get_rows()) == list(range(1, 201))
+    assert ids(SentByFilter(10).get_rows(message_table)) == list(range(3, 201, 3))
+
+
+def test_backfill_stops_at_timestamp():
+    history = [
+        make_stream_message(id, sender_id=10, stream_id=5, topic="t")
+        for id in range(1, 201)
+    ]
+    with tempfile.TemporaryDirectory() as dir:
+        fn = os.path.join(dir, "database.snapshot")
+        database = Database.create_empty_database()
+        database.populate_messages(history[180:])
+        write_snapshot(database, fn)
+
+        stop_timestamp = history[150]["timestamp"]
+        checkpoint = run_backfill(
+            fn, FakeZulipApi(history), stop_timestamp=stop_timestamp
+        )
+        assert checkpoint.is_complete()
+        message_ids = ids(read_snapshot(fn).message_table.get_rows())
+
+    assert set(range(151, 201)) <= set(message_ids)
+    assert 1 not in message_ids
+
+
+def test_catch_up_database():
+    for columnar in [False, True]:
+        check_catch_up_database(make_database(columnar=columnar))
+
+
+def check_catch_up_database(database):
+    # While we had no event queue, 2 was deleted, 3 was edited, 1
+    # moved to another topic, and 12 sent 6.
+    moved = make_stream_message(1, sender_id=10, stream_id=5, topic="brunch")
+    edited = make_stream_message(3, sender_id=10, stream_id=5, topic="dinner")
+    edited["content"] = "<p>edited</p>"
+    history = [
+        moved,
+        edited,
+        make_direct_message(4, sender_id=10, user_ids=[10, 11]),
+        make_direct_message(5, sender_id=11, user_ids=[10, 11, 12]),
+        make_direct_message(6, sender_id=12, user_ids=[10, 12]),
+    ]
+    register_info = RegisterInfo(
+        queue_id="q",
+        last_event_id=-1,
+        realm_users=[
+            dict(user_id=id, full_name=f"user {id}", avatar_url="", delivery_email="")
+            for id in [10, 11, 12]
+        ],
+        streams=[dict(stream_id=5, name="food")],
+    )
+    events = []
+    asyncio.run(
+        catch_up_database(
+            FakeZulipApi(history), register_info, database, on_event=events.append
+        )
+    )
+
+    message_table = database.message_table
+    topic_table = database.topic_table
+    assert ids(message_table.get_rows()) == [1, 3, 4, 5, 6]
+    assert message_table.get_row(3).content == "<p>edited</p>"
+    lunch_id = topic_table.get_topic_id(5, "lunch")
+    brunch_id = topic_table.get_topic_id(5, "brunch")
+    assert ids(TopicFilter(topic_id=lunch_id).get_rows(message_table)) == []
+    assert ids(TopicFilter(topic_id=brunch_id).get_rows(message_table)) == [1]
+
+    # The listener hears about all of it at once.
+    assert events == [
+        dict(
+            type="catch_up",
+            new_message_ids=[6],
+            changed_message_ids=[1, 3],
+            deleted_message_ids=[2],
+            user_ids=[10, 11, 12],
+        )
+    ]
+
+
+def test_content_cache():
+    content_cache = ContentCache(max_size=2)
+    content_cache.put(1, "<p>one</p>", "one")
+    content_cache.put(2, "<p>two</p>", "two")
+    assert content_cache.get(1, "<p>one</p>") == "one"
+    # an edit changes the content, so the old text no longer matches
+    assert content_cache.get(1, "<p>edited</p>") is None
+    content_cache.put(3, "<p>three</p>", "three")
+    content_cache.put(4, "<p>four</p>", "four")  # evicts 2
+    assert content_cache.get(2, "<p>two</p>") is None
+    assert content_cache.get_stats() == dict(
+        size=2,
+        disk_size=0,
+        hits=1,
+        disk_hits=0,
+        misses=2,
+        invalidations=1,
+        evictions=1,
+    )
+
+
+def test_content_cache_on_disk():
+    with tempfile.TemporaryDirectory() as dir:
+        fn = os.path.join(dir, "content_cache.bin")
+        content_cache = ContentCache(max_size=1, fn=fn)
+        content_cache.put(1, "<p>one</p>", "one")
+        content_cache.put(2, "<p>two</p>", "two")
+        content_cache.put(2, "<p>edited</p>", "edited")
+        # 1 fell out of memory, but we still have it on disk
+        assert content_cache.get(1, "<p>one</p>") == "one"
+        assert content_cache.disk_hits == 1
+        content_cache.close()
+
+        # As if we died mid-write:
+        with open(fn, "ab") as f:
+            f.write(b"\x01\x02\x03")
+
+        content_cache = ContentCache(fn=fn)
+        assert content_cache.get(1, "<p>one</p>") == "one"
+        assert content_cache.get(2, "<p>two</p>") is None
+        assert content_cache.get(2, "<p>edited</p>") == "edited"
+        content_cache.put(3, "<p>three</p>", "three")
+        content_cache.close()
+
+        content_cache = ContentCache(fn=fn)
+        assert content_cache.get(3, "<p>three</p>") == "three"
+        content_cache.close()
+
+        # texts from another version of the parser don't count
+        content_cache = ContentCache(fn=fn, parser_version=PARSER_VERSION + 1)
+        assert content_cache.get(3, "<p>three</p>") is None
+        content_cache.put(4, "<p>four</p>", "four")
+        content_cache.close()
+        content_cache = ContentCache(fn=fn, parser_version=PARSER_VERSION + 1)
+        assert content_cache.get(4, "<p>four</p>") == "four"
+        content_cache.close()
+
+
+def test_service_paging():
+    for columnar in [False, True]:
+        asyncio.run(check_service_paging(make_database(columnar=columnar)))
+
+
+async def check_service_paging(database):
+    # Sender 10 has messages 1, 3, 4 and (after this) 8; there are no
+    # messages 6 or 7.
+    database.populate_messages(
+        [make_stream_message(8, sender_id=10, stream_id=5, topic="lunch")]
+    )
+    database.populate_streams([dict(stream_id=5, name="food")])
+    service = Service(database)
+    user = User(id=10, name="Ten", avatar_url="")
+
+    def window_ids(window):
+        return [m.id for m in window.hydrated_messages]
+
+    window = await service.get_messages_sent_by_user(user, num_before=2)
+    assert window_ids(window) == [4, 8]
+    assert not window.found_oldest and window.found_newest
+
+    older = await service.get_older_messages(window.older_cursor, 1)
+    assert window_ids(older) == [3]
+    assert not older.found_oldest
+    older = await service.get_older_messages(older.older_cursor, 5)
+    assert window_ids(older) == [1]
+    assert older.found_oldest
+
+    newer = await service.get_newer_messages(older.newer_cursor, 2)
+    assert window_ids(newer) == [3, 4]
+    assert not newer.found_newest
+
+    window = await service.get_messages_sent_by_user(
+        user, anchor=3, num_before=1, num_after=1
+    )
+    assert window_ids(window) == [1, 3, 4]
+    assert window.found_oldest and not window.found_newest
+
+    window = await service.get_messages_sent_by_user(
+        user, anchor="oldest", num_before=0, num_after=10
+    )
+    assert window_ids(window) == [1, 3, 4, 8]
+    assert window.found_oldest and window.found_newest
+
+    # An anchor that isn't in the narrow (2 was sent by 11) still
+    # places the window.
+    window = await service.get_messages_sent_by_user(
+        user, anchor=2, num_before=5, num_after=1
+    )
+    assert window_ids(window) == [1, 3]
+
+    # Missing anchors snap to the next message, or to the newest.
+    window = await service.get_messages_sent_by_user(
+        user, anchor=6, num_before=1, num_after=0
+    )
+    assert window_ids(window) == [4, 8]
+    window = await service.get_messages_sent_by_user(
+        user, anchor=99, num_before=1, num_after=3
+    )
+    assert window_ids(window) == [8]
+    assert window.found_newest
+
+    empty = await service.get_messages_sent_by_user(
+        User(id=99, name="Nobody", avatar_url="")
+    )
+    assert window_ids(empty) == []
+    assert empty.found_oldest and empty.found_newest
+
+
+test_indexes()
+test_index_update_on_reinsert()
+test_indexes_survive_json_round_trip()
+test_timestamp_order()
+test_columnar_json_round_trip()
+test_snapshot_round_trip()
+test_snapshot_append()
+test_snapshot_rewrite()
+test_event_applier()
+test_backfill_resumes()
+test_backfill_stops_at_timestamp()
+test_catch_up_database()
+test_content_cache()
+test_content_cache_on_disk()
+test_service_paging()
@@ -0,0 +1,305 @@
+import asyncio
+import json
+import sys
+import time
+from contextlib import asynccontextmanager
+
+sys.path.append("api")
+from aiohttp import web
+from event_info import EventInfo, EventMetrics
+from remote_users import RemoteUserFetcher
+from request_scheduler import Priority, RequestScheduler
+from user import User
+from user_cache import UserCache
+from zulip import EventQueueExpired, ZulipApi, ZulipApiError
+
+
+async def run_with_stub_server(responses, check):
+    # Serves GET /api/v1/messages from a list of (status, headers).
+    requests = []
+
+    async def handle_messages(request):
+        requests.append(time.monotonic())
+        status, headers = responses[min(len(requests), len(responses)) - 1]
+        body = dict(result="success" if status == 200 else "error", msg="")
+        return web.json_response(body, status=status, headers=headers)
+
+    app = web.Application()
+    app.router.add_get("/api/v1/messages", handle_messages)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        async with ZulipApi(f"http://127.0.0.1:{port}", "me", "key") as zulip_api:
+            await check(zulip_api, requests)
+    finally:
+        await runner.cleanup()
+
+
+def test_retry_after_429():
+    async def check(zulip_api, requests):
+        async with zulip_api.GET_json("messages", {}) as data:
+            assert data["result"] == "success"
+        assert len(requests) == 2
+        assert requests[1] - requests[0] >= 0.2
+
+    responses = [(429, {"Retry-After": "0.2"}), (200, {})]
+    asyncio.run(run_with_stub_server(responses, check))
+
+
+def test_retry_server_errors_but_not_client_errors():
+    async def check(zulip_api, requests):
+        async with zulip_api.GET_json("messages", {}) as data:
+            assert data["result"] == "success"
+        assert len(requests) == 2
+
+    asyncio.run(run_with_stub_server([(502, {}), (200, {})], check))
+
+    async def check_client_error(zulip_api, requests):
+        try:
+            async with zulip_api.GET_json("messages", {}):
+                assert False
+        except ZulipApiError:
+            pass
+        assert len(requests) == 1
+
+    asyncio.run(run_with_stub_server([(400, {})], check_client_error))
+
+
+def test_waits_for_rate_limit_reset():
+    async def check(zulip_api, requests):
+        for _ in range(2):
+            async with zulip_api.GET_json("messages", {}):
+                pass
+        assert requests[1] - requests[0] >= 0.5
+
+    reset = str(time.time() + 1.0)
+    headers = {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": reset}
+    asyncio.run(run_with_stub_server([(200, headers), (200, {})], check))
+
+
+def test_interactive_beats_backfill():
+    async def run():
+        scheduler = RequestScheduler(max_in_flight=1)
+        order = []
+
+        async def request(name, priority):
+            async with scheduler.slot(priority):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        await scheduler.acquire(Priority.INTERACTIVE)
+        tasks = [
+            asyncio.create_task(request("backfill 1", Priority.BACKFILL)),
+            asyncio.create_task(request("backfill 2", Priority.BACKFILL)),
+            asyncio.create_task(request("interactive", Priority.INTERACTIVE)),
+        ]
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        assert order == ["interactive", "backfill 1", "backfill 2"]
+        assert scheduler.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_backfill_leaves_budget_for_interactive():
+    async def run():
+        scheduler = RequestScheduler(max_in_flight=10)
+        scheduler.remaining = 3
+        scheduler.reset_at = time.monotonic() + 60
+
+        assert scheduler.get_delay(Priority.BACKFILL) > 0
+        assert scheduler.get_delay(Priority.INTERACTIVE) == 0
+        await asyncio.wait_for(scheduler.acquire(Priority.INTERACTIVE), 1)
+        assert scheduler.remaining == 2
+
+    asyncio.run(run())
+
+
+class StopProcessing(Exception):
+    pass
+
+
+def run_event_pipeline(*, queue_size, num_events):
+    # Each poll returns a batch of 10 events, following last_event_id.
+    # We note how many events had been applied when each poll arrived.
+    applied = []
+    applied_when_polled = []
+
+    async def handle_events(request):
+        applied_when_polled.append(len(applied))
+        last_event_id = int(request.query["last_event_id"])
+        events = [dict(id=last_event_id + i, type="heartbeat") for i in range(1, 11)]
+        return web.json_response(dict(result="success", events=events))
+
+    def callback(event):
+        applied.append(event["id"])
+        time.sleep(0.001)
+        if len(applied) == num_events:
+            raise StopProcessing
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/api/v1/events", handle_events)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            async with ZulipApi(f"http://127.0.0.1:{port}", "me", "key") as zulip_api:
+                await zulip_api.process_events(
+                    event_info=event_info,
+                    callback=callback,
+                    metrics=metrics,
+                    queue_size=queue_size,
+                )
+        except StopProcessing:
+            pass
+        finally:
+            await runner.cleanup()
+
+    event_info = EventInfo(queue_id="q", last_event_id=-1)
+    metrics = EventMetrics()
+    asyncio.run(run())
+    assert applied == list(range(num_events))
+    return event_info, metrics, applied_when_polled
+
+
+def test_event_pipeline():
+    event_info, metrics, applied_when_polled = run_event_pipeline(
+        queue_size=100, num_events=30
+    )
+    # The second poll went out while we were still applying the first batch.
+    assert applied_when_polled[1] < 10
+    assert metrics.num_received >= metrics.num_applied == 29
+    # Event 29 raised, so it never counted as applied.
+    assert event_info.last_event_id == 28
+
+
+def test_event_pipeline_backpressure():
+    _, metrics, applied_when_polled = run_event_pipeline(queue_size=4, num_events=30)
+    assert metrics.max_queue_depth <= 4
+    assert metrics.blocked_time > 0
+    # We only poll again once the queue has room for the previous batch.
+    assert applied_when_polled[1] >= 10 - 4
+
+
+def test_event_queue_expiry():
+    # a batch, a dropped poll, another batch, then the queue expires
+    polls = []
+
+    async def handle_events(request):
+        polls.append(request.query["last_event_id"])
+        last_event_id = int(request.query["last_event_id"])
+        if len(polls) == 2:
+            return web.Response(status=502)
+        if len(polls) == 4:
+            body = dict(result="error", code="BAD_EVENT_QUEUE_ID", msg="expired")
+            return web.json_response(body, status=400)
+        events = [dict(id=last_event_id + i, type="heartbeat") for i in range(1, 11)]
+        return web.json_response(dict(result="success", events=events))
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/api/v1/events", handle_events)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        applied = []
+        try:
+            async with ZulipApi(f"http://127.0.0.1:{port}", "me", "key") as zulip_api:
+                await zulip_api.process_events(
+                    event_info=EventInfo(queue_id="q", last_event_id=-1),
+                    callback=lambda event: applied.append(event["id"]),
+                )
+            assert False
+        except EventQueueExpired:
+            pass
+        finally:
+            await runner.cleanup()
+        return applied
+
+    applied = asyncio.run(run())
+    assert polls == ["-1", "9", "9", "19"]
+    # everything we received got applied before we gave up on the queue
+    assert applied == list(range(20))
+
+
+class FakeUsersApi:
+    def __init__(self, known_user_ids):
+        self.known_user_ids = known_user_ids
+        self.requested = []
+
+    @asynccontextmanager
+    async def GET_json(self, url_ending, params):
+        assert url_ending == "users"
+        user_ids = json.loads(params["user_ids"])
+        self.requested.append(user_ids)
+        await asyncio.sleep(0.01)
+        members = [
+            dict(user_id=id, full_name=f"user {id}", avatar_url=f"/avatar/{id}")
+            for id in user_ids
+            if id in self.known_user_ids
+        ]
+        yield dict(result="success", members=members)
+
+
+def test_remote_users_are_batched_and_deduplicated():
+    async def run():
+        zulip_api = FakeUsersApi({1, 2, 3})
+        user_cache = UserCache()
+        fetcher = RemoteUserFetcher(
+            zulip_api=zulip_api, host="https://example.com", user_cache=user_cache
+        )
+        first, second = await asyncio.gather(
+            fetcher.get_users({1, 2}), fetcher.get_users({2, 3, 4})
+        )
+        assert zulip_api.requested == [[1, 2], [3, 4]]
+        assert first[2] is second[2]
+        assert second[3].avatar_url == "https://example.com/avatar/3"
+        assert second[4].name == "Unknown user 4"
+
+        assert user_cache.get(3).name == "user 3"
+        assert user_cache.get(4).name == "Unknown user 4"
+        assert fetcher.in_flight == {}
+
+    asyncio.run(run())
+
+
+def test_user_cache_ttl_and_lru():
+    now = 0.0
+    user_cache = UserCache(max_size=2, ttl=10, clock=lambda: now)
+
+    def make_user(id):
+        return User(id=id, name=f"user {id}", avatar_url="")
+
+    user_cache.put(make_user(1))
+    user_cache.put(make_user(2))
+    assert user_cache.get(1).id == 1
+    user_cache.put(make_user(3))  # evicts 2, the least recently used
+    assert user_cache.get(2) is None
+    assert user_cache.get(3).id == 3
+
+    now = 10.0
+    assert user_cache.get(1) is None
+    assert user_cache.get_stats() == dict(
+        size=1, hits=2, misses=2, expirations=1, evictions=1, hit_rate=0.5
+    )
+
+
+test_retry_after_429()
+test_retry_server_errors_but_not_client_errors()
+test_waits_for_rate_limit_reset()
+test_interactive_beats_backfill()
+test_backfill_leaves_budget_for_interactive()
+test_event_pipeline()
+test_event_pipeline_backpressure()
+test_event_queue_expiry()
+test_remote_users_are_batched_and_deduplicated()
+test_user_cache_ttl_and_lru()
@@ -1,3 +1,5 @@
+import bisect
+
 import flet as ft
 from buddy_list_row import BuddyListRow
 
@@ -12,13 +14,46 @@ class BuddyList:
             expand=True,
         )
         self.controller = controller
+        # sort_keys[i] is the sort key of list_view.controls[i]
+        self.sort_keys = []
+        # user_id -> sort key, so we can bisect for a user's row
+        self.sort_key_dict = {}
 
     def populate(self, service):
-        items = []
         users = service.get_sorted_local_users()
-        for user in users:
-            row = BuddyListRow(user, controller=self.controller)
-            items.append(row.control)
-
-        self.list_view.controls = items
+        self.sort_keys = [self.get_sort_key(service, user) for user in users]
+        self.sort_key_dict = {sort_key[-1]: sort_key for sort_key in self.sort_keys}
+        self.list_view.controls = [self.make_row(user) for user in users]
         self.list_view.update()
+
+    def apply_updates(self, pending, service):
+        controls = self.list_view.controls
+        for user_id in pending.changed_user_ids:
+            user = service.database.user_table.maybe_get_row(user_id)
+            if user is None:
+                continue
+            # A rename can move the user, so drop the old row (if any)
+            # and insert the new one in sorted order.
+            i = self.find_user(user_id)
+            if i is not None:
+                del self.sort_keys[i]
+                del controls[i]
+            sort_key = self.get_sort_key(service, user)
+            i = bisect.bisect_right(self.sort_keys, sort_key)
+            self.sort_keys.insert(i, sort_key)
+            self.sort_key_dict[user_id] = sort_key
+            controls.insert(i, self.make_row(user))
+
+    def find_user(self, user_id):
+        sort_key = self.sort_key_dict.get(user_id)
+        if sort_key is None:
+            return None
+        return bisect.bisect_left(self.sort_keys, sort_key)
+
+    def get_sort_key(self, service, user):
+        # matches service.get_sorted_local_users, plus the id
+        return (user.id != service.database.current_user_id, user.name, user.id)
+
+    def make_row(self, user):
+        row = BuddyListRow(user, controller=self.controller)
+        return row.control
@@ -0,0 +1,88 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from api.message_parser import get_zulip_contents
+
+"""
+Parsing message content (lxml, then our ZulipContent tree) can take
+a while for big messages: KaTeX, long code blocks, tables.  Doing it
+on the asyncio loop that flet drives would stall input handling, so
+ContentParser does it on worker threads instead, a batch of messages
+at a time.
+
+Before a batch goes to the workers, we look each message up in the
+Service's ContentCache (see api/content_cache.py), and only parse
+the misses.  Whatever we parse goes back into the cache, except for
+failures: get_texts hands those back as (None, error), so that the
+next parser version (or a retry) gets another go at them.
+
+Each batch belongs to a generation.  When the user navigates away,
+MessageList calls cancel(), which starts a new generation: workers
+stop parsing stale batches between messages, and get_texts returns
+None for them, so their results never reach the screen.
+"""
+
+NUM_WORKERS = 2
+# how many messages we parse between checks for staleness
+CHUNK_SIZE = 10
+# Tests check that every message round trips back to its HTML; here
+# we only spot check.
+ROUND_TRIP_SAMPLE_RATE = 0.01
+
+
+def get_texts(contents, is_stale):
+    # a (text, error) pair for each message, one of them None
+    texts = []
+    for i in range(0, len(contents), CHUNK_SIZE):
+        if is_stale():
+            return None
+        parsed_messages = get_zulip_contents(
+            contents[i : i + CHUNK_SIZE], sample_rate=ROUND_TRIP_SAMPLE_RATE
+        )
+        for parsed_message in parsed_messages:
+            if parsed_message.error is None:
+                texts.append((parsed_message.zulip_content.as_text(), None))
+            else:
+                texts.append((None, parsed_message.error))
+    return texts
+
+
+class ContentParser:
+    def __init__(self, *, content_cache, num_workers=NUM_WORKERS):
+        self.content_cache = content_cache
+        self.executor = ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix="content-parser"
+        )
+        self.generation = 0
+
+    def cancel(self):
+        self.generation += 1
+
+    async def get_texts(self, messages):
+        content_cache = self.content_cache
+        texts = [content_cache.get(m.id, m.content) for m in messages]
+        misses = [m for m, text in zip(messages, texts) if text is None]
+        if not misses:
+            return [(text, None) for text in texts]
+
+        generation = self.generation
+
+        def is_stale():
+            return self.generation != generation
+
+        loop = asyncio.get_running_loop()
+        new_texts = await loop.run_in_executor(
+            self.executor, get_texts, [m.content for m in misses], is_stale
+        )
+        if is_stale():
+            return None
+
+        for message, (text, error) in zip(misses, new_texts):
+            if error is None:
+                content_cache.put(message.id, message.content, text)
+        content_cache.flush()
+
+        new_text_iter = iter(new_texts)
+        return [
+            (text, None) if text is not None else next(new_text_iter) for text in texts
+        ]
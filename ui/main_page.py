@@ -1,5 +1,6 @@
 import flet as ft
 from three_pane import ThreePane
+from update_scheduler import UpdateScheduler
 
 import api.service as api
 from api.config import HOST
@@ -27,3 +28,6 @@ async def main(page: ft.Page):
     page.controls = [three_pane.control]
     page.update()
     await three_pane.populate()
+
+    update_scheduler = UpdateScheduler(page=page, controller=three_pane)
+    page.run_task(service.process_events, update_scheduler.add_event)
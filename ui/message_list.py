@@ -1,10 +1,43 @@
+import asyncio
+import bisect
+
 import flet as ft
 from message_row import MessageRow
 
+"""
+MessageList only builds MessageRows for the messages that are on
+screen, plus OVERSCAN rows on either side.  Spacers above and below
+those rows stand in for everything else (at ROW_HEIGHT per message),
+so the scrollbar still reflects the whole narrow.  Opening a huge
+narrow costs about as much as opening a small one.
+
+As the user scrolls, we slide the rendered slice along, reusing rows
+that scrolled out of view (see MessageRow.populate) rather than
+building new ones.  We only move the slice once the visible messages
+get close to its edge, so most scroll events do nothing.
+
+Flet doesn't tell us how tall each row really is, so ROW_HEIGHT is
+an estimate, and the spacers are only approximately right.
+
+Freshly populated rows show a placeholder; we parse their content on
+the ContentParser's worker threads and fill it in with one update()
+per batch.
+"""
+
+ROW_HEIGHT = 70
+OVERSCAN = 15
+INITIAL_ROWS = 30
+
+
+def get_key(hydrated_message):
+    # the (timestamp, id) order that the Service hands messages back in
+    return (hydrated_message.timestamp, hydrated_message.id)
+
 
 class MessageList:
-    def __init__(self, *, controller, width):
+    def __init__(self, *, controller, content_parser, width):
         self.list_view = ft.ListView([])
+        self.list_view.on_scroll = self.on_scroll
 
         self.control = ft.Container(
             self.list_view,
@@ -15,20 +48,218 @@ class MessageList:
         )
 
         self.controller = controller
+        self.content_parser = content_parser
         self.width = width
+        self.message_list_config = None
+        self.older_cursor = None
+        self.narrow = None
+        self.found_newest = False
+
+        # all the messages in the narrow that we've loaded, oldest
+        # first, and the slice [first, last) of them that has rows
+        self.messages = []
+        self.first = 0
+        self.last = 0
+        self.rows_by_id = {}
+        self.free_rows = []
+        self.parse_tasks = set()
+
+        self.top_spacer = ft.Container(height=0)
+        self.bottom_spacer = ft.Container(height=0)
 
-    def populate_messages(self, hydrated_messages, message_list_config):
+        self.load_older_button = ft.TextButton("Load older messages")
+
+        async def on_click(_):
+            await controller.populate_older_messages(self.older_cursor)
+
+        self.load_older_button.on_click = on_click
+
+    def populate_messages(self, message_window, message_list_config):
+        self.message_list_config = message_list_config
         self.list_view.controls = []
         self.list_view.update()
 
-        items = []
+        # Whatever we were parsing for the last narrow is moot now.
+        self.content_parser.cancel()
+
+        self.narrow = message_window.newer_cursor.narrow
+        self.found_newest = message_window.found_newest
+        # The config can change how rows look, so we can't recycle
+        # rows from the last narrow.
+        self.rows_by_id = {}
+        self.free_rows = []
+
+        self.messages = list(message_window.hydrated_messages)
+        self.set_older_cursor(message_window)
+        self.render(0, INITIAL_ROWS)
+        self.list_view.update()
+
+    def prepend_messages(self, message_window):
+        # The user is at the top (they just clicked the button), so
+        # show the messages we just loaded.
+        self.messages = message_window.hydrated_messages + self.messages
+        self.set_older_cursor(message_window)
+        self.render(0, INITIAL_ROWS)
+        self.list_view.update()
+
+    def set_older_cursor(self, message_window):
+        if message_window.found_oldest:
+            self.older_cursor = None
+        else:
+            self.older_cursor = message_window.older_cursor
 
-        for message in hydrated_messages:
-            row = MessageRow(
-                controller=self.controller, message_list_config=message_list_config
-            )
-            row.populate(message, width=self.width - 100)
+    def header_items(self):
+        if self.older_cursor is None:
+            return []
+        return [self.load_older_button]
+
+    async def on_scroll(self, e):
+        top = len(self.header_items()) * ROW_HEIGHT
+        first_visible = max(0, int((e.pixels - top) // ROW_HEIGHT))
+        last_visible = first_visible + int(e.viewport_dimension // ROW_HEIGHT) + 1
+        last_visible = min(last_visible, len(self.messages))
+        if self.first <= first_visible and last_visible <= self.last:
+            return
+        self.render(first_visible - OVERSCAN, last_visible + OVERSCAN)
+        self.list_view.update()
+
+    def render(self, first, last):
+        self.first = max(0, first)
+        self.last = max(self.first, min(last, len(self.messages)))
+        visible_messages = self.messages[self.first : self.last]
+
+        # Free up the rows whose messages scrolled out of the slice.
+        visible_ids = {m.id for m in visible_messages}
+        for message_id in list(self.rows_by_id):
+            if message_id not in visible_ids:
+                self.free_rows.append(self.rows_by_id.pop(message_id))
+
+        items = []
+        unparsed_rows = []
+        for message in visible_messages:
+            row = self.rows_by_id.get(message.id)
+            if row is None:
+                row = self.free_rows.pop() if self.free_rows else self.make_row()
+                self.rows_by_id[message.id] = row
+            if row.hydrated_message is not message:
+                row.populate(message)
+                unparsed_rows.append(row)
             items.append(row.control)
 
-        self.list_view.controls = items
+        self.top_spacer.height = self.first * ROW_HEIGHT
+        self.bottom_spacer.height = (len(self.messages) - self.last) * ROW_HEIGHT
+        self.list_view.controls = [
+            *self.header_items(),
+            self.top_spacer,
+            *items,
+            self.bottom_spacer,
+        ]
+
+        if unparsed_rows:
+            task = asyncio.create_task(self.parse_content(unparsed_rows))
+            self.parse_tasks.add(task)
+            task.add_done_callback(self.parse_tasks.discard)
+
+    async def parse_content(self, rows):
+        messages = [row.hydrated_message for row in rows]
+        texts = await self.content_parser.get_texts(messages)
+        if texts is None:
+            # The user navigated away.
+            return
+        for row, message, (text, error) in zip(rows, messages, texts):
+            # Skip rows that got recycled for another message meanwhile.
+            if row.hydrated_message is not message:
+                continue
+            if error is None:
+                row.set_text(text)
+            else:
+                row.set_error(error)
         self.list_view.update()
+
+    async def apply_updates(self, pending, service):
+        # Patch our messages for one frame's worth of events, and
+        # re-render the slice.  We leave the update() to the
+        # UpdateScheduler.
+        narrow = self.narrow
+        if narrow is None:
+            return
+        message_table = service.database.message_table
+        loaded_ids = {m.id for m in self.messages}
+
+        gone_ids = {id for id in pending.deleted_message_ids if id in loaded_ids}
+        changed_ids = []
+        new_ids = set()
+        for message_id in pending.changed_message_ids:
+            message = message_table.maybe_get_row(message_id)
+            if message_id in loaded_ids:
+                if message is None or not narrow.matches(message):
+                    gone_ids.add(message_id)
+                else:
+                    changed_ids.append(message_id)
+            elif (
+                message is not None
+                and narrow.matches(message)
+                and self.is_in_loaded_range(message.key())
+            ):
+                # e.g. a message that got moved into our topic
+                new_ids.add(message_id)
+
+        for message_id in pending.new_message_ids:
+            message = message_table.maybe_get_row(message_id)
+            if (
+                message is not None
+                and message_id not in loaded_ids
+                and narrow.matches(message)
+                and self.is_in_loaded_range(message.key())
+            ):
+                new_ids.add(message_id)
+
+        if not (gone_ids or changed_ids or new_ids):
+            return
+
+        changed_messages = await service.get_hydrated_messages_for_ids(changed_ids)
+        new_messages = await service.get_hydrated_messages_for_ids(sorted(new_ids))
+        if self.narrow is not narrow:
+            # The user went somewhere else while we were hydrating.
+            return
+
+        # Keep the slice on the same messages, unless it reaches the
+        # bottom, in which case we grow it to take in the new messages
+        # there.
+        at_bottom = self.last == len(self.messages)
+        num_rendered = self.last - self.first
+        first_key = get_key(self.messages[self.first]) if num_rendered else None
+
+        changed_dict = {m.id: m for m in changed_messages}
+        messages = [
+            changed_dict.get(m.id, m) for m in self.messages if m.id not in gone_ids
+        ]
+        for message in new_messages:
+            bisect.insort(messages, message, key=get_key)
+        self.messages = messages
+
+        if first_key is None:
+            first = self.first
+        else:
+            first = bisect.bisect_left(messages, first_key, key=get_key)
+        last = len(messages) if at_bottom else first + num_rendered
+        self.render(first, last)
+
+    def is_in_loaded_range(self, key):
+        # Messages above or below what we have loaded will show up
+        # when the user loads or scrolls that far.
+        messages = self.messages
+        if self.older_cursor is not None:
+            if not messages or key < get_key(messages[0]):
+                return False
+        if not self.found_newest:
+            if not messages or key > get_key(messages[-1]):
+                return False
+        return True
+
+    def make_row(self):
+        return MessageRow(
+            controller=self.controller,
+            message_list_config=self.message_list_config,
+            width=self.width - 100,
+        )
@@ -4,15 +4,17 @@ from message_pane_header import MessagePaneHeader
 
 
 class MessagePane:
-    def __init__(self, *, controller, width):
-        self.message_list = MessageList(controller=controller, width=width)
+    def __init__(self, *, controller, content_parser, width):
+        self.message_list = MessageList(
+            controller=controller, content_parser=content_parser, width=width
+        )
         self.header = MessagePaneHeader(controller=controller)
         self.control = ft.Column()
         self.control.controls = [self.header.control, self.message_list.control]
 
-    def populate_messages(self, *, message_list_config, hydrated_messages):
+    def populate_messages(self, *, message_list_config, message_window):
         sender_dict = dict()
-        for m in hydrated_messages:
+        for m in message_window.hydrated_messages:
             sender = m.deferred_sender.full_object()
             sender_dict[sender.id] = sender
 
@@ -20,6 +22,12 @@ class MessagePane:
         self.header.populate(
             message_list_config=message_list_config, participants=participants
         )
-        self.message_list.populate_messages(hydrated_messages, message_list_config)
+        self.message_list.populate_messages(message_window, message_list_config)
         self.control.controls = [self.header.control, self.message_list.control]
         self.control.update()
+
+    def prepend_messages(self, message_window):
+        self.message_list.prepend_messages(message_window)
+
+    async def apply_updates(self, pending, service):
+        await self.message_list.apply_updates(pending, service)
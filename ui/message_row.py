@@ -1,42 +1,33 @@
 import flet as ft
 from address_link import AddressLink
 
-from api.message_parser import get_zulip_content
+PLACEHOLDER = "\u2026"
 
 
 class MessageRow:
-    def __init__(self, *, controller, message_list_config):
+    # A MessageRow builds its controls once; MessageList recycles
+    # rows by calling populate() again with another message.  The
+    # text shows a placeholder until MessageList hands us the parsed
+    # content (see content_parser.py).
+    def __init__(self, *, controller, message_list_config, width):
         self.controller = controller
         self.message_list_config = message_list_config
+        self.hydrated_message = None
 
-    def populate(self, hydrated_message, *, width):
-        sender = hydrated_message.deferred_sender.full_object()
-        address_link = AddressLink(hydrated_message, self.controller)
-
-        if self.message_list_config.show_sender:
-            info = ft.Text(sender.name, size=14, weight=ft.FontWeight.BOLD)
-        else:
-            info = address_link.control
-
-        content = get_zulip_content(hydrated_message.content).as_text()
+        self.avatar = ft.Image(src="", height=30)
+        self.info_row = ft.Row(controls=[])
+        self.text = ft.Text(
+            "",
+            selectable=True,
+            expand=True,
+            width=width,
+            # auto_follow_links=True,
+        )
 
         item = ft.Row(
             controls=[
-                ft.Image(src=sender.avatar_url, tooltip=sender.name, height=30),
-                ft.Column(
-                    controls=[
-                        ft.Row(
-                            controls=[info],
-                        ),
-                        ft.Text(
-                            content,
-                            selectable=True,
-                            expand=True,
-                            width=width,
-                            # auto_follow_links=True,
-                        ),
-                    ]
-                ),
+                self.avatar,
+                ft.Column(controls=[self.info_row, self.text]),
             ],
             vertical_alignment=ft.CrossAxisAlignment.START,
             expand=True,
@@ -48,3 +39,26 @@ class MessageRow:
             padding=7,
             expand=True,
         )
+
+    def populate(self, hydrated_message):
+        self.hydrated_message = hydrated_message
+        sender = hydrated_message.deferred_sender.full_object()
+
+        if self.message_list_config.show_sender:
+            info = ft.Text(sender.name, size=14, weight=ft.FontWeight.BOLD)
+        else:
+            info = AddressLink(hydrated_message, self.controller).control
+
+        self.avatar.src = sender.avatar_url
+        self.avatar.tooltip = sender.name
+        self.info_row.controls = [info]
+        self.text.value = PLACEHOLDER
+        self.text.color = ft.Colors.GREY
+
+    def set_text(self, text):
+        self.text.value = text
+        self.text.color = None
+
+    def set_error(self, error):
+        self.text.value = f"(could not parse message: {error})"
+        self.text.color = ft.Colors.RED
@@ -1,5 +1,6 @@
 import flet as ft
 from buddy_list import BuddyList
+from content_parser import ContentParser
 from message_list_config import MessageListConfig
 from message_pane import MessagePane
 from topic_list import TopicList
@@ -8,8 +9,11 @@ from topic_list import TopicList
 class ThreePane:
     def __init__(self, service):
         self.service = service
+        self.content_parser = ContentParser(content_cache=service.content_cache)
         self.topic_list = TopicList(controller=self, width=330)
-        self.message_pane = MessagePane(controller=self, width=550)
+        self.message_pane = MessagePane(
+            controller=self, content_parser=self.content_parser, width=550
+        )
         self.buddy_list = BuddyList(controller=self, width=150)
 
         self.control = ft.Row(
@@ -29,33 +33,39 @@ class ThreePane:
         self.buddy_list.populate(self.service)
         self.topic_list.populate(self.service)
 
+    async def apply_updates(self, pending):
+        # called by the UpdateScheduler once per frame
+        self.buddy_list.apply_updates(pending, self.service)
+        self.topic_list.apply_updates(pending, self.service)
+        await self.message_pane.apply_updates(pending, self.service)
+
     async def populate_sent_by(self, user):
-        messages = await self.service.get_messages_sent_by_user(user)
+        message_window = await self.service.get_messages_sent_by_user(user)
         message_list_config = MessageListConfig(
             label=f"sent by {user.name}", show_sender=False
         )
         self.message_pane.populate_messages(
-            message_list_config=message_list_config, hydrated_messages=messages
+            message_list_config=message_list_config, message_window=message_window
         )
 
     async def populate_for_direct_message(self, user):
-        messages = await self.service.get_direct_messages_for_user(user)
+        message_window = await self.service.get_direct_messages_for_user(user)
         label = f"DMs with {user.name}"
         message_list_config = MessageListConfig(label=label, show_sender=True)
         self.message_pane.populate_messages(
-            message_list_config=message_list_config, hydrated_messages=messages
+            message_list_config=message_list_config, message_window=message_window
         )
 
     async def populate_for_topic(self, topic):
-        messages = await self.service.get_messages_for_topic(topic)
+        message_window = await self.service.get_messages_for_topic(topic)
         label = topic.label(stream_table=self.service.database.stream_table)
         message_list_config = MessageListConfig(label=label, show_sender=True)
         self.message_pane.populate_messages(
-            message_list_config=message_list_config, hydrated_messages=messages
+            message_list_config=message_list_config, message_window=message_window
         )
 
     async def populate_for_address(self, address):
-        messages = await self.service.get_messages_for_address(address)
+        message_window = await self.service.get_messages_for_address(address)
         label = address.name(
             stream_table=self.service.database.stream_table,
             topic_table=self.service.database.topic_table,
@@ -63,5 +73,9 @@ class ThreePane:
         )
         message_list_config = MessageListConfig(label=label, show_sender=True)
         self.message_pane.populate_messages(
-            message_list_config=message_list_config, hydrated_messages=messages
+            message_list_config=message_list_config, message_window=message_window
         )
+
+    async def populate_older_messages(self, cursor):
+        message_window = await self.service.get_older_messages(cursor)
+        self.message_pane.prepend_messages(message_window)
@@ -1,3 +1,5 @@
+import bisect
+
 import flet as ft
 from topic_list_row import TopicListRow
 
@@ -13,18 +15,47 @@ class TopicList:
         )
         self.controller = controller
         self.width = width
+        # labels[i] is the label of list_view.controls[i]
+        self.labels = []
+        self.max_topic_id = 0
 
     def populate(self, service):
-        items = []
-        topics = service.get_sorted_topics()
-        for topic in topics:
-            row = TopicListRow(
-                topic,
-                controller=self.controller,
-                stream_table=service.database.stream_table,
-                width=self.width - 30,
-            )
-            items.append(row.control)
-
-        self.list_view.controls = items
+        self.rebuild(service)
         self.list_view.update()
+
+    def rebuild(self, service):
+        stream_table = service.database.stream_table
+        topics = service.get_sorted_topics()
+        self.labels = [topic.label(stream_table=stream_table) for topic in topics]
+        self.list_view.controls = [self.make_row(service, topic) for topic in topics]
+        self.max_topic_id = service.database.topic_table.id_seq
+
+    def apply_updates(self, pending, service):
+        if pending.streams_changed:
+            # A rename can reorder everything, but it's rare.
+            self.rebuild(service)
+            return
+        if not pending.topics_changed:
+            return
+
+        # Topic ids are handed out in order, so the new topics are
+        # exactly the ones past max_topic_id.
+        topic_table = service.database.topic_table
+        stream_table = service.database.stream_table
+        controls = self.list_view.controls
+        for topic_id in range(self.max_topic_id + 1, topic_table.id_seq + 1):
+            topic = topic_table.get_topic(topic_id)
+            label = topic.label(stream_table=stream_table)
+            i = bisect.bisect_right(self.labels, label)
+            self.labels.insert(i, label)
+            controls.insert(i, self.make_row(service, topic))
+        self.max_topic_id = topic_table.id_seq
+
+    def make_row(self, service, topic):
+        row = TopicListRow(
+            topic,
+            controller=self.controller,
+            stream_table=service.database.stream_table,
+            width=self.width - 30,
+        )
+        return row.control
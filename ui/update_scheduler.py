@@ -0,0 +1,103 @@
+import asyncio
+from dataclasses import dataclass, field
+
+"""
+Events from the server arrive one at a time, sometimes hundreds per
+second (think of a busy realm, or catching up after a reconnect).
+Redrawing a pane per event would swamp the page, so UpdateScheduler
+collects them into a PendingUpdates for one frame (FRAME_SECONDS),
+and then asks the controller to patch only the affected rows,
+followed by a single page.update().
+
+The Database has already applied each event by the time we hear
+about it (see data_layer.process_events), so PendingUpdates only
+needs ids: the panes look up the current rows when they flush.
+
+While a flush is running (hydrating new messages can wait on the
+server for unknown senders), new events pile up for the next frame,
+so frames never overlap and always apply in order.
+"""
+
+FRAME_SECONDS = 0.05
+
+
+@dataclass
+class PendingUpdates:
+    new_message_ids: list[int] = field(default_factory=list)
+    changed_message_ids: set[int] = field(default_factory=set)
+    deleted_message_ids: set[int] = field(default_factory=set)
+    changed_user_ids: set[int] = field(default_factory=set)
+    topics_changed: bool = False
+    streams_changed: bool = False
+
+    def add(self, event):
+        event_type = event["type"]
+
+        if event_type == "message":
+            message = event["message"]
+            self.new_message_ids.append(message["id"])
+            if message["type"] == "stream":
+                self.topics_changed = True
+        elif event_type == "update_message":
+            message_ids = event.get("message_ids", [event["message_id"]])
+            self.changed_message_ids.update(message_ids)
+            if "subject" in event or "new_stream_id" in event:
+                self.topics_changed = True
+        elif event_type == "delete_message":
+            message_ids = event.get("message_ids", [event.get("message_id")])
+            self.deleted_message_ids.update(message_ids)
+        elif event_type == "realm_user":
+            self.changed_user_ids.add(event["person"]["user_id"])
+        elif event_type == "stream":
+            self.streams_changed = True
+        elif event_type == "catch_up":
+            # everything we missed while we had no event queue (see
+            # data_layer.CatchUp)
+            self.new_message_ids.extend(event["new_message_ids"])
+            self.changed_message_ids.update(event["changed_message_ids"])
+            self.deleted_message_ids.update(event["deleted_message_ids"])
+            self.changed_user_ids.update(event["user_ids"])
+            self.topics_changed = True
+            self.streams_changed = True
+
+    def is_empty(self):
+        return not (
+            self.new_message_ids
+            or self.changed_message_ids
+            or self.deleted_message_ids
+            or self.changed_user_ids
+            or self.topics_changed
+            or self.streams_changed
+        )
+
+
+class UpdateScheduler:
+    def __init__(self, *, page, controller):
+        self.page = page
+        self.controller = controller
+        self.pending = PendingUpdates()
+        self.flush_scheduled = False
+        self.num_events = 0
+        self.num_frames = 0
+
+    def add_event(self, event):
+        self.pending.add(event)
+        self.num_events += 1
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.page.run_task(self.flush_frames)
+
+    async def flush_frames(self):
+        try:
+            while True:
+                await asyncio.sleep(FRAME_SECONDS)
+                pending = self.pending
+                self.pending = PendingUpdates()
+                if not pending.is_empty():
+                    await self.controller.apply_updates(pending)
+                    self.page.update()
+                    self.num_frames += 1
+                if self.pending.is_empty():
+                    return
+        finally:
+            self.flush_scheduled = False